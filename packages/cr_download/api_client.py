@@ -0,0 +1,208 @@
+"""api_client.py: a shared client for the JSON web APIs used to find
+streams (the YouTube Data API and the Twitch API).
+
+Every request goes through a single keep-alive connection pool, with
+a timeout, and is retried with exponential backoff when the server
+is rate limiting (429) or failing (5xx). Response bodies are parsed
+once, and the client keeps track of how many requests it made to each
+host and how long they took. Responses which rarely change can be
+kept in a persistent ResponseCache.
+
+"""
+
+from collections import namedtuple
+import threading
+import time
+from urllib.parse import urlparse
+
+from cr_download.configuration import data as config
+from cr_download.transfer import make_session
+from cr_download import response_cache
+
+#seconds to wait before the first retry (doubled for each one after)
+BACKOFF_BASE = 1.0
+
+#longest we'll wait before a retry, even if the server asks for more
+MAX_BACKOFF = 60.0
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+#a parsed response: data is the decoded JSON body (None for a 304 Not
+#Modified response)
+APIResponse = namedtuple("APIResponse", ["status_code", "headers", "data", "url"])
+
+class APIError(Exception):
+    """exception thrown when an API request fails, even after retrying
+    """
+
+class HostStats:
+    """request counts and latency for a single host
+    """
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def mean_latency(self):
+        if self.requests == 0:
+            return 0.0
+        return self.total_latency / self.requests
+
+def retry_delay(response, attempt):
+    """get how long to wait before retrying a failed request: the time
+    asked for in the response's Retry-After header, or exponential
+    backoff for the given (0-based) attempt
+
+    """
+    delay = BACKOFF_BASE * 2 ** attempt
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            delay = float(retry_after)
+    return min(delay, MAX_BACKOFF)
+
+class APIClient:
+    """make GET requests to JSON APIs over a pooled session.
+
+    headers are sent with every request. Requests time out after
+    timeout seconds, and are attempted up to max_retries more times
+    (by default, the api_timeout and api_retries config options).
+
+    if a ResponseCache is given, responses from endpoints with a time
+    to live in the api_cache_ttl config option can be cached.
+
+    """
+    def __init__(self, headers=None, timeout=None, max_retries=None,
+                 session=None, cache=None):
+        self.headers = dict(headers or {})
+        self.cache = cache
+        self.timeout = timeout or config.api_timeout
+        self.max_retries = (config.api_retries if max_retries is None
+                            else max_retries)
+        self.session = session or make_session()
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def _record(self, host, latency, retried=False, failed=False):
+        with self._lock:
+            stats = self.stats.setdefault(host, HostStats())
+            stats.requests += 1
+            stats.total_latency += latency
+            stats.max_latency = max(stats.max_latency, latency)
+            stats.retries += int(retried)
+            stats.errors += int(failed)
+
+    def request(self, url, params=None, headers=None):
+        """GET url, retrying on connection errors, 429 and 5xx responses.
+
+        return an APIResponse. A 304 response is returned as is;
+        otherwise, raise an APIError if the request doesn't succeed.
+
+        """
+        import requests
+
+        host = urlparse(url).netloc
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            response = None
+            start = time.time()
+            try:
+                response = self.session.get(url, params=params,
+                                            headers=request_headers,
+                                            timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                self._record(host, time.time() - start,
+                             retried=not last_attempt, failed=last_attempt)
+                if last_attempt:
+                    raise APIError("Request to {} failed: {}".format(
+                        url, error))
+                time.sleep(retry_delay(None, attempt))
+                continue
+
+            latency = time.time() - start
+            if response.status_code in RETRY_STATUSES and not last_attempt:
+                self._record(host, latency, retried=True)
+                time.sleep(retry_delay(response, attempt))
+                continue
+
+            failed = response.status_code >= 400
+            self._record(host, latency, failed=failed)
+            if failed:
+                raise APIError("Request to {} failed with status {}: {}".format(
+                    url, response.status_code, response.text[:200]))
+
+            data = None
+            if response.status_code != 304:
+                try:
+                    data = response.json()
+                except ValueError:
+                    raise APIError("Invalid JSON response from {}".format(url))
+
+            return APIResponse(response.status_code, response.headers,
+                               data, response.url)
+
+    def get(self, url, params=None, headers=None, endpoint=None):
+        """GET url, and return the decoded JSON response.
+
+        endpoint names the kind of request being made. If it has a time
+        to live configured, a cached response younger than that is
+        returned without making a request, and an older one is
+        revalidated with its ETag.
+
+        """
+        ttl = response_cache.endpoint_ttl(endpoint)
+        if self.cache is None or endpoint is None or ttl is None:
+            return self.request(url, params, headers).data
+
+        key = response_cache.cache_key(url, params)
+        entry, fresh = self.cache.lookup(key, ttl)
+        if fresh:
+            return entry["data"]
+
+        request_headers = dict(headers or {})
+        if entry is not None and entry.get("etag"):
+            request_headers["If-None-Match"] = entry["etag"]
+
+        response = self.request(url, params, request_headers)
+        if response.status_code == 304 and entry is not None:
+            self.cache.refresh(key)
+            return entry["data"]
+
+        self.cache.store(key, endpoint, response.data,
+                         response.headers.get("ETag"))
+        return response.data
+
+    def summary(self):
+        """get a string describing the requests made to each host
+        """
+        lines = []
+        with self._lock:
+            for host, stats in sorted(self.stats.items()):
+                lines.append(
+                    "{}: {} request(s), {} retried, {} failed, "
+                    "{:.0f}ms mean / {:.0f}ms max latency".format(
+                        host, stats.requests, stats.retries, stats.errors,
+                        1000 * stats.mean_latency, 1000 * stats.max_latency))
+        if self.cache is not None:
+            lines.append("response cache: {}".format(self.cache.summary()))
+        return "\n".join(lines)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """get the APIClient shared by everything in the process (created the
+    first time it's needed)
+
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = APIClient(cache=response_cache.ResponseCache())
+        return _client
@@ -1,12 +1,11 @@
-"""appdata.py: module to handle local application data (mostly just a
-wrapper for the pkg_resources API)
+"""appdata.py: module to handle local application data (data files
+installed alongside the package)
 
 also handle local caching
 
 """
 
 import os
-import pkg_resources
 
 from .name import APP_NAME
 
@@ -52,15 +51,11 @@ def cache_filename(filename):
 def resource_string(resource):
     """ get data packaged with the application as a string
     """
-    datapath = "{data_dir}/{resource}".format(
-        data_dir=DATA_DIR, resource=resource)
-    return pkg_resources.resource_string(__name__, datapath)
+    with open(resource_filename(resource), "rb") as resource_file:
+        return resource_file.read()
 
 def resource_filename(resource):
-    """get a (possibly temporary) filename for data packaged with the
-    application
-
+    """get the filename of data packaged with the application
     """
-    datapath = "{data_dir}/{resource}".format(
-        data_dir=DATA_DIR, resource=resource)
-    return pkg_resources.resource_filename(__name__, datapath)
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        DATA_DIR, resource)
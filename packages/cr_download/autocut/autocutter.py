@@ -6,18 +6,17 @@ transitions in the audio sequence.
 
 """
 
-from __future__ import print_function
-from builtins import dict
-
 import os
+import pickle
 import tempfile
 import shutil
-import wave
 from collections import deque
 
 from progressbar import progressbar
 
+from .. import checkpoint
 from .. import media_utils
+from .. import stream_data
 from ..configuration import data as config
 
 from . import sample_fingerprint
@@ -127,8 +126,8 @@ def intervals_to_keep(transition_times, cutting_pattern):
 
     return intervals
 
-def recut_files(input_files, output_dir, episode_segments):
-    """Cut out unwanted portions of an array of audio files.
+def recut_files(input_audio, episode_segments, on_output=None):
+    """Cut out unwanted portions of an open WavSequence.
 
     EPISODE_SEGMENTS is a sequence of tuples, indicating portions to
     cut the episode up into, of the form (part_name, intervals). I
@@ -138,13 +137,18 @@ def recut_files(input_files, output_dir, episode_segments):
     Each the second value in the tuple is an array of intervals
     belonging to that segment.
 
+    Frames are piped directly into an encoder for each output file,
+    so no intermediate .wav files are written. If on_output is given,
+    it's called with the name of each audio file as soon as it has
+    been encoded.
+
     return the names of the audio files created.
 
     """
 
     edited_files = []
 
-    input_audio = wav_sequence.open(input_files)
+    input_audio.seek(0)
     current_frame = 0
 
     if config.autocutter_verbosity > 0:
@@ -152,40 +156,41 @@ def recut_files(input_files, output_dir, episode_segments):
         episode_segments = progressbar(episode_segments)
 
     for name, intervals in episode_segments:
-        wavfile_name = os.path.join(
-            output_dir,
-            media_utils.change_ext(os.path.basename(name), ".wav"))
-
-        output_wav = wave.open(wavfile_name, "wb")
-        output_wav.setparams(input_audio.getparams())
-        for start, end in intervals:
-            input_audio.skip_frames(start - current_frame)
-            if end == -1:
-                input_audio.copy_to_end(output_wav)
-                break
-            else:
-                input_audio.copy_frames(end - start, output_wav)
-                current_frame = end
+        with media_utils.open_encoder(name) as output_audio:
+            output_audio.setparams(input_audio.getparams())
+            for start, end in intervals:
+                input_audio.skip_frames(start - current_frame)
+                if end == -1:
+                    input_audio.copy_to_end(output_audio)
+                    break
+                else:
+                    input_audio.copy_frames(end - start, output_audio)
+                    current_frame = end
 
-        media_utils.ffmpeg_convert(wavfile_name, name)
         edited_files.append(name)
-
-    input_audio.close()
+        if on_output is not None:
+            on_output(name)
 
     return edited_files
 
-def get_transition_times(audio_files, transition_sequence, window_time=10):
+def get_transition_times(audio_files, transition_sequence, window_time=10,
+                         fingerprints=None):
     """get a sequence of timestamps for points in audio files where
     transitions are found.
 
+    audio_files is either an array of filenames or an open WavSequence.
+    If the FingerprintSequence for the audio has already been
+    computed, it can be given as fingerprints.
+
     """
     sample_prints = sample_fingerprint.load_prints(
         sample_file=config.sample_data_file
     )
 
-    print("Generating audio fingerprints...")
-    fingerprints = fingerprint_sequence.load_fingerprints(
-        audio_files, use_cache=config.use_cache)
+    if fingerprints is None:
+        print("Generating audio fingerprints...")
+        fingerprints = fingerprint_sequence.load_fingerprints(
+            audio_files, use_cache=config.use_cache)
 
     fp_transitions = fingerprint_transition_times(
         fingerprints, sample_prints, transition_sequence,
@@ -209,53 +214,147 @@ def _get_episode_partname(episode_pattern, part_index):
     return ep_name
 
 
-def autocut(audio_files, output_file):
-    """automatically edit the array of audio files to exclude transitions
-    and specific segments between them.
-
-    if config.autocut_merge is specified, a single audio file is
-    produced, with undesired segments excluded. Otherwise, one audio
-    file for each desired segment is created.
-
-    returns the name(s) of the created file(s).
-
-    """
+def _autocut_source(source):
+    #the configured source may list several sources; the first is the
+    #default
+    return source or stream_data.enabled_sources()[0]
 
+def _cutting_sequence(source):
     if config.cutting_sequence:
-        cutting_sequence = config.cutting_sequences[config.source][
+        return config.cutting_sequences[source][
             config.cutting_sequence
         ]
 
+    return config.cutting_sequences[source][
+        config.default_cutting_sequence
+    ]
+
+def _save_fingerprints(input_audio, filename):
+    print("Generating audio fingerprints...")
+    fingerprints = fingerprint_sequence.load_fingerprints(
+        input_audio, use_cache=config.use_cache)
+    with open(filename, "wb") as fingerprint_file:
+        pickle.dump(fingerprints, fingerprint_file)
+    return filename
+
+def _load_fingerprints(filename):
+    with open(filename, "rb") as fingerprint_file:
+        return pickle.load(fingerprint_file)
+
+def _checkpointed_transition_times(input_audio, transition_sequence,
+                                   episode_checkpoint):
+    #fingerprints and transition times are separate stages, so
+    #changing the samples or thresholds doesn't mean fingerprinting
+    #the audio again
+    fingerprint_file = episode_checkpoint.run(
+        "fingerprints",
+        [checkpoint.file_signature(name) for name in input_audio.filenames],
+        lambda: _save_fingerprints(
+            input_audio, episode_checkpoint.path("fingerprints.pickle")),
+        files=lambda filename: [filename])
+
+    return episode_checkpoint.run(
+        "transitions",
+        [checkpoint.file_signature(fingerprint_file), transition_sequence,
+         config.sample_data_file, config.sample_audio_files,
+         config.autocut_error_threshold, config.autocut_time_threshold],
+        lambda: get_transition_times(
+            input_audio, transition_sequence,
+            fingerprints=_load_fingerprints(fingerprint_file)))
+
+def episode_intervals(input_audio, source=None, episode_checkpoint=None):
+    """find the intervals of frames to keep from an open WavSequence,
+    using the configured audio and cutting sequences for streams from
+    source (by default, the configured source)
+
+    if a checkpoint.EpisodeCheckpoint is given, the audio's
+    fingerprints and transition times are recorded in it, and reused
+    if they've been found before.
+
+    """
+    source = _autocut_source(source)
+    transition_sequence = config.audio_sequences[source][config.audio_sequence]
+    if episode_checkpoint is None:
+        transition_times = get_transition_times(input_audio,
+                                                transition_sequence)
     else:
-        cutting_sequence = config.cutting_sequences[config.source][
-            config.default_cutting_sequence
-        ]
+        transition_times = _checkpointed_transition_times(
+            input_audio, transition_sequence, episode_checkpoint)
 
-    pcm_intervals = intervals_to_keep(
-        get_transition_times(
-            audio_files,
-            config.audio_sequences[config.source][config.audio_sequence]),
-        cutting_sequence
-    )
+    return intervals_to_keep(transition_times, _cutting_sequence(source))
+
+def episode_segments(output_file, intervals):
+    """group intervals to keep into the parts of the episode to output.
+
+    if config.autocut_merge is specified, there is a single part
+    (named output_file) containing every interval. Otherwise, each
+    interval becomes its own part.
 
+    """
     if config.autocut_merge:
-        episode_segments = [(output_file, pcm_intervals)]
-    else:
-        episode_segments = [
-            (_get_episode_partname(output_file, i), [interval])
-            for i, interval in enumerate(pcm_intervals)
-        ]
+        return [(output_file, intervals)]
 
-    tmpdir = tempfile.mkdtemp()
-    try:
-        output_files = recut_files(audio_files, tmpdir, episode_segments)
-    finally:
-        if (not DEBUG and not config.debug):
-            shutil.rmtree(tmpdir)
-        else:
-            print(("Debug mode: autocutter preserving temporary directory "
-                   "{}".format(tmpdir)))
-    return output_files
+    return [
+        (_get_episode_partname(output_file, i), [interval])
+        for i, interval in enumerate(intervals)
+    ]
+
+def timed_episode_segments(audio_files, output_file, source=None,
+                           episode_checkpoint=None):
+    """like episode_segments, but find the intervals to keep in
+    audio_files and give them in seconds instead of frames (with an
+    end time of None for the end of the audio).
+
+    """
+    with wav_sequence.open(audio_files) as input_audio:
+        framerate = float(input_audio.framerate)
+        intervals = episode_intervals(input_audio, source, episode_checkpoint)
+
+    return episode_segments(output_file, [
+        (start / framerate, None if end == -1 else end / framerate)
+        for start, end in intervals
+    ])
+
+def autocut(audio_files, output_file, source=None, on_output=None,
+            episode_checkpoint=None):
+    """automatically edit the array of audio files to exclude transitions
+    and specific segments between them.
+
+    source is the name of the site the audio came from, which decides
+    the transitions expected (by default, the configured source).
+    on_output is called with the name of each file as soon as it has
+    been created.
+
+    if a checkpoint.EpisodeCheckpoint is given, each stage of
+    autocutting is recorded in it, and skipped if it has already been
+    done with the same inputs.
+
+    if config.autocut_merge is specified, a single audio file is
+    produced, with undesired segments excluded. Otherwise, one audio
+    file for each desired segment is created.
+
+    returns the name(s) of the created file(s).
+
+    """
+    with wav_sequence.open(audio_files) as input_audio:
+        segments = episode_segments(
+            output_file,
+            episode_intervals(input_audio, source, episode_checkpoint))
+        if episode_checkpoint is None:
+            return recut_files(input_audio, segments, on_output)
+
+        def _reused(output_files):
+            if on_output is not None:
+                for name in output_files:
+                    on_output(name)
+
+        return episode_checkpoint.run(
+            "encode",
+            [segments, config.autocut_merge,
+             [checkpoint.file_signature(name)
+              for name in input_audio.filenames]],
+            lambda: recut_files(input_audio, segments, on_output),
+            files=lambda output_files: output_files, on_reuse=_reused)
 
 def get_autocut_errors(audio_files, window_time=10.0):
     """get an array of the minimum bit diffs found in the fingerprint
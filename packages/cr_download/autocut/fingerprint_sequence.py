@@ -11,6 +11,7 @@ from progressbar import progressbar
 
 from .. import appdata
 from . import fingerprint_utils
+from . import wav_sequence
 
 class FingerprintException(Exception):
     pass
@@ -18,6 +19,9 @@ class FingerprintException(Exception):
 class FingerprintSequence:
     """class to store fingerprint data for a set of audio files.
 
+    audio_files may be either an array of filenames or an open
+    WavSequence.
+
     """
     def __init__(self, audio_files=None):
         self._sequence = []
@@ -25,9 +29,36 @@ class FingerprintSequence:
         self.channels = None
         self.duration = 0.0
 
-        if audio_files is not None:
+        if isinstance(audio_files, wav_sequence.WavSequence):
+            self.load_from_wav_sequence(audio_files)
+        elif audio_files is not None:
             self.load_from_audio_files(audio_files)
 
+    def load_from_wav_sequence(self, audio):
+        """load the FingerprintSequence from the files in an open
+        WavSequence, reading PCM data directly from its memory map.
+
+        """
+        if audio.sampwidth != 2:
+            raise FingerprintException(
+                "Fingerprinting requires 16-bit audio, got {}-bit".format(
+                    8 * audio.sampwidth)
+            )
+
+        self.channels = audio.nchannels
+        self.samplerate = audio.framerate
+
+        frame_counts = audio.file_frame_counts()
+        for i in progressbar(range(len(frame_counts))):
+            duration = float(frame_counts[i]) / audio.framerate
+            self._sequence += fingerprint_utils.fingerprint_pcm(
+                audio.framerate, audio.nchannels,
+                audio.file_blocks(i), duration
+            )
+            self.duration += duration
+
+        self.fingerprint_rate = len(self._sequence) / self.duration
+
     def load_from_audio_files(self, audio_files):
         """load the FingerprintSequence from a sequence of audio files.
         """
@@ -83,6 +114,8 @@ class FingerprintSequence:
         return int(index / self.fingerprint_rate)
 
 def _get_cache_filename(audio_files):
+    if isinstance(audio_files, wav_sequence.WavSequence):
+        audio_files = audio_files.filenames
     basenames = [os.path.basename(afile) for afile in audio_files]
     return hashlib.md5("".join(basenames).encode("utf-8")).hexdigest()
 
@@ -101,7 +134,8 @@ def _load_cached_fingerprints(filename):
     return fprints
 
 def load_fingerprints(audio_files, use_cache=False):
-    """load a fingerprint sequence from an array of audio files.
+    """load a fingerprint sequence from an array of audio files (or an
+    open WavSequence).
 
     if use_cache is specified, try to load the sequence from a pickle
     in the cache directory first.
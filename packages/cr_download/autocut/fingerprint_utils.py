@@ -33,6 +33,14 @@ def total_error(print1, print2):
                                                      print2)])
     return float(err) / (32 * min(len(print1), len(print2)))
 
+def fingerprint_pcm(samplerate, channels, blocks, duration):
+    """compute the full chromaprint of 16-bit PCM data, provided as an
+    iterable of blocks of bytes
+
+    """
+    enc_print = acoustid.fingerprint(samplerate, channels, blocks, duration)
+    return acoustid.chromaprint.decode_fingerprint(enc_print)[0]
+
 def fingerprint_full_file(filename):
     """read an audio file and compute its full chromaprint
     """
@@ -40,11 +48,10 @@ def fingerprint_full_file(filename):
         data = {"duration":audio_file.duration,
                 "samplerate":audio_file.samplerate,
                 "channels":audio_file.channels}
-        enc_print = acoustid.fingerprint(
+        dec_print = fingerprint_pcm(
             audio_file.samplerate,
             audio_file.channels,
             iter(audio_file),
             audio_file.duration
         )
-        dec_print = acoustid.chromaprint.decode_fingerprint(enc_print)[0]
     return dec_print, data
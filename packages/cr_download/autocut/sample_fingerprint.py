@@ -6,13 +6,12 @@ transition points.
 
 """
 
-from __future__ import print_function
-
 import os
 from itertools import chain
 import pickle
 import tempfile
 import shutil
+import threading
 
 from .. import media_utils
 from ..configuration import data as config
@@ -65,7 +64,23 @@ class SampleFingerprint:
 
         return min(errs)
 
+#fingerprint data loaded so far, indexed by (mask, sample_file), so a
+#long-running process only loads it once
+_loaded_prints = {}
+_prints_lock = threading.Lock()
+
 def load_prints(mask=MASK, sample_file=None):
+    """get transition soundtrack fingerprint data, loading it (with
+    _load_prints) the first time it's needed
+
+    """
+    key = (mask, sample_file)
+    with _prints_lock:
+        if key not in _loaded_prints:
+            _loaded_prints[key] = _load_prints(mask, sample_file)
+        return _loaded_prints[key]
+
+def _load_prints(mask=MASK, sample_file=None):
     """Load transition soundtrack fingerprint data from file(s).
 
     If sample_file is specified, this function tries to load
@@ -1,61 +1,231 @@
 """wav_sequence: module providing tools to open a sequence of .wav
 files as if it were a single audio file
 
+The files are memory-mapped rather than read through the wave module,
+so the whole sequence can be addressed as one virtual array of frames
+(indexed by frame number) without copying it into memory. The
+fingerprinter and the autocutter both read episode audio through a
+WavSequence, so they share the same pages of the OS page cache.
+
 """
 
-from collections import deque
-import wave
+from collections import namedtuple
+import io
+import mmap
+import struct
+
+#number of frames copied at a time by the sequential read methods
+BUFFER_SIZE = 65536
+
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+#same fields as the namedtuple returned by wave.Wave_read.getparams
+WavParams = namedtuple("WavParams", ["nchannels", "sampwidth", "framerate",
+                                     "nframes", "comptype", "compname"])
+
+class WavException(Exception):
+    """exception thrown when a file can't be mapped as PCM wav data
+    """
+
+class WavFile:
+    """memory-mapped view of the PCM data in a single .wav file
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with io.open(filename, "rb") as wav_file:
+            try:
+                self._map = mmap.mmap(wav_file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            except ValueError:
+                raise WavException("{} is empty".format(filename))
+
+        self._read_header()
+
+    def _read_header(self):
+        if len(self._map) < 12:
+            raise WavException("{} is not a wav file".format(self.filename))
+        riff, _, wave_id = struct.unpack_from("<4sI4s", self._map, 0)
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise WavException("{} is not a wav file".format(self.filename))
+
+        fmt = None
+        offset = 12
+        while offset + 8 <= len(self._map):
+            chunk_id, chunk_size = struct.unpack_from("<4sI", self._map,
+                                                      offset)
+            offset += 8
+            if chunk_id == b"fmt ":
+                fmt = self._read_fmt(offset, chunk_size)
+            elif chunk_id == b"data":
+                break
+            #chunks are padded to an even number of bytes
+            offset += chunk_size + (chunk_size & 1)
+        else:
+            raise WavException("{} has no data chunk".format(self.filename))
+
+        if fmt is None or fmt[0] != _WAVE_FORMAT_PCM or not fmt[4]:
+            raise WavException("{} does not contain PCM audio".format(
+                self.filename))
+
+        _, self.nchannels, self.framerate, _, self.framesize, bits = fmt
+        self.sampwidth = bits // 8
 
-BUFFER_SIZE = 1024
+        #ffmpeg leaves the data size unset if it can't seek back and
+        #fix the header, so fall back to the size of the file
+        data_size = chunk_size
+        if data_size == 0 or offset + data_size > len(self._map):
+            data_size = len(self._map) - offset
+
+        self._data_offset = offset
+        self.nframes = data_size // self.framesize
+
+    def _read_fmt(self, offset, chunk_size):
+        if chunk_size < 16 or offset + chunk_size > len(self._map):
+            raise WavException("{} has a truncated fmt chunk".format(
+                self.filename))
+        fmt = struct.unpack_from("<HHIIHH", self._map, offset)
+
+        #extensible formats keep the actual format code at the start
+        #of their subformat GUID
+        if fmt[0] == _WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+            subformat, = struct.unpack_from("<H", self._map, offset + 24)
+            fmt = (subformat,) + fmt[1:]
+        return fmt
+
+    def frames(self, start, end):
+        """get the PCM data for frames [start, end) as a bytes object
+        """
+        return self._map[self._data_offset + start * self.framesize:
+                         self._data_offset + end * self.framesize]
+
+    def getparams(self):
+        """get wav file metadata for this file
+        """
+        return WavParams(self.nchannels, self.sampwidth, self.framerate,
+                         self.nframes, "NONE", "not compressed")
+
+    def close(self):
+        """unmap the file
+        """
+        self._map.close()
 
 class WavSequence:
     """class to treat a sequence of wav files as a single audio file
+
+    Besides the sequential readframes/skip_frames/copy_frames
+    interface, frames can be accessed at random by slicing the
+    sequence, e.g. seq[start:end] returns the PCM data for frames
+    start through end - 1, even if they span several files.
+
     """
     def __init__(self, filenames):
-        self._filenames = deque(filenames)
-        self._current_file = None
+        self.filenames = list(filenames)
+        self._files = []
+        self._file_starts = []
+        self.nframes = 0
         self.frame_index = 0
 
     def open(self):
-        """open the first wav file in the sequence
+        """map every wav file in the sequence
         """
-        if self._filenames:
-            self._current_file = wave.open(self._filenames.popleft(), "rb")
+        for filename in self.filenames:
+            wav_file = WavFile(filename)
+            if self._files and (
+                    wav_file.getparams()[:3] != self._files[0].getparams()[:3]):
+                wav_file.close()
+                raise WavException(
+                    """Wav sequence doesn't know how to handle input files
+                    with different channelno, sample width or sample rate!"""
+                )
+            self._files.append(wav_file)
+            self._file_starts.append(self.nframes)
+            self.nframes += wav_file.nframes
 
     def close(self):
-        """close the current (only) open file in the sequence
+        """unmap all of the files in the sequence
         """
-        self._current_file.close()
+        for wav_file in self._files:
+            wav_file.close()
+        self._files = []
+        self._file_starts = []
+
+    def __len__(self):
+        return self.nframes
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, step = index.indices(self.nframes)
+            if step != 1:
+                raise WavException("wav sequences can't be sliced with a step")
+            return self.frames(start, end)
+
+        if index < 0:
+            index += self.nframes
+        if not 0 <= index < self.nframes:
+            raise IndexError("frame index out of range")
+        return self.frames(index, index + 1)
+
+    def frames(self, start, end):
+        """get the PCM data for frames [start, end) of the sequence
+        """
+        chunks = []
+        for file_start, wav_file in zip(self._file_starts, self._files):
+            file_end = file_start + wav_file.nframes
+            if file_end <= start:
+                continue
+            if file_start >= end:
+                break
+            chunks.append(wav_file.frames(max(start - file_start, 0),
+                                          min(end, file_end) - file_start))
+
+        if len(chunks) == 1:
+            return chunks[0]
+        return b"".join(chunks)
+
+    def blocks(self, start=0, end=None, block_size=BUFFER_SIZE):
+        """iterate over the PCM data for frames [start, end) of the
+        sequence, block_size frames at a time
+
+        """
+        if end is None:
+            end = self.nframes
+        for block_start in range(start, end, block_size):
+            yield self.frames(block_start, min(block_start + block_size, end))
+
+    def file_blocks(self, file_index, block_size=BUFFER_SIZE):
+        """iterate over the PCM data of a single file in the sequence
+        """
+        start = self._file_starts[file_index]
+        return self.blocks(start, start + self._files[file_index].nframes,
+                           block_size)
+
+    def file_frame_counts(self):
+        """get the number of frames in each file of the sequence
+        """
+        return [wav_file.nframes for wav_file in self._files]
 
     def readframes(self, num_frames):
         """read at most num_frames frames from the file sequence
         """
-        frames = self._current_file.readframes(num_frames)
-        if len(frames) < num_frames and self._filenames:
-            self._current_file.close()
-            self._current_file = wave.open(self._filenames.popleft(), "rb")
-            frames += self.readframes(num_frames - len(frames))
-
-        return frames
+        start = self.frame_index
+        self.frame_index = min(start + num_frames, self.nframes)
+        return self.frames(start, self.frame_index)
 
     def _advance_frames(self, num_frames, output_file=None):
-        frames_left = num_frames
-        frames = [0]
-        while frames:
-            if num_frames == -1:
-                to_read = BUFFER_SIZE
-            else:
-                to_read = min(BUFFER_SIZE, frames_left)
-
-            frames = self.readframes(to_read)
-            if output_file is not None:
-                output_file.writeframes(frames)
-            frames_left -= to_read
+        if num_frames == -1:
+            end = self.nframes
+        else:
+            end = min(self.frame_index + max(num_frames, 0), self.nframes)
 
-    def skip_frames(self, num_frames):
-        """skip ahead num_frames frames in the file sequence (or to end of file),
-        using a buffer
+        if output_file is not None:
+            for block in self.blocks(self.frame_index, end):
+                output_file.writeframes(block)
 
+        self.frame_index = end
+
+    def skip_frames(self, num_frames):
+        """skip ahead num_frames frames in the file sequence (or to end of file)
         """
         self._advance_frames(num_frames)
 
@@ -71,11 +241,35 @@ class WavSequence:
 
         self._advance_frames(-1, output_file)
 
+    def seek(self, frame_index):
+        """move the read position to an absolute frame index
+        """
+        self.frame_index = max(min(frame_index, self.nframes), 0)
 
     def getparams(self):
-        """get wav file metadata for the currently open file
+        """get wav file metadata for the sequence (nframes is the total
+        number of frames in all files)
+
         """
-        return self._current_file.getparams()
+        return self._files[0].getparams()._replace(nframes=self.nframes)
+
+    @property
+    def framerate(self):
+        return self._files[0].framerate
+
+    @property
+    def nchannels(self):
+        return self._files[0].nchannels
+
+    @property
+    def sampwidth(self):
+        return self._files[0].sampwidth
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 def open(filenames):
     """open a sequence of filenames as a single WavSequence object
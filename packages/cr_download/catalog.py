@@ -0,0 +1,164 @@
+"""catalog.py: an indexed catalog of downloaded episodes.
+
+Episodes are stored in an SQLite database in the application data
+directory, keyed by their short id (as produced by
+metadata.format_critrole_title), so each run only adds or updates the
+rows for the episodes it produced. The catalog can be queried by
+campaign and episode number, and exported to the YAML metadata file
+format.
+
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from . import appdata
+
+CATALOG_FILE = "episodes.db"
+
+#fields of an episode entry written to metadata files, in order
+EPISODE_FIELDS = ["id", "title", "airdate", "file", "description"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS episodes (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    airdate TEXT,
+    file TEXT,
+    description TEXT,
+    campaign INTEGER,
+    episode INTEGER,
+    part INTEGER,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS episodes_by_number
+    ON episodes (campaign, episode, part);
+"""
+
+class CatalogException(Exception):
+    """exception thrown when an entry can't be added to the catalog
+    """
+
+def _entry(row):
+    return {field: row[field] for field in EPISODE_FIELDS
+            if row[field] is not None}
+
+class EpisodeCatalog:
+    """the catalog of episodes, stored at path (by default, in the
+    application data directory)
+
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(appdata.get_userdata_dir(),
+                                         CATALOG_FILE)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def upsert(self, entry, campaign=None, episode=None, part=None):
+        """add an episode entry (a dict with the EPISODE_FIELDS keys) to
+        the catalog, or update the existing entry with the same id.
+
+        campaign, episode and part are the episode's numbers (if
+        known), used for queries.
+
+        return True if the catalog changed. Raise a CatalogException if
+        the entry has no id (since it would replace any other entry
+        without one).
+
+        """
+        if not entry.get("id"):
+            raise CatalogException("Episode entry has no id: {}".format(
+                entry.get("title") or entry.get("file")))
+
+        values = [entry.get(field) for field in EPISODE_FIELDS]
+        numbers = [None if num is None else int(num)
+                   for num in (campaign, episode, part)]
+
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT * FROM episodes WHERE id = ?", (entry["id"],)).fetchone()
+            if (row is not None and
+                    [row[field] for field in EPISODE_FIELDS] == values and
+                    [row["campaign"], row["episode"], row["part"]] == numbers):
+                return False
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO episodes "
+                "(id, title, airdate, file, description, campaign, episode, "
+                "part, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                values + numbers + [time.time()])
+        return True
+
+    def remove(self, ep_id):
+        """remove an episode from the catalog
+        """
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM episodes WHERE id = ?", (ep_id,))
+
+    def get(self, ep_id):
+        """get the entry for the episode with the given id, or None
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM episodes WHERE id = ?", (ep_id,)).fetchone()
+        return None if row is None else _entry(row)
+
+    def query(self, campaign=None, first=None, last=None):
+        """get the entries for episodes, ordered by campaign, episode and
+        part.
+
+        if campaign is given, only include episodes from that
+        campaign. If first or last are given, only include episodes
+        numbered from first and/or up to last.
+
+        """
+        conditions = []
+        params = []
+        if campaign is not None:
+            conditions.append("campaign = ?")
+            params.append(int(campaign))
+        if first is not None:
+            conditions.append("episode >= ?")
+            params.append(int(first))
+        if last is not None:
+            conditions.append("episode <= ?")
+            params.append(int(last))
+
+        sql = "SELECT * FROM episodes"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY campaign, episode, part, id"
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [_entry(row) for row in rows]
+
+    def export_yaml(self, output_file, entries=None):
+        """write entries (by default, every episode in the catalog) to a
+        YAML metadata file, as a dict indexed by episode id
+
+        """
+        from ruamel.yaml import YAML
+
+        if entries is None:
+            entries = self.query()
+        YAML(typ="safe").dump({entry["id"]: entry for entry in entries},
+                              Path(output_file))
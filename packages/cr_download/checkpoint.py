@@ -0,0 +1,170 @@
+"""checkpoint.py: let episode processing pick up after the last stage
+whose inputs haven't changed.
+
+Each episode gets a work directory (under the work_dir config option,
+or in the application data directory) holding the files produced by
+each processing stage, and a manifest recording, for every stage
+which finished, a hash of its inputs, its result and the files it
+produced. When the episode is processed again, a stage whose inputs
+hash the same and whose files are all still there is skipped, and its
+recorded result is used instead. Since each stage's inputs include the
+results of the stages before it, everything after the first stage
+whose inputs changed is run again.
+
+A work directory only lasts until its episode has been processed
+successfully, when it's deleted (it's kept if processing fails, so
+the next run can pick up where this one stopped).
+
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+from cr_download.configuration import data as config
+from . import appdata
+
+MANIFEST_FILE = "manifest.json"
+
+WORK_DIR = "work"
+
+def file_signature(filename):
+    """get a list identifying the current contents of a file (its path,
+    size and modification time), to use as a stage input
+
+    """
+    stat = os.stat(filename)
+    return [os.path.abspath(filename), stat.st_size, stat.st_mtime]
+
+def _hash_inputs(inputs):
+    text = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def work_dir(title):
+    """get the work directory for the episode saved under title
+    """
+    base_dir = config.work_dir or os.path.join(appdata.get_userdata_dir(),
+                                               WORK_DIR)
+    return os.path.join(base_dir,
+                        re.sub(r"[^\w.-]+", "_", os.path.basename(title)))
+
+class EpisodeCheckpoint:
+    """the manifest of finished stages for an episode, kept in
+    directory (created if it doesn't exist)
+
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_FILE)
+        self.stages = {}
+        self.skipped = []
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                self.stages = json.load(manifest_file).get("stages", {})
+        except (IOError, OSError, ValueError):
+            self.stages = {}
+
+    def _save(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as manifest_file:
+            json.dump({"stages": self.stages}, manifest_file, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def path(self, name):
+        """get the name of a file in the work directory
+        """
+        return os.path.join(self.directory, name)
+
+    def scoped(self, prefix):
+        """get a view of the checkpoint whose stage and file names all
+        start with prefix (e.g. for the stages run on each of an
+        episode's streams)
+
+        """
+        return _ScopedCheckpoint(self, prefix)
+
+    def _finished(self, stage, inputs_hash):
+        with self._lock:
+            entry = self.stages.get(stage)
+        if entry is None or entry["inputs"] != inputs_hash:
+            return None
+        if not all(os.path.exists(name) for name in entry["files"]):
+            return None
+        return entry
+
+    def run(self, stage, inputs, func, files=None, on_reuse=None):
+        """get the result of a stage: if it finished before with the same
+        inputs (any JSON-serializable data) and its files are still
+        there, the recorded result; otherwise, run func() to get it and
+        record it.
+
+        files is a function getting the list of files a stage produced
+        from its result. If the recorded result is used, on_reuse (if
+        given) is called with it.
+
+        """
+        inputs_hash = _hash_inputs(inputs)
+        entry = self._finished(stage, inputs_hash)
+        if entry is not None:
+            print("Reusing {} from {}".format(stage, self.directory))
+            self.skipped.append(stage)
+            if on_reuse is not None:
+                on_reuse(entry["result"])
+            return entry["result"]
+
+        result = func()
+        with self._lock:
+            self.stages[stage] = {
+                "inputs": inputs_hash,
+                "result": result,
+                "files": list(files(result)) if files is not None else [],
+                "finished": time.time()
+            }
+            self._save()
+        return result
+
+    def clear(self):
+        """delete the work directory, along with everything in it
+        """
+        with self._lock:
+            self.stages = {}
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+class _ScopedCheckpoint:
+    def __init__(self, checkpoint, prefix):
+        self.checkpoint = checkpoint
+        self.prefix = prefix
+
+    @property
+    def directory(self):
+        return self.checkpoint.directory
+
+    def path(self, name):
+        return self.checkpoint.path(self.prefix + name)
+
+    def scoped(self, prefix):
+        return _ScopedCheckpoint(self.checkpoint, self.prefix + prefix)
+
+    def run(self, stage, inputs, func, files=None, on_reuse=None):
+        return self.checkpoint.run(self.prefix + stage, inputs, func, files,
+                                   on_reuse)
+
+def for_episode(title):
+    """get the checkpoint for the episode saved under title, if the
+    checkpoint config option is set (otherwise, None)
+
+    """
+    if not config.checkpoint:
+        return None
+    return EpisodeCheckpoint(work_dir(title))
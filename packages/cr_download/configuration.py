@@ -4,19 +4,19 @@ config data is exposed to the user as a global Configuration object,
 called 'data'. Users can import this object to get access to config
 settings, and update/save it using the Configuration class interface.
 
+parsing YAML is slow, so the parsed config files are cached (in the
+cache directory) until either file changes.
+
 """
 
 import os
 import os.path as path
 from pathlib import Path
-
-from ruamel.yaml import YAML
+import pickle
 
 from . import appdata
 from .name import APP_NAME
 
-yaml = YAML(typ="safe")
-
 _XDG_CONFIG_HOME = (os.environ.get('XDG_CONFIG_HOME')
                     or path.join(path.expanduser("~"), ".config"))
 
@@ -27,6 +27,13 @@ CONFIG_PATH = path.join(CONFIG_DIR, CONFIG_FILE)
 
 CONFIG_EXCLUDES = ["writeable_data"]
 
+CONFIG_CACHE_FILE = "config_cache.pickle"
+
+def _yaml():
+    from ruamel.yaml import YAML
+
+    return YAML(typ="safe")
+
 class Configuration:
     """Provide a namespace for program configuration."""
     def __init__(self, init_data):
@@ -54,7 +61,7 @@ class Configuration:
         """save some of the configuration data to the user's default config
         file"""
         _make_user_config_dir()
-        yaml.dump(self.writeable_data, Path(CONFIG_PATH))
+        _yaml().dump(self.writeable_data, Path(CONFIG_PATH))
 
 def _get_default_config_string():
     return appdata.resource_string(CONFIG_FILE).decode('utf-8')
@@ -65,17 +72,66 @@ def _make_user_config_dir():
     except os.error:
         pass
 
-def _load_config():
+def _file_version(filename):
+    stat = os.stat(filename)
+    return filename, stat.st_mtime, stat.st_size
+
+def _read_config_cache(key):
+    try:
+        with appdata.open_cache_file(CONFIG_CACHE_FILE, "rb") as cache_file:
+            cached_key, default_data, user_data = pickle.load(cache_file)
+    except (IOError, OSError, EOFError, ValueError, pickle.PickleError):
+        return None
+    if cached_key != key:
+        return None
+    return default_data, user_data
+
+def _write_config_cache(key, default_data, user_data):
+    try:
+        with appdata.open_cache_file(CONFIG_CACHE_FILE, "wb") as cache_file:
+            pickle.dump((key, default_data, user_data), cache_file)
+    except (IOError, OSError):
+        pass
+
+def _parse_config_files():
+    """get the parsed data in the default and user config files, creating
+    the user config file if it doesn't exist
+
+    """
     default_config_string = _get_default_config_string()
-    config = Configuration(yaml.load(default_config_string))
+    yaml = _yaml()
+    default_data = yaml.load(default_config_string)
     try:
         with open(CONFIG_PATH, "r") as user_config_file:
-            config.update(yaml.load(user_config_file))
+            user_data = yaml.load(user_config_file)
     except(IOError, OSError):
         _make_user_config_dir()
         with open(CONFIG_PATH, "w") as user_config_file:
             user_config_file.write(default_config_string)
+        user_data = default_data
+
+    return default_data, user_data
 
+def _load_config():
+    try:
+        key = (_file_version(appdata.resource_filename(CONFIG_FILE)),
+               _file_version(CONFIG_PATH))
+        cached = _read_config_cache(key)
+    except OSError:
+        key = cached = None
+
+    if cached is not None:
+        default_data, user_data = cached
+    else:
+        default_data, user_data = _parse_config_files()
+        if key is None:
+            #the user config file was just created
+            key = (_file_version(appdata.resource_filename(CONFIG_FILE)),
+                   _file_version(CONFIG_PATH))
+        _write_config_cache(key, default_data, user_data)
+
+    config = Configuration(default_data)
+    config.update(user_data or {})
     return config
 
 data = _load_config()
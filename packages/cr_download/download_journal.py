@@ -0,0 +1,167 @@
+"""download_journal.py: keep track of partially completed downloads.
+
+A DownloadJournal is a small JSON sidecar file stored next to a file
+being downloaded. It records which byte ranges (for plain HTTP
+downloads) or which HLS segments have been completely written to
+disk, so an interrupted download can pick up where it left off.
+
+"""
+
+import json
+import os
+import threading
+
+JOURNAL_EXT = ".journal"
+
+class DownloadJournal:
+    """journal of the completed parts of the download of output_filename.
+
+    source identifies what is being downloaded (e.g. a video url). An
+    existing journal for a different source is discarded. Ranges can
+    be recorded from several threads at once.
+
+    """
+    def __init__(self, output_filename, source):
+        self.output_filename = output_filename
+        self.path = output_filename + JOURNAL_EXT
+        self.source = source
+        self.size = None
+        self.ranges = []
+        self.segments = []
+        self._lock = threading.RLock()
+
+        self.load()
+
+    def load(self):
+        """load the journal from disk (if there is one for this source)
+        """
+        try:
+            with open(self.path, "r") as journal_file:
+                data = json.load(journal_file)
+        except (IOError, OSError, ValueError):
+            return
+
+        if data.get("source") != self.source:
+            return
+
+        self.size = data.get("size")
+        self.ranges = [tuple(rng) for rng in data.get("ranges", [])]
+        self.segments = [tuple(seg) for seg in data.get("segments", [])]
+
+    def save(self):
+        """write the journal to disk, replacing the previous version
+        atomically
+
+        """
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as journal_file:
+                json.dump({"source":self.source,
+                           "size":self.size,
+                           "ranges":self.ranges,
+                           "segments":self.segments}, journal_file)
+            os.replace(tmp_path, self.path)
+
+    def remove(self):
+        """delete the journal (once the download is complete)
+        """
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def reset(self, size=None):
+        """forget everything recorded about the download
+        """
+        self.size = size
+        self.ranges = []
+        self.segments = []
+
+    def _file_size(self):
+        try:
+            return os.path.getsize(self.output_filename)
+        except OSError:
+            return 0
+
+    def add_range(self, start, end):
+        """record that bytes [start, end) have been written to disk
+        """
+        if end <= start:
+            return
+
+        with self._lock:
+            merged = []
+            for rng_start, rng_end in sorted(self.ranges + [(start, end)]):
+                if merged and rng_start <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], rng_end))
+                else:
+                    merged.append((rng_start, rng_end))
+            self.ranges = merged
+
+    def completed_bytes(self):
+        """get the number of bytes recorded as downloaded
+        """
+        return sum(end - start for start, end in self.ranges)
+
+    def missing_ranges(self, size=None):
+        """get the ranges [start, end) of the file which have not been
+        downloaded yet. If the total size is unknown, the last range
+        has end None.
+
+        """
+        if size is None:
+            size = self.size
+
+        missing = []
+        position = 0
+        for start, end in self.ranges:
+            if start > position:
+                missing.append((position, start))
+            position = max(position, end)
+
+        if size is None:
+            missing.append((position, None))
+        elif position < size:
+            missing.append((position, size))
+
+        return missing
+
+    def add_segment(self, name, size):
+        """record that the next HLS segment (with the given name) has been
+        appended to the output file
+
+        """
+        self.segments.append((name, size))
+
+    def segment_offset(self):
+        """get the number of bytes in the completed HLS segments
+        """
+        return sum(size for _, size in self.segments)
+
+    def verify(self, segment_names=None):
+        """check the journal against the output file on disk, and drop
+        anything which isn't actually there.
+
+        if segment_names is given, it's the list of segment names in the
+        current playlist. Recorded segments are only kept as long as
+        they match the start of that list.
+
+        """
+        file_size = self._file_size()
+        if file_size == 0:
+            self.reset(self.size)
+            return
+
+        self.ranges = [(start, min(end, file_size))
+                       for start, end in self.ranges if start < file_size]
+
+        if segment_names is not None:
+            matched = []
+            for (name, size), expected in zip(self.segments, segment_names):
+                if name != expected:
+                    break
+                matched.append((name, size))
+            self.segments = matched
+
+        while self.segments and self.segment_offset() > file_size:
+            self.segments.pop()
@@ -0,0 +1,173 @@
+"""download_registry.py: remember which streams have already been
+downloaded, so the same VOD is never downloaded twice.
+
+The registry is a JSON file in the cache directory mapping each
+stream (its url and the quality downloaded) to the file it was saved
+to, along with the file's size, modification time and SHA-256 hash
+(worked out the first time the download is looked up again). A
+registered file is only reused if it's still there and unchanged.
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from cr_download.configuration import data as config
+from . import appdata
+
+REGISTRY_FILE = "downloads.json"
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def file_hash(filename):
+    """get the hex SHA-256 digest of a file's contents
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as input_file:
+        for block in iter(lambda: input_file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def stream_key(stream, quality=None):
+    """get the key a stream's download is registered under
+    """
+    return "{} {}".format(stream.url, quality or stream.stream)
+
+class DownloadRegistry:
+    """persistent record of downloaded files, indexed by stream_key
+    """
+    def __init__(self, path=None):
+        self.path = path or appdata.cache_filename(REGISTRY_FILE)
+        self.entries = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as registry_file:
+                self.entries = json.load(registry_file)
+        except (IOError, OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        """write the registry to disk, replacing the previous version
+        atomically
+
+        """
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as registry_file:
+                json.dump(self.entries, registry_file)
+            os.replace(tmp_path, self.path)
+
+    def record(self, key, filename):
+        """register filename as the download of the stream with the given
+        key (unless there's no such file, e.g. if the download didn't
+        report where it saved it).
+
+        the file isn't hashed until the download is first looked up
+        again, so recording it doesn't hold up the next download.
+
+        """
+        if not filename:
+            return
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return
+        entry = {"path": os.path.abspath(filename), "size": stat.st_size,
+                 "mtime": stat.st_mtime, "sha256": None}
+        with self._lock:
+            self.entries[key] = entry
+        self.save()
+
+    def _verify(self, entry):
+        try:
+            stat = os.stat(entry["path"])
+        except OSError:
+            return False
+
+        if stat.st_size != entry["size"]:
+            return False
+        if entry.get("sha256") is None:
+            #the file hasn't been hashed since it was registered, so it
+            #can only be trusted if it wasn't touched at all
+            if stat.st_mtime != entry["mtime"]:
+                return False
+            entry["sha256"] = file_hash(entry["path"])
+            return True
+        if stat.st_mtime == entry["mtime"]:
+            return True
+
+        #the file was touched since it was registered, so check the
+        #contents are still the same
+        if file_hash(entry["path"]) != entry["sha256"]:
+            return False
+        entry["mtime"] = stat.st_mtime
+        return True
+
+    def find(self, key):
+        """get the name of an existing, verified download of the stream
+        with the given key, or None if there isn't one
+
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        hashed = entry.get("sha256") is not None
+        if not self._verify(entry):
+            with self._lock:
+                self.entries.pop(key, None)
+            self.save()
+            return None
+
+        if not hashed:
+            self.save()
+        return entry["path"]
+
+    def reuse(self, key, filename_base):
+        """get a file for the stream with the given key, under the name
+        filename_base (plus the registered file's extension), if it has
+        been downloaded before.
+
+        the registered file is hard linked to the new name if the
+        download_hardlinks config option is set (or copied, if it can't
+        be linked); otherwise it's used from where it is. Return None if
+        there's no verified download of the stream.
+
+        """
+        existing = self.find(key)
+        if existing is None or not config.download_hardlinks:
+            return existing
+
+        filename = filename_base + os.path.splitext(existing)[1]
+        if os.path.exists(filename) and os.path.samefile(filename, existing):
+            return filename
+
+        try:
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.link(existing, filename)
+        except OSError:
+            shutil.copyfile(existing, filename)
+        return filename
+
+_registry = None
+
+def get_registry():
+    """get the download registry (loaded from the cache the first time
+    it's needed)
+
+    """
+    global _registry
+    if _registry is None:
+        _registry = DownloadRegistry()
+    return _registry
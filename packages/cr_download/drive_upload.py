@@ -1,44 +1,77 @@
 """drive_upload.py
 
-Module responsible for uploading a single file to a folder named
-"xfer" in the user's Google Drive root directory.
+Module responsible for uploading files to a folder named "xfer" in
+the user's Google Drive root directory.
 
-This is super brittle and doesn't provide error checking or
-configurability.
+A DriveUploader builds the Drive API service and looks up the folder
+once, then uploads several files at a time with Drive's resumable
+upload protocol, a chunk at a time over a pooled session. The session
+URI of each unfinished upload is kept in the cache directory, so an
+interrupted upload picks up where it left off the next time the same
+file is uploaded.
 
 """
 
-from __future__ import print_function
-
+from concurrent.futures import ThreadPoolExecutor
+import json
+import mimetypes
 import os
-import httplib2
-
-from apiclient import discovery, errors
-from apiclient.http import MediaFileUpload
-from oauth2client.file import Storage
-from progressbar import ProgressBar
+import threading
+import time
 
-from . import configuration
+from cr_download.configuration import data as config
+from cr_download import configuration
+from cr_download import api_client
+from cr_download import appdata
+from cr_download import transfer
 
 XFER_FOLDER_NAME = "xfer"
 CREDENTIALS_FILE = os.path.join(configuration.CONFIG_DIR, "drive_credentials.json")
 
-def _get_service():
-    """get Google Drive API service object (assume credentials are stored
-    locally)
+SESSIONS_FILE = "drive_uploads.json"
+
+#resumable upload chunks have to be a multiple of this many bytes
+CHUNK_ALIGNMENT = 256 * 1024
+
+#number of times an upload is started over in a new session (after
+#its session expires) before giving up
+MAX_SESSION_RESTARTS = 3
+
+class DriveUploadException(Exception):
+    """exception thrown when a file can't be uploaded to Google Drive
+    """
+
+class _SessionExpired(Exception):
+    pass
 
+class _RetryableError(Exception):
+    def __init__(self, response):
+        super().__init__("HTTP {}".format(response.status_code))
+        self.response = response
+
+def _get_credentials():
+    """get Google Drive API credentials (assume they are stored locally)
+    """
+    from oauth2client.file import Storage
+
+    return Storage(CREDENTIALS_FILE).get()
+
+def _get_service(credentials):
+    """get Google Drive API service object
     """
-    store = Storage(CREDENTIALS_FILE)
-    credentials = store.get()
+    import httplib2
+    from apiclient import discovery
+
     http = credentials.authorize(httplib2.Http())
-    service = discovery.build('drive', 'v2', http=http)
-    return service
+    return discovery.build('drive', 'v2', http=http)
 
 def _get_xfer_id(service):
     """get id of XFER_FOLDER_NAME folder in user's Google Drive root
     directory
 
     """
+    from apiclient import errors
+
     try:
         children = service.children().list(
             folderId="root",
@@ -51,29 +84,293 @@ def _get_xfer_id(service):
     except errors.HttpError as error:
         print("Error: {}".format(error))
 
-def _upload_file(service, filename, parent_id):
-    """use service to upload file filename to Drive folder with id
-    parent_id
+def aligned_chunk_size(megabytes):
+    """get the size in bytes of upload chunks of about the given number
+    of megabytes, rounded to a multiple of CHUNK_ALIGNMENT
+
+    """
+    chunks = int(megabytes * 1024 * 1024) // CHUNK_ALIGNMENT
+    return max(chunks, 1) * CHUNK_ALIGNMENT
+
+def _uploaded_bytes(response):
+    #the Range header of a 308 response says which bytes the server
+    #has, e.g. "bytes=0-1048575" (or is missing if it has none)
+    byte_range = response.headers.get("Range", "")
+    if "-" not in byte_range:
+        return 0
+    return int(byte_range.rsplit("-", 1)[1]) + 1
+
+class UploadSessions:
+    """persistent record of the session URIs of unfinished uploads,
+    stored in path (by default, in the cache directory)
+
+    """
+    def __init__(self, path=None):
+        self.path = path or appdata.cache_filename(SESSIONS_FILE)
+        self.sessions = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def key(filename, parent_id):
+        """get the key the upload of filename to the folder with id
+        parent_id is stored under (which changes if the file does)
+
+        """
+        stat = os.stat(filename)
+        return "{} {} {} {}".format(os.path.abspath(filename), stat.st_size,
+                                    stat.st_mtime, parent_id)
+
+    def load(self):
+        try:
+            with open(self.path, "r") as sessions_file:
+                self.sessions = json.load(sessions_file)
+        except (IOError, OSError, ValueError):
+            self.sessions = {}
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as sessions_file:
+            json.dump(self.sessions, sessions_file)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key):
+        with self._lock:
+            return self.sessions.get(key)
+
+    def set(self, key, session_uri):
+        with self._lock:
+            self.sessions[key] = session_uri
+            self._save()
+
+    def remove(self, key):
+        with self._lock:
+            if self.sessions.pop(key, None) is not None:
+                self._save()
+
+class DriveUploader:
+    """upload files to a Google Drive folder (by default, the
+    XFER_FOLDER_NAME folder, found when the first file is uploaded).
+
+    files are sent to upload_url in chunks of chunk_size bytes, up to
+    workers at a time (by default, the drive_upload_url,
+    drive_chunk_size and drive_upload_workers config options).
+    credentials are the OAuth2 credentials requests are authorized
+    with (by default, the ones saved in CREDENTIALS_FILE).
 
     """
-    media_body = MediaFileUpload(filename, resumable=True)
-    body = {
-        'title':os.path.basename(filename),
-        'parents':[{'id':parent_id}]
-    }
-    request = service.files().insert(body=body, media_body=media_body)
-    response = None
-    with ProgressBar(max_value=100) as progress_bar:
-        while response is None:
-            status, response = request.next_chunk()
-            if status:
-                progress_bar.update(int(status.progress() * 100))
+    def __init__(self, folder_id=None, credentials=None, upload_url=None,
+                 chunk_size=None, workers=None, sessions=None, session=None):
+        self.folder_id = folder_id
+        self.credentials = credentials
+        self.upload_url = upload_url or config.drive_upload_url
+        self.chunk_size = (chunk_size or
+                           aligned_chunk_size(config.drive_chunk_size))
+        self.workers = workers or config.drive_upload_workers
+        self.sessions = sessions or UploadSessions()
+        self.session = session or transfer.make_session(self.workers)
+        self._lock = threading.Lock()
+
+    def _get_credentials(self):
+        with self._lock:
+            if self.credentials is None:
+                self.credentials = _get_credentials()
+            return self.credentials
+
+    def get_folder_id(self):
+        """get the id of the folder files are uploaded to, looking it up
+        the first time it's needed
+
+        """
+        credentials = self._get_credentials()
+        with self._lock:
+            if self.folder_id is None:
+                self.folder_id = _get_xfer_id(_get_service(credentials))
+                if self.folder_id is None:
+                    raise DriveUploadException(
+                        "Could not find the '{}' folder in Google Drive"
+                        .format(XFER_FOLDER_NAME))
+            return self.folder_id
+
+    def _headers(self, headers):
+        #the access token is refreshed by the credentials when it expires
+        with self._lock:
+            token = self.credentials.get_access_token().access_token
+        headers = dict(headers)
+        headers["Authorization"] = "Bearer {}".format(token)
+        return headers
+
+    def _start(self, filename, size, parent_id):
+        """start a resumable upload session for filename, retrying on
+        connection errors, 429 and 5xx responses. Return the session URI.
+
+        """
+        import requests
+
+        metadata = {"title": os.path.basename(filename),
+                    "parents": [{"id": parent_id}]}
+        mime_type = (mimetypes.guess_type(filename)[0]
+                     or "application/octet-stream")
+
+        for attempt in range(config.api_retries + 1):
+            response = None
+            try:
+                response = self.session.post(
+                    self.upload_url, params={"uploadType": "resumable"},
+                    data=json.dumps(metadata), timeout=config.api_timeout,
+                    headers=self._headers({
+                        "Content-Type": "application/json; charset=UTF-8",
+                        "X-Upload-Content-Type": mime_type,
+                        "X-Upload-Content-Length": str(size)}))
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if attempt == config.api_retries:
+                    raise DriveUploadException(
+                        "Could not start upload of {}: {}".format(
+                            filename, error))
+            else:
+                if (response.status_code == 200 and
+                        "Location" in response.headers):
+                    return response.headers["Location"]
+                if (response.status_code not in api_client.RETRY_STATUSES or
+                        attempt == config.api_retries):
+                    raise DriveUploadException(
+                        "Could not start upload of {}: HTTP {}".format(
+                            filename, response.status_code))
+            time.sleep(api_client.retry_delay(response, attempt))
+
+    def _put(self, session_uri, content_range, data=b""):
+        """send (part of) a file to an upload session.
+
+        return a pair of the number of bytes the server now has and
+        the uploaded file's metadata (None until it's finished).
+
+        """
+        response = self.session.put(
+            session_uri, data=data, timeout=config.api_timeout,
+            headers=self._headers({"Content-Range": content_range}))
+        if response.status_code in (200, 201):
+            return None, response.json()
+        if response.status_code == 308:
+            return _uploaded_bytes(response), None
+        if response.status_code in (404, 410):
+            raise _SessionExpired()
+        if response.status_code in api_client.RETRY_STATUSES:
+            raise _RetryableError(response)
+        raise DriveUploadException("Upload failed: HTTP {}".format(
+            response.status_code))
+
+    def _send(self, session_uri, upload_file, size, progress, offset=None):
+        import requests
+
+        #offset is the number of bytes the server has, or None if we
+        #need to ask (when resuming an upload, or after an error)
+        result = None
+        attempt = 0
+        while result is None:
+            try:
+                if offset is None or offset >= size:
+                    #ask the server what it has (which, once it has the
+                    #whole file, finishes the upload)
+                    finishing = offset is not None
+                    offset, result = self._put(session_uri,
+                                               "bytes */{}".format(size))
+                    if finishing and result is None and offset >= size:
+                        raise DriveUploadException(
+                            "Upload has every byte, but didn't finish")
+                else:
+                    upload_file.seek(offset)
+                    chunk = upload_file.read(self.chunk_size)
+                    offset, result = self._put(
+                        session_uri, "bytes {}-{}/{}".format(
+                            offset, offset + len(chunk) - 1, size), chunk)
+                    attempt = 0
+            except (_RetryableError, requests.ConnectionError,
+                    requests.Timeout) as error:
+                if attempt >= config.api_retries:
+                    raise DriveUploadException(
+                        "Upload failed: {}".format(error))
+                time.sleep(api_client.retry_delay(
+                    getattr(error, "response", None), attempt))
+                attempt += 1
+                offset = None
+                continue
+
+            if progress is not None:
+                progress.update(size if result is not None else offset)
+
+        return result
+
+    def upload(self, filename, progress=None):
+        """upload filename, continuing an earlier interrupted upload of
+        the same file if there was one.
+
+        progress is an object with update/finish methods used to
+        report the number of bytes sent. Return the uploaded file's id.
+
+        """
+        self._get_credentials()
+        parent_id = self.get_folder_id()
+        size = os.path.getsize(filename)
+        key = self.sessions.key(filename, parent_id)
+
+        result = None
+        restarts = 0
+        with open(filename, "rb") as upload_file:
+            while result is None:
+                session_uri = self.sessions.get(key)
+                offset = None
+                if session_uri is None:
+                    session_uri = self._start(filename, size, parent_id)
+                    self.sessions.set(key, session_uri)
+                    offset = 0
+                try:
+                    result = self._send(session_uri, upload_file, size,
+                                        progress, offset)
+                except _SessionExpired:
+                    #start the upload over in a new session
+                    self.sessions.remove(key)
+                    restarts += 1
+                    if restarts > MAX_SESSION_RESTARTS:
+                        raise DriveUploadException(
+                            "Upload of {} failed: session expired {} "
+                            "times".format(filename, restarts))
+
+        self.sessions.remove(key)
+        if progress is not None:
+            progress.finish()
+        return result["id"]
+
+    def upload_files(self, filenames):
+        """upload several files at once.
+
+        return a dict of the uploaded files' ids, indexed by filename.
+
+        """
+        def _upload(filename):
+            progress = transfer.LineProgress(os.path.basename(filename),
+                                             action="uploaded")
+            return self.upload(filename, progress=progress)
+
+        with ThreadPoolExecutor(
+                max_workers=max(min(self.workers, len(filenames)), 1)
+        ) as executor:
+            file_ids = list(executor.map(_upload, filenames))
+
+        return dict(zip(filenames, file_ids))
 
 def single_xfer_upload(filename):
     """upload a local file to the XFER_FOLDER_NAME folder in the user's
     Google Drive.
 
     """
-    service = _get_service()
-    xfer_id = _get_xfer_id(service)
-    _upload_file(service, filename, xfer_id)
+    return DriveUploader().upload(filename)
+
+def xfer_upload(filenames):
+    """upload local files to the XFER_FOLDER_NAME folder in the user's
+    Google Drive, several at a time
+
+    """
+    return DriveUploader().upload_files(filenames)
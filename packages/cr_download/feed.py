@@ -0,0 +1,209 @@
+"""feed.py: build a podcast RSS feed from episode metadata entries.
+
+The feed is written item by item, straight to the output file. Building
+an item needs the size and duration of its audio file, which are
+probed once and cached (per file, until the file changes). The XML
+for each item is cached too, along with a hash of everything it was
+built from, so only items for new or changed episodes are regenerated.
+
+Audio files which are no longer there (e.g. after being uploaded
+elsewhere) keep the size and duration they were last probed with;
+episodes whose files were never probed are left out of the feed.
+
+"""
+
+from datetime import datetime
+from email.utils import format_datetime
+import hashlib
+import json
+import mimetypes
+import os
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+from cr_download.configuration import data as config
+from cr_download import media_utils
+from . import appdata
+
+FEED_CACHE_FILE = "feed_cache.json"
+
+ITUNES_NS = "http://www.itunes.com/dtds/podcast-1.0.dtd"
+
+_AIRDATE_FORMATS = [("%Y-%m-%dT%H:%M:%S", 19), ("%Y-%m-%d", 10)]
+
+def _parse_airdate(airdate):
+    for date_format, length in _AIRDATE_FORMATS:
+        try:
+            return datetime.strptime(str(airdate)[:length], date_format)
+        except ValueError:
+            pass
+    return None
+
+def _itunes_duration(seconds):
+    seconds = int(seconds)
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60,
+                                     seconds % 60)
+
+def _hash_inputs(*inputs):
+    text = json.dumps(inputs, sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class FeedBuilder:
+    """build RSS feeds, caching file probes and item XML in cache_path
+    (by default, in the cache directory)
+
+    """
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path or appdata.cache_filename(FEED_CACHE_FILE)
+        self.probes = {}
+        self.items = {}
+        self.built = 0
+        self.reused = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_path, "r") as cache_file:
+                data = json.load(cache_file)
+            self.probes = data.get("probes", {})
+            self.items = data.get("items", {})
+        except (IOError, OSError, ValueError):
+            self.probes = {}
+            self.items = {}
+
+    def save(self):
+        directory = os.path.dirname(self.cache_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as cache_file:
+            json.dump({"probes": self.probes, "items": self.items}, cache_file)
+        os.replace(tmp_path, self.cache_path)
+
+    def file_info(self, filename):
+        """get a dict with the size (in bytes) and duration (in seconds) of
+        an audio file, probing it only if it changed since last time.
+
+        if the file doesn't exist any more, return the last probe of it
+        (or None if it was never probed).
+
+        """
+        cached = self.probes.get(filename)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return cached
+
+        if (cached is not None and cached["size"] == stat.st_size and
+                cached["mtime"] == stat.st_mtime):
+            return cached
+
+        duration = float(media_utils.probe(filename)["format"]["duration"])
+        info = {"size": stat.st_size, "mtime": stat.st_mtime,
+                "duration": duration}
+        self.probes[filename] = info
+        return info
+
+    def _item_xml(self, entry, info, base_url):
+        url = base_url + quote(os.path.basename(entry["file"]))
+        mime_type = mimetypes.guess_type(entry["file"])[0] or "audio/mpeg"
+
+        lines = ["<item>",
+                 "<title>{}</title>".format(escape(entry["title"])),
+                 "<guid isPermaLink=\"false\">{}</guid>".format(
+                     escape(entry["id"])),
+                 "<enclosure url=\"{}\" length=\"{}\" type=\"{}\"/>".format(
+                     escape(url, {"\"": "&quot;"}), info["size"], mime_type),
+                 "<itunes:duration>{}</itunes:duration>".format(
+                     _itunes_duration(info["duration"]))]
+
+        airdate = _parse_airdate(entry.get("airdate", ""))
+        if airdate is not None:
+            lines.append("<pubDate>{}</pubDate>".format(
+                format_datetime(airdate)))
+        if entry.get("description"):
+            lines.append("<description>{}</description>".format(
+                escape(entry["description"])))
+
+        lines.append("</item>")
+        return "\n".join(lines) + "\n"
+
+    def item(self, entry, base_url):
+        """get the XML for the feed item for an episode metadata entry, or
+        None if its audio file can't be found
+
+        """
+        info = self.file_info(entry["file"])
+        if info is None:
+            return None
+        inputs_hash = _hash_inputs(entry, info["size"], info["duration"],
+                                   base_url)
+
+        cached = self.items.get(entry["id"])
+        if cached is not None and cached["hash"] == inputs_hash:
+            self.reused += 1
+            return cached["xml"]
+
+        xml = self._item_xml(entry, info, base_url)
+        self.items[entry["id"]] = {"hash": inputs_hash, "xml": xml}
+        self.built += 1
+        return xml
+
+    def write(self, output_file, entries, title=None, link=None,
+              description=None, base_url=None):
+        """write an RSS feed with an item for each of entries (episode
+        metadata entries, as written to metadata files) to output_file,
+        most recent first.
+
+        the feed's title, link and description, and the url audio files
+        are served under, default to the feed_title, feed_link,
+        feed_description and feed_base_url config options.
+
+        """
+        base_url = base_url or config.feed_base_url
+        if not base_url.endswith("/"):
+            base_url += "/"
+
+        entries = sorted(entries, key=lambda entry: str(entry.get("airdate")),
+                         reverse=True)
+
+        tmp_file = output_file + ".tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as feed_file:
+                feed_file.write(
+                    "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
+                    "<rss version=\"2.0\" xmlns:itunes=\"{}\">\n"
+                    "<channel>\n<title>{}</title>\n<link>{}</link>\n"
+                    "<description>{}</description>\n".format(
+                        ITUNES_NS, escape(title or config.feed_title),
+                        escape(link or config.feed_link),
+                        escape(description or config.feed_description)))
+
+                for entry in entries:
+                    item = self.item(entry, base_url)
+                    if item is None:
+                        print("Leaving {} out of the feed: can't find {}"
+                              .format(entry["id"], entry["file"]))
+                        continue
+                    feed_file.write(item)
+
+                feed_file.write("</channel>\n</rss>\n")
+            os.replace(tmp_file, output_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+        #forget items for episodes which aren't in the feed any more
+        ids = set(entry["id"] for entry in entries)
+        self.items = {ep_id: item for ep_id, item in self.items.items()
+                      if ep_id in ids}
+
+        self.save()
+        return output_file
+
+def write_feed(output_file, entries, **kwargs):
+    """write an RSS feed for entries to output_file, using the cached
+    probes and items from previous feeds
+
+    """
+    return FeedBuilder().write(output_file, entries, **kwargs)
@@ -0,0 +1,316 @@
+"""ffmpeg_jobs.py: run ffmpeg processes as managed jobs.
+
+Every ffmpeg invocation in the pipeline goes through this module. A
+job runs ffmpeg with "-progress pipe:1", parses the progress output
+into ProgressEvent objects, records the wall-clock and CPU time the
+process used, and raises an FFmpegError if ffmpeg exits with a
+non-zero status (with the tail of ffmpeg's log in the message).
+
+A JobRunner runs several jobs at once, up to a concurrency limit (the
+ffmpeg_max_jobs config option), and cancels the remaining jobs as soon
+as one of them fails.
+
+"""
+
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+from cr_download.configuration import data as config
+
+#number of bytes of ffmpeg's log to include in error messages
+ERROR_LOG_TAIL = 2000
+
+#number of finished jobs kept for timing summaries
+HISTORY_SIZE = 500
+
+ProgressEvent = namedtuple("ProgressEvent", ["job", "out_time", "total_size",
+                                             "speed", "done"])
+
+class FFmpegError(Exception):
+    """exception thrown when an ffmpeg job fails or is cancelled
+    """
+
+def _parse_speed(speed):
+    try:
+        return float(speed.rstrip("x"))
+    except ValueError:
+        return None
+
+def _parse_progress_block(job, block):
+    out_time = None
+    if block.get("out_time_us", "N/A") != "N/A":
+        out_time = int(block["out_time_us"]) / 1000000.0
+    elif block.get("out_time_ms", "N/A") != "N/A":
+        #despite the name, ffmpeg reports out_time_ms in microseconds
+        out_time = int(block["out_time_ms"]) / 1000000.0
+
+    total_size = None
+    if block.get("total_size", "N/A") != "N/A":
+        total_size = int(block["total_size"])
+
+    return ProgressEvent(job, out_time, total_size,
+                         _parse_speed(block.get("speed", "N/A")),
+                         block.get("progress") == "end")
+
+def _display_time(seconds):
+    seconds = int(seconds)
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, (seconds // 60) % 60,
+                                     seconds % 60)
+
+class ProgressPrinter:
+    """progress callback printing a status line for each job, at most
+    once every interval seconds (and once when the job finishes)
+
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._last_printed = {}
+
+    def __call__(self, event):
+        now = time.time()
+        last = self._last_printed.get(event.job)
+        if not event.done and last is not None and now - last < self.interval:
+            return
+
+        self._last_printed[event.job] = now
+        status = "done" if event.done else "running"
+        processed = ("?" if event.out_time is None
+                     else _display_time(event.out_time))
+        speed = "" if event.speed is None else " ({:.1f}x)".format(event.speed)
+        print("[ffmpeg] {}: {} processed{}, {}".format(
+            event.job.description, processed, speed, status))
+
+def _default_progress_callback():
+    if config.ffmpeg_progress_interval > 0:
+        return ProgressPrinter(config.ffmpeg_progress_interval)
+    return None
+
+def _wait_with_usage(process):
+    """wait for a process to exit, returning the CPU time (user + system)
+    it used, if the platform can report it
+
+    """
+    if hasattr(os, "wait4"):
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            #already reaped by the subprocess module
+            process.wait()
+            return None
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+        return usage.ru_utime + usage.ru_stime
+
+    process.wait()
+    return None
+
+class FFmpegJob:
+    """a single ffmpeg invocation.
+
+    args is the list of ffmpeg arguments (not including the path to
+    the ffmpeg executable). If stdin is subprocess.PIPE, data can be
+    written to the job's stdin attribute after it has been started.
+
+    """
+    def __init__(self, args, description=None, stdin=None,
+                 on_progress=None):
+        self.args = list(args)
+        self.description = description or " ".join(self.args)
+        self.on_progress = on_progress or _default_progress_callback()
+
+        self.returncode = None
+        self.wall_time = None
+        self.cpu_time = None
+        self.last_progress = None
+
+        self._stdin = stdin
+        self._process = None
+        self._log = None
+        self._reader = None
+        self._start_time = None
+        self._cancelled = False
+        #held while starting or cancelling, so a job cancelled as it
+        #starts is either never started or terminated
+        self._lock = threading.Lock()
+
+    def command(self):
+        """get the full command line used to run the job
+        """
+        return ([config.ffmpeg_path, "-hide_banner", "-nostats",
+                 "-loglevel", "error", "-progress", "pipe:1"] + self.args)
+
+    @property
+    def stdin(self):
+        return self._process.stdin
+
+    def start(self):
+        """start the ffmpeg process
+        """
+        with self._lock:
+            if self._cancelled:
+                raise FFmpegError("Job cancelled: {}".format(self.description))
+
+            self._log = tempfile.TemporaryFile()
+            self._start_time = time.time()
+            self._process = subprocess.Popen(
+                self.command(),
+                stdin=(subprocess.DEVNULL if self._stdin is None
+                       else self._stdin),
+                stdout=subprocess.PIPE, stderr=self._log)
+
+        self._reader = threading.Thread(target=self._read_progress)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _read_progress(self):
+        block = {}
+        for line in self._process.stdout:
+            key, _, value = line.decode("utf-8", "replace").strip().partition("=")
+            block[key] = value
+            if key == "progress":
+                self.last_progress = _parse_progress_block(self, block)
+                if self.on_progress is not None:
+                    self.on_progress(self.last_progress)
+                block = {}
+
+    def _log_tail(self):
+        self._log.seek(0, os.SEEK_END)
+        self._log.seek(max(self._log.tell() - ERROR_LOG_TAIL, 0))
+        return self._log.read().decode("utf-8", "replace").strip()
+
+    def wait(self):
+        """wait for the job to finish.
+
+        raise an FFmpegError if ffmpeg exited with a non-zero status.
+
+        """
+        if self._process.stdin is not None and not self._process.stdin.closed:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        self._reader.join()
+        self.cpu_time = _wait_with_usage(self._process)
+        self.wall_time = time.time() - self._start_time
+        self.returncode = self._process.returncode
+        self._process.stdout.close()
+
+        try:
+            if self._cancelled:
+                raise FFmpegError("Job cancelled: {}".format(self.description))
+            if self.returncode != 0:
+                raise FFmpegError("ffmpeg exited with status {} ({}):\n{}".format(
+                    self.returncode, self.description, self._log_tail()))
+        finally:
+            self._log.close()
+            history.append(self)
+
+    def run(self):
+        """start the job and wait for it to finish
+        """
+        self.start()
+        self.wait()
+        return self
+
+    def cancel(self):
+        """stop the job (or prevent it from starting)
+        """
+        with self._lock:
+            self._cancelled = True
+            if self._process is not None and self._process.returncode is None:
+                try:
+                    self._process.terminate()
+                except OSError:
+                    pass
+
+#the most recent jobs which have finished running, for timing summaries
+#(bounded, since a long-running process can run any number of jobs)
+history = deque(maxlen=HISTORY_SIZE)
+
+class JobRunner:
+    """run ffmpeg jobs concurrently, up to max_jobs at a time.
+
+    if max_jobs is not specified, use the ffmpeg_max_jobs config
+    option (or the number of CPUs if that's 0).
+
+    """
+    def __init__(self, max_jobs=None, on_progress=None):
+        if max_jobs is None:
+            max_jobs = config.ffmpeg_max_jobs
+        self.max_jobs = max_jobs or os.cpu_count() or 1
+        self.on_progress = on_progress
+        self._jobs = []
+        self._lock = threading.Lock()
+
+    def run(self, jobs, on_done=None):
+        """run all of the given jobs, and wait for them to finish.
+
+        if on_done is given, it's called with each job as soon as it
+        finishes successfully. If any job fails, cancel all of the
+        others and raise the resulting FFmpegError.
+
+        """
+        jobs = list(jobs)
+        with self._lock:
+            self._jobs += jobs
+        if self.on_progress is not None:
+            for job in jobs:
+                job.on_progress = self.on_progress
+
+        def _run(job):
+            job.run()
+            if on_done is not None:
+                on_done(job)
+
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+            futures = [executor.submit(_run, job) for job in jobs]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in done:
+                if future.exception() is not None:
+                    self.cancel()
+                    raise future.exception()
+
+        return jobs
+
+    def cancel(self):
+        """cancel every running or pending job
+        """
+        with self._lock:
+            for job in self._jobs:
+                job.cancel()
+
+def run(args, description=None, on_progress=None):
+    """run a single ffmpeg job (with the given arguments) to completion
+    """
+    return FFmpegJob(args, description, on_progress=on_progress).run()
+
+def run_all(jobs, max_jobs=None, on_progress=None, on_done=None):
+    """run a collection of FFmpegJobs using a JobRunner
+    """
+    return JobRunner(max_jobs, on_progress).run(jobs, on_done)
+
+def summary(jobs=None):
+    """get a string summarizing wall and CPU time for a list of finished
+    jobs (by default, the last HISTORY_SIZE jobs run)
+
+    """
+    if jobs is None:
+        jobs = history
+
+    lines = []
+    for job in jobs:
+        if job.wall_time is None:
+            continue
+        cpu_time = "?" if job.cpu_time is None else "{:.1f}s".format(
+            job.cpu_time)
+        lines.append("{:8.1f}s wall {:>8} cpu  {}".format(
+            job.wall_time, cpu_time, job.description))
+    return "\n".join(lines)
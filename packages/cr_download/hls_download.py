@@ -0,0 +1,231 @@
+"""hls_download.py: download HLS (m3u8) streams by fetching their media
+segments concurrently.
+
+Segments are fetched by a pool of worker threads, a bounded number at
+a time. They are written to the output file strictly in playlist
+order (a segment which arrives early waits in a reorder buffer until
+the ones before it are written), and writes are batched into large
+sequential blocks.
+
+"""
+
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import time
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+from cr_download.configuration import data as config
+from cr_download.download_journal import DownloadJournal
+from cr_download.transfer import TransferStats, make_session
+
+#number of segments to keep in flight per worker
+SEGMENTS_PER_WORKER = 2
+
+#bytes to collect in memory before writing them to the output file
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+
+SEGMENT_RETRIES = 3
+REQUEST_TIMEOUT = 30
+
+Segment = namedtuple("Segment", ["index", "url", "duration", "start"])
+Variant = namedtuple("Variant", ["url", "bandwidth", "name"])
+
+_ATTRIBUTE_REGEX = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+class HLSException(Exception):
+    """exception thrown when a playlist can't be downloaded
+    """
+
+def _parse_attributes(attribute_list):
+    return {key: value.strip('"')
+            for key, value in _ATTRIBUTE_REGEX.findall(attribute_list)}
+
+def parse_playlist(text, base_url):
+    """parse the text of an m3u8 playlist.
+
+    return a tuple (variants, segments): for a master playlist, the
+    array of variant streams it lists, and for a media playlist, its
+    array of media segments (the other array is empty).
+
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or lines[0] != "#EXTM3U":
+        raise HLSException("Not an m3u8 playlist: {}".format(base_url))
+
+    variants = []
+    segments = []
+    duration = None
+    variant_attrs = None
+    position = 0.0
+
+    for line in lines[1:]:
+        if line.startswith("#EXT-X-STREAM-INF:"):
+            variant_attrs = _parse_attributes(line.split(":", 1)[1])
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",")[0])
+        elif line.startswith("#EXT-X-KEY:"):
+            if _parse_attributes(line.split(":", 1)[1]).get("METHOD") != "NONE":
+                raise HLSException("Encrypted playlists are not supported")
+        elif line.startswith("#EXT-X-MAP:"):
+            uri = _parse_attributes(line.split(":", 1)[1]).get("URI")
+            if uri and not segments:
+                segments.append(Segment(0, urljoin(base_url, uri), 0.0, 0.0))
+        elif line.startswith("#"):
+            continue
+        elif variant_attrs is not None:
+            variants.append(Variant(
+                urljoin(base_url, line),
+                int(variant_attrs.get("BANDWIDTH", 0)),
+                variant_attrs.get("VIDEO", variant_attrs.get("NAME"))))
+            variant_attrs = None
+        else:
+            segments.append(Segment(len(segments), urljoin(base_url, line),
+                                    duration or 0.0, position))
+            position += duration or 0.0
+            duration = None
+
+    return variants, segments
+
+def get_segments(playlist_url, session, variant=None):
+    """get the array of media segments for a playlist url.
+
+    if the url is a master playlist, use the variant named variant
+    (or the one with the highest bandwidth).
+
+    """
+    response = session.get(playlist_url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    variants, segments = parse_playlist(response.text, response.url)
+
+    if variants:
+        chosen = [var for var in variants if var.name == variant]
+        if not chosen:
+            chosen = sorted(variants, key=lambda var: var.bandwidth)[-1:]
+        return get_segments(chosen[0].url, session)
+
+    return segments
+
+def _fetch_segment(session, segment, rate_limiter=None):
+    for attempt in range(SEGMENT_RETRIES):
+        try:
+            response = session.get(segment.url, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            if rate_limiter is not None:
+                rate_limiter.consume(len(response.content))
+            return response.content
+        except requests.RequestException:
+            if attempt == SEGMENT_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+def segment_name(segment):
+    """get a name for a segment which stays the same across playlist
+    requests (i.e. without any access token in the query string)
+
+    """
+    return os.path.basename(urlparse(segment.url).path)
+
+def download_segments(segments, output_file, session=None, workers=None,
+                      progress=None, journal=None, rate_limiter=None):
+    """download an array of segments, writing them in order to the
+    open file output_file.
+
+    progress is an optional function which is called with the total
+    number of bytes downloaded after each segment is written.
+
+    if a DownloadJournal is given, each segment is recorded in it once
+    it has been written to disk. If a RateLimiter is given, the
+    workers share its bandwidth limit.
+
+    return a TransferStats object for the download.
+
+    """
+    workers = workers or config.download_workers
+    if session is None:
+        session = make_session(workers)
+
+    stats = TransferStats()
+    write_buffer = bytearray()
+    buffered_segments = []
+    in_flight = deque()
+    max_in_flight = workers * SEGMENTS_PER_WORKER
+
+    def _flush():
+        output_file.write(write_buffer)
+        output_file.flush()
+        del write_buffer[:]
+        if journal is not None and buffered_segments:
+            for name, size in buffered_segments:
+                journal.add_segment(name, size)
+            journal.save()
+        del buffered_segments[:]
+
+    def _write_next():
+        segment, future = in_flight.popleft()
+        data = future.result()
+        write_buffer.extend(data)
+        buffered_segments.append((segment_name(segment), len(data)))
+        stats.add(len(data))
+        if len(write_buffer) >= WRITE_BUFFER_SIZE:
+            _flush()
+        if progress is not None:
+            progress(stats.bytes)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for segment in segments:
+                if len(in_flight) >= max_in_flight:
+                    _write_next()
+                in_flight.append((segment, executor.submit(
+                    _fetch_segment, session, segment, rate_limiter)))
+            while in_flight:
+                _write_next()
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+            #whatever was fetched in order is still worth keeping
+            _flush()
+
+    stats.finish()
+    return stats
+
+def download(playlist_url, output_filename, session=None, workers=None,
+             variant=None, progress=None, source=None, rate_limiter=None):
+    """download the HLS stream at playlist_url to output_filename.
+
+    if source is given, it's a stable identifier for the stream (the
+    playlist url itself usually contains a short-lived access token),
+    and progress is kept in a DownloadJournal so that an interrupted
+    download only fetches the segments which are missing.
+
+    return a TransferStats object for the download.
+
+    """
+    workers = workers or config.download_workers
+    if session is None:
+        session = make_session(workers)
+
+    segments = get_segments(playlist_url, session, variant)
+
+    if source is None:
+        with open(output_filename, "wb") as output_file:
+            return download_segments(segments, output_file, session, workers,
+                                     progress, rate_limiter=rate_limiter)
+
+    journal = DownloadJournal(output_filename, source)
+    journal.verify([segment_name(segment) for segment in segments])
+    done = len(journal.segments)
+
+    mode = "r+b" if done and os.path.exists(output_filename) else "wb"
+    with open(output_filename, mode) as output_file:
+        output_file.truncate(journal.segment_offset())
+        output_file.seek(journal.segment_offset())
+        stats = download_segments(segments[done:], output_file, session,
+                                  workers, progress, journal, rate_limiter)
+
+    journal.remove()
+    return stats
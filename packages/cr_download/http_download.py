@@ -0,0 +1,290 @@
+"""http_download.py: download files over plain HTTP(S), resuming
+interrupted downloads.
+
+Progress is recorded in a DownloadJournal next to the output file.
+When a download is restarted (in the same run after a dropped
+connection, or in a later run) only the byte ranges missing from the
+file are requested again, using HTTP Range requests if the server
+supports them.
+
+If the server supports Range requests, a download can also be split
+into parts which are fetched over several pooled connections at
+once, and written in place into a preallocated output file. This gets
+around servers which throttle each connection.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+import requests
+
+from cr_download.configuration import data as config
+from cr_download import api_client
+from cr_download.download_journal import DownloadJournal
+from cr_download.transfer import TransferStats, make_session
+
+CHUNK_SIZE = 1024 * 1024
+
+#size of the parts a download is split into for parallel connections
+PART_SIZE = 8 * 1024 * 1024
+
+#save the journal after this many bytes have been written
+JOURNAL_INTERVAL = 8 * 1024 * 1024
+
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 5
+
+class DownloadException(Exception):
+    """exception thrown when a file can't be downloaded completely
+    """
+
+def _content_range_total(response):
+    content_range = response.headers.get("Content-Range", "")
+    total = content_range.rpartition("/")[2]
+    if total.isdigit():
+        return int(total)
+    return None
+
+def _open_output(filename):
+    if os.path.exists(filename):
+        return open(filename, "r+b")
+    return open(filename, "w+b")
+
+def _fetch_range(session, url, output_file, journal, start, end,
+                 stats, headers=None, progress=None, rate_limiter=None,
+                 require_range=False):
+    """fetch bytes [start, end) of url (to the end of the file if end is
+    None) and write them to output_file at the same offset.
+
+    if require_range is specified, raise a DownloadException if the
+    server ignores the range and sends the whole file.
+
+    return a tuple (position, finished): the position in the file
+    reached, and whether the response was read to the end (i.e. the
+    connection wasn't dropped).
+
+    """
+    request_headers = dict(headers or {})
+    if start > 0 or end is not None:
+        request_headers["Range"] = "bytes={}-{}".format(
+            start, "" if end is None else end - 1)
+
+    response = session.get(url, headers=request_headers, stream=True,
+                           timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+
+    if response.status_code == 206:
+        total = _content_range_total(response)
+    else:
+        if require_range:
+            response.close()
+            raise DownloadException(
+                "{} stopped honoring range requests".format(url))
+        #the server ignored the range, so we're getting the whole file
+        if start > 0:
+            journal.reset()
+            start = 0
+        total = int(response.headers["Content-Length"]) if (
+            "Content-Length" in response.headers) else None
+        end = None
+
+    if total is not None:
+        if journal.size is not None and journal.size != total:
+            response.close()
+            raise DownloadException(
+                "{} changed size since the download started".format(url))
+        journal.size = total
+
+    position = start
+    last_saved = start
+    finished = False
+    output_file.seek(start)
+    try:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            if end is not None:
+                chunk = chunk[:end - position]
+            output_file.write(chunk)
+            position += len(chunk)
+            stats.add(len(chunk))
+            if rate_limiter is not None:
+                rate_limiter.consume(len(chunk))
+            if progress is not None:
+                progress(stats.bytes)
+
+            if position - last_saved >= JOURNAL_INTERVAL:
+                output_file.flush()
+                journal.add_range(last_saved, position)
+                journal.save()
+                last_saved = position
+
+            if end is not None and position >= end:
+                break
+        finished = True
+    except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+        pass
+    finally:
+        response.close()
+        output_file.flush()
+        journal.add_range(last_saved, position)
+        journal.save()
+
+    return position, finished
+
+def _probe_size(session, url, headers=None):
+    """find the total size of the file at url, if the server supports
+    range requests for it (otherwise, return None)
+
+    """
+    request_headers = dict(headers or {})
+    request_headers["Range"] = "bytes=0-0"
+    response = session.get(url, headers=request_headers, stream=True,
+                           timeout=REQUEST_TIMEOUT)
+    try:
+        response.raise_for_status()
+        if response.status_code != 206:
+            return None
+        return _content_range_total(response)
+    finally:
+        response.close()
+
+def _split_ranges(ranges, part_size):
+    parts = []
+    for start, end in ranges:
+        for part_start in range(start, end, part_size):
+            parts.append((part_start, min(part_start + part_size, end)))
+    return parts
+
+def _download_part(session, url, output_filename, journal, part, stats,
+                   headers, progress, rate_limiter):
+    """download a single part [start, end) of a file, retrying (from
+    where it left off) if the connection is dropped or the server
+    fails with a status it might recover from
+
+    """
+    start, end = part
+    retries = 0
+    with open(output_filename, "r+b") as output_file:
+        while start < end:
+            error_response = None
+            try:
+                position, _ = _fetch_range(
+                    session, url, output_file, journal, start, end, stats,
+                    headers, progress, rate_limiter, require_range=True)
+            except requests.HTTPError as error:
+                if (error.response is None or error.response.status_code
+                        not in api_client.RETRY_STATUSES):
+                    raise
+                error_response = error.response
+                position = start
+            except (requests.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError):
+                position = start
+
+            if position == start:
+                retries += 1
+                if retries > MAX_RETRIES:
+                    raise DownloadException(
+                        "Could not download bytes {}-{} of {}".format(
+                            start, end, url))
+                time.sleep(api_client.retry_delay(error_response, retries))
+            else:
+                retries = 0
+            start = position
+
+def _download_parallel(session, url, output_filename, journal, stats,
+                       connections, headers, progress, rate_limiter):
+    with _open_output(output_filename) as output_file:
+        #preallocate the file so every part can be written in place
+        output_file.truncate(journal.size)
+
+    parts = _split_ranges(journal.missing_ranges(), PART_SIZE)
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        futures = [executor.submit(_download_part, session, url,
+                                   output_filename, journal, part, stats,
+                                   headers, progress, rate_limiter)
+                   for part in parts]
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+def _download_serial(session, url, output_filename, journal, stats,
+                     headers, progress, rate_limiter):
+    with _open_output(output_filename) as output_file:
+        retries = 0
+        missing = journal.missing_ranges()
+        while missing:
+            start, end = missing[0]
+            try:
+                position, finished = _fetch_range(
+                    session, url, output_file, journal,
+                    start, end, stats, headers, progress, rate_limiter)
+            except requests.ConnectionError:
+                position, finished = start, False
+
+            if journal.size is None and finished:
+                #no length was given, so a clean end of stream means
+                #we have everything
+                journal.size = position
+            missing = journal.missing_ranges()
+
+            if missing and position == start:
+                retries += 1
+                if retries > MAX_RETRIES:
+                    raise DownloadException(
+                        "Could not download {}".format(url))
+                time.sleep(2 ** retries)
+            elif missing:
+                retries = 0
+
+        output_file.truncate(journal.size)
+
+def download(url, output_filename, source=None, session=None, headers=None,
+             progress=None, rate_limiter=None, connections=None):
+    """download url to output_filename, resuming a previous partial
+    download if a journal for it exists.
+
+    source is a stable identifier for what is being downloaded (by
+    default, the url itself) used to match up the journal.
+
+    if the server supports range requests, the download is split over
+    up to connections connections at once (by default, the
+    download_workers config option).
+
+    return a TransferStats object for the download.
+
+    """
+    connections = connections or config.download_workers
+    if session is None:
+        session = make_session(connections)
+
+    journal = DownloadJournal(output_filename, source or url)
+    journal.verify()
+
+    stats = TransferStats()
+    size = None
+    if connections > 1:
+        size = _probe_size(session, url, headers)
+
+    if size is not None:
+        if journal.size not in (None, size):
+            journal.reset()
+        journal.size = size
+        _download_parallel(session, url, output_filename, journal, stats,
+                           connections, headers, progress, rate_limiter)
+    else:
+        _download_serial(session, url, output_filename, journal, stats,
+                         headers, progress, rate_limiter)
+
+    if (journal.missing_ranges() or
+            os.path.getsize(output_filename) != journal.size):
+        raise DownloadException("Downloaded file {} is incomplete".format(
+            output_filename))
+
+    journal.remove()
+    stats.finish()
+    return stats
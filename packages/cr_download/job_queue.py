@@ -0,0 +1,165 @@
+"""job_queue.py: a persistent queue of episodes to download.
+
+Jobs are stored in an SQLite database in the application data
+directory, so episodes found by the watch daemon are processed even if
+it's restarted. Each job is keyed by the url of its stream, so the
+same stream is never queued twice. A job is queued, then running,
+then done or failed; jobs left running when the daemon stopped are
+queued again when it starts.
+
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from . import appdata
+
+QUEUE_FILE = "jobs.db"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT UNIQUE,
+    title TEXT,
+    payload TEXT,
+    status TEXT,
+    attempts INTEGER DEFAULT 0,
+    error TEXT,
+    created REAL,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, id);
+"""
+
+#a job in the queue. payload is the (JSON) data it was queued with
+Job = namedtuple("Job", ["id", "key", "title", "payload", "status",
+                         "attempts", "error"])
+
+def _job(row):
+    return Job(row["id"], row["key"], row["title"], json.loads(row["payload"]),
+               row["status"], row["attempts"], row["error"])
+
+class JobQueue:
+    """the queue of jobs, stored at path (by default, in the application
+    data directory)
+
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(appdata.get_userdata_dir(),
+                                         QUEUE_FILE)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _set_status(self, job_id, status, error=None):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? "
+                "WHERE id = ?", (status, error, time.time(), job_id))
+
+    def enqueue(self, key, title, payload, status=QUEUED):
+        """add a job to the queue, unless there's already one with the
+        same key. payload is any JSON-serializable data.
+
+        return True if the job was added.
+
+        """
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO jobs "
+                "(key, title, payload, status, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, title, json.dumps(payload), status, now, now))
+        return cursor.rowcount > 0
+
+    def claim(self):
+        """mark the oldest queued job as running and return it, or return
+        None if no jobs are queued
+
+        """
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY id LIMIT 1",
+                (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, "
+                "updated = ? WHERE id = ?", (RUNNING, time.time(), row["id"]))
+        return _job(row)._replace(status=RUNNING,
+                                  attempts=row["attempts"] + 1)
+
+    def complete(self, job_id):
+        """mark a job as done
+        """
+        self._set_status(job_id, DONE)
+
+    def fail(self, job_id, error, retry=False):
+        """mark a job as failed with the given error message, or queue it
+        to be tried again if retry is specified
+
+        """
+        self._set_status(job_id, QUEUED if retry else FAILED, str(error))
+
+    def requeue_running(self):
+        """queue every job marked as running again (after the process
+        running them stopped). Return the number of jobs requeued.
+
+        """
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, updated = ? WHERE status = ?",
+                (QUEUED, time.time(), RUNNING))
+        return cursor.rowcount
+
+    def is_empty(self):
+        """check whether any job has ever been added to the queue
+        """
+        with self._lock:
+            row = self._db.execute("SELECT COUNT(*) FROM jobs").fetchone()
+        return row[0] == 0
+
+    def jobs(self, status=None):
+        """get every job (with the given status, if specified), oldest first
+        """
+        sql = "SELECT * FROM jobs"
+        params = []
+        if status is not None:
+            sql += " WHERE status = ?"
+            params.append(status)
+        with self._lock:
+            rows = self._db.execute(sql + " ORDER BY id", params).fetchall()
+        return [_job(row) for row in rows]
+
+    def counts(self):
+        """get a dict of the number of jobs with each status
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {row[0]: row[1] for row in rows}
@@ -7,14 +7,36 @@ Many of these functions are simple wrappers for ffmpeg functionality.
 
 import os
 import re
+import json
+import math
 import tempfile
 import subprocess
 
 from cr_download.configuration import data as config
+from cr_download import ffmpeg_jobs
 
 #max length (in seconds) of an audio file cut by mp4_to_audio_segments
 AUDIO_SEGMENT_LENGTH = 1800
 
+#seconds before the start of a segment to seek to when extracting
+#segments in parallel
+SEEK_PREROLL = 10
+
+#ffmpeg raw PCM formats, indexed by sample width (in bytes)
+PCM_FORMATS = {1:"u8", 2:"s16le", 3:"s24le", 4:"s32le"}
+
+#containers an audio stream can be copied into without re-encoding,
+#indexed by codec name (first entry is the preferred container)
+COPY_CONTAINERS = {
+    "aac":[".m4a", ".aac", ".mp4", ".mka"],
+    "mp3":[".mp3", ".mka"],
+    "opus":[".opus", ".ogg", ".webm", ".mka"],
+    "vorbis":[".ogg", ".webm", ".mka"],
+    "flac":[".flac", ".mka"]
+}
+
+MediaException = ffmpeg_jobs.FFmpegError
+
 def file_list(directory, pattern):
     """return a sorted array of files in the given directory matching a
     specified regex.
@@ -29,7 +51,7 @@ def file_list(directory, pattern):
                             if re.match(pattern, fname)])
     return matched_files
 
-def merge_audio_files(files, output):
+def merge_audio_files(files, output, on_progress=None):
     """merge a sequence of audio files into a single one, using ffmpeg.
 
     """
@@ -37,8 +59,85 @@ def merge_audio_files(files, output):
         for name in files:
             filelist.write("file '{}'\n".format(name))
         filelist.flush()
-        subprocess.call([config.ffmpeg_path, "-hide_banner", "-f", "concat",
-                         "-safe", "0", "-i", filelist.name, output])
+        ffmpeg_jobs.run(["-y", "-f", "concat", "-safe", "0",
+                         "-i", filelist.name, output],
+                        description="merge {}".format(output),
+                        on_progress=on_progress)
+
+    return output
+
+def probe(filename):
+    """get the format and stream information ffprobe reports for a media
+    file, as a dict
+
+    """
+    try:
+        output = subprocess.check_output(
+            [config.ffprobe_path, "-v", "error", "-of", "json",
+             "-show_format", "-show_streams", filename])
+    except subprocess.CalledProcessError:
+        raise MediaException("ffprobe could not read {}".format(filename))
+    return json.loads(output.decode("utf-8"))
+
+def audio_stream_info(filename):
+    """get ffprobe's description of the first audio stream in a file
+    """
+    for stream in probe(filename)["streams"]:
+        if stream.get("codec_type") == "audio":
+            return stream
+
+    raise MediaException("{} has no audio stream".format(filename))
+
+def copy_container(codec_name):
+    """get the preferred container extension for an audio stream copied
+    without re-encoding, or None if there isn't one
+
+    """
+    containers = COPY_CONTAINERS.get(codec_name)
+    if containers:
+        return containers[0]
+    return None
+
+def extract_audio(video_files, output, allow_rename=False, on_progress=None):
+    """extract the audio from a sequence of video files into a single
+    audio file, in one pass of ffmpeg.
+
+    if the container implied by output's extension can hold the source
+    audio codec, the audio is copied without re-encoding. Otherwise, if
+    allow_rename is specified, the extension of output is changed to a
+    container which can hold it; failing that, the audio is transcoded.
+
+    return the name of the file created.
+
+    """
+    codec = audio_stream_info(video_files[0]).get("codec_name")
+    ext = os.path.splitext(output)[1].lower()
+
+    if ext not in COPY_CONTAINERS.get(codec, []) and allow_rename:
+        new_ext = copy_container(codec)
+        if new_ext:
+            output = change_ext(output, new_ext)
+            ext = new_ext
+
+    if ext in COPY_CONTAINERS.get(codec, []):
+        codec_args = ["-c:a", "copy"]
+    else:
+        codec_args = []
+
+    with tempfile.NamedTemporaryFile(mode="w+") as filelist:
+        if len(video_files) > 1:
+            for name in video_files:
+                filelist.write("file '{}'\n".format(os.path.abspath(name)))
+            filelist.flush()
+            input_args = ["-f", "concat", "-safe", "0", "-i", filelist.name]
+        else:
+            input_args = ["-i", video_files[0]]
+
+        ffmpeg_jobs.run(["-y"] + input_args +
+                        ["-vn", "-map", "0:a:0"] + codec_args + [output],
+                        description="extract audio to {}".format(
+                            os.path.basename(output)),
+                        on_progress=on_progress)
 
     return output
 
@@ -47,26 +146,88 @@ def change_ext(filename, new_ext):
     """
     return re.sub(r"\.\w+$", new_ext, filename)
 
-def mp4_to_audio_segments(video_file, output_dir, segment_fmt):
+def _segment_range_job(video_file, output_file, start, end, on_progress):
+    """get an ffmpeg job extracting audio between start and end seconds
+    (either of which may be None) from the beginning of video_file
+
+    """
+    #seek (quickly, on the input) to a little before the start of the
+    #range, so the decoder has settled by the time it gets there, then
+    #let atrim cut at the exact sample. Timestamps after an input seek
+    #count from where it landed, so the trims are relative to that.
+    seek = max((start or 0) - SEEK_PREROLL, 0)
+    trims = []
+    if start is not None:
+        trims.append("start={:.6f}".format(start - seek))
+    if end is not None:
+        trims.append("end={:.6f}".format(end - seek))
+
+    filters = "asetpts=PTS-STARTPTS"
+    if trims:
+        filters = "atrim={},{}".format(":".join(trims), filters)
+
+    seek_args = ["-ss", "{:.6f}".format(seek)] if seek else []
+    return ffmpeg_jobs.FFmpegJob(
+        ["-y"] + seek_args + ["-i", video_file,
+                              "-vn", "-map", "0:a:0", "-af", filters,
+                              output_file],
+        description="extract {}".format(os.path.basename(output_file)),
+        on_progress=on_progress)
+
+def _parallel_audio_segments(video_file, pattern, on_progress):
+    duration = float(probe(video_file)["format"]["duration"])
+
+    num_segments = max(int(math.ceil(duration / AUDIO_SEGMENT_LENGTH)), 1)
+    boundaries = ([None] +
+                  [i * AUDIO_SEGMENT_LENGTH for i in range(1, num_segments)] +
+                  [None])
+
+    split_files = [pattern % i for i in range(num_segments)]
+    ffmpeg_jobs.run_all(
+        _segment_range_job(video_file, split_files[i],
+                           boundaries[i], boundaries[i + 1], on_progress)
+        for i in range(num_segments)
+    )
+    return split_files
+
+def mp4_to_audio_segments(video_file, output_dir, segment_fmt,
+                          on_progress=None, parallel=None):
     """cut an audio file into segments of length at most
     AUDIO_SEGMENT_LENGTH seconds, using ffmpeg
 
     file format of the output segments is specificed by segment_fmt.
 
+    if parallel is specified (by default, if the parallel_segmenting
+    config option is set), probe the duration of the video and extract
+    each segment with a separate ffmpeg process, running concurrently.
+    The segments then end at exact multiples of AUDIO_SEGMENT_LENGTH
+    rather than at the packet boundaries ffmpeg's segment muxer picks,
+    but put together they hold the same audio. (For lossy codecs which
+    add noise when decoding, like AAC, samples after the first segment
+    can differ by a rounding error, since each is decoded separately.)
+
     return the filenames of the output files, relative to location of
     output_dir.
 
     """
+    if parallel is None:
+        parallel = config.parallel_segmenting
+
     basename = os.path.basename(video_file)
     pattern = os.path.join(
         output_dir,
         change_ext(basename, "%03d{}".format(segment_fmt))
     )
+    if parallel:
+        return _parallel_audio_segments(video_file, pattern, on_progress)
+
     with tempfile.NamedTemporaryFile(mode='w+') as filelist:
-        subprocess.call([config.ffmpeg_path, "-hide_banner", "-i", video_file,
+        ffmpeg_jobs.run(["-y", "-i", video_file, "-vn",
                          "-f", "segment", "-segment_time",
                          str(AUDIO_SEGMENT_LENGTH), "-segment_list",
-                         filelist.name, pattern])
+                         filelist.name, pattern],
+                        description="split {}".format(basename),
+                        on_progress=on_progress)
         split_files = [filename.strip() for filename in filelist]
 
     split_files = [os.path.join(output_dir, filename)
@@ -74,13 +235,95 @@ def mp4_to_audio_segments(video_file, output_dir, segment_fmt):
 
     return split_files
 
-def ffmpeg_convert(input_file, output_file):
+def ffmpeg_convert(input_file, output_file, on_progress=None):
     """wrapper function for ffmpeg video to audio conversion.
     """
-    subprocess.call([config.ffmpeg_path, "-hide_banner", "-i",
-                     input_file, output_file])
+    ffmpeg_jobs.run(["-y", "-i", input_file, output_file],
+                    description="convert {}".format(
+                        os.path.basename(input_file)),
+                    on_progress=on_progress)
     return output_file
 
+class EncoderPipe:
+    """write raw PCM frames straight into an ffmpeg encoder process.
+
+    this provides the part of the wave.Wave_write interface used by
+    the autocutter (setparams/writeframes/close), so audio can be
+    encoded to its final format without first being written to a
+    temporary .wav file.
+
+    """
+    def __init__(self, output_file, on_progress=None):
+        self.output_file = output_file
+        self.on_progress = on_progress
+        self._job = None
+
+    def setparams(self, params):
+        """start the encoder, given wav file parameters for the input frames
+        """
+        nchannels, sampwidth, framerate = params[:3]
+        if sampwidth not in PCM_FORMATS:
+            raise MediaException(
+                "Unsupported sample width: {}".format(sampwidth))
+
+        #ffmpeg can't ask before overwriting the output, since stdin
+        #is carrying the audio data
+        self._job = ffmpeg_jobs.FFmpegJob(
+            ["-y", "-f", PCM_FORMATS[sampwidth], "-ar", str(framerate),
+             "-ac", str(nchannels), "-i", "pipe:0", self.output_file],
+            description="encode {}".format(
+                os.path.basename(self.output_file)),
+            stdin=subprocess.PIPE, on_progress=self.on_progress)
+        self._job.start()
+
+    def writeframes(self, frames):
+        """send a block of PCM frames to the encoder
+        """
+        if self._job is None:
+            raise MediaException("Encoder for {} is not running".format(
+                self.output_file))
+        try:
+            self._job.stdin.write(frames)
+        except BrokenPipeError:
+            #the encoder died; wait() reports why
+            self._finish()
+
+    def _finish(self):
+        job, self._job = self._job, None
+        job.wait()
+
+    def close(self):
+        """finish encoding and wait for the encoder to exit
+        """
+        if self._job is not None:
+            self._finish()
+
+    def cancel(self):
+        """stop the encoder without waiting for it to finish
+        """
+        if self._job is not None:
+            self._job.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None:
+            self.cancel()
+        try:
+            self.close()
+        except MediaException:
+            #don't hide the exception which caused the cancellation
+            if exc_type is None:
+                raise
+
+def open_encoder(output_file, on_progress=None):
+    """open an EncoderPipe writing to output_file (in the format implied
+    by its extension)
+
+    """
+    return EncoderPipe(output_file, on_progress)
+
 def _bytes_in_units(num_bytes, units):
     if units == "kB":
         return "{0:.1f}".format(num_bytes / 1000.0)
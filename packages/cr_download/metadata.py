@@ -1,17 +1,10 @@
 """metadata.py: produce YAML files containing metadata about
 downloaded CR episodes """
 
-from __future__ import print_function
-from __future__ import unicode_literals
-from builtins import input
-
 import re
 import os
-from pathlib import Path
-
-from ruamel.yaml import YAML
 
-yaml = YAML(typ="safe")
+from . import catalog
 
 def parse_critrole_title(title):
     """parse a critical role episode title to extract campaign and episode #"""
@@ -63,9 +56,8 @@ def format_critrole_title(ep_data, short=True):
     return ep_title
 
 
-def write_metadata_file(output_file, audio_files, streams):
-    """write a YAML file to output_file with an entry for each audio file
-    provided.
+def episode_entries(audio_files, streams):
+    """get a metadata entry for each audio file provided.
 
     audio_files: dict of arrays of files downloaded (indexed by
     filename, possibly with wildcard)
@@ -73,8 +65,11 @@ def write_metadata_file(output_file, audio_files, streams):
     streams: dict of arrays of stream_data dicts, also indexed by
     filename (with wildcard if present)
 
+    return an array of tuples (entry, episode_name_data, part), where
+    part is None unless the episode was split into several files.
+
     """
-    episodes = {}
+    entries = []
     for title, files in audio_files.items():
         part = 1
         for audio_file in files:
@@ -82,6 +77,11 @@ def write_metadata_file(output_file, audio_files, streams):
             episode_name_data = parse_critrole_title(stream["title"])
             ep_title = format_critrole_title(episode_name_data, short=False)
             ep_id = format_critrole_title(episode_name_data)
+            if not ep_id:
+                #the title doesn't name an episode, so the entry is
+                #identified by the stream it came from instead
+                ep_title = stream["title"]
+                ep_id = stream.url
             if len(files) > 1:
                 ep_title += " part {}".format(part)
                 ep_id += "p{:02d}".format(part)
@@ -95,8 +95,54 @@ def write_metadata_file(output_file, audio_files, streams):
             if hasattr(stream, "description"):
                 ep["description"] = stream.description
 
-            episodes[ep_id] = ep
+            entries.append((ep, episode_name_data,
+                            part if len(files) > 1 else None))
 
             part += 1
 
-    yaml.dump(episodes, Path(output_file))
+    return entries
+
+def catalog_episodes(audio_files, streams, episode_catalog):
+    """add an entry for each audio file provided to an EpisodeCatalog
+    (audio_files and streams are as for episode_entries).
+
+    return a tuple (entries, changed): the array of entries for the
+    audio files, and whether any of them changed the catalog.
+
+    """
+    changed = False
+    entries = []
+    for ep, episode_name_data, part in episode_entries(audio_files, streams):
+        changed = episode_catalog.upsert(
+            ep, episode_name_data.get("campaign"),
+            episode_name_data.get("episode"), part) or changed
+        entries.append(ep)
+
+    return entries, changed
+
+def write_metadata_file(output_file, audio_files, streams, episode_catalog=None):
+    """add an entry for each audio file provided to the episode catalog,
+    then write a YAML file to output_file with an entry for every
+    episode in the catalog.
+
+    audio_files and streams are as for episode_entries. Only the
+    catalog rows for these files are touched, and the YAML file is
+    only rewritten if any of them changed.
+
+    return the array of entries for the audio files.
+
+    """
+    own_catalog = episode_catalog is None
+    if own_catalog:
+        episode_catalog = catalog.EpisodeCatalog()
+
+    try:
+        entries, changed = catalog_episodes(audio_files, streams,
+                                            episode_catalog)
+        if changed or not os.path.exists(output_file):
+            episode_catalog.export_yaml(output_file)
+    finally:
+        if own_catalog:
+            episode_catalog.close()
+
+    return entries
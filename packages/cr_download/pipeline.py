@@ -0,0 +1,176 @@
+"""pipeline.py: run episodes through a sequence of processing stages
+concurrently.
+
+Each Stage has its own worker threads, and stages are connected by
+bounded queues, so e.g. one episode can be autocut while the next one
+is still downloading. Every stage keeps track of how long its workers
+spend busy and waiting, so the pipeline can report how well each
+stage was utilized.
+
+"""
+
+import queue
+import threading
+import time
+
+_DONE = object()
+
+class Stage:
+    """a stage of a pipeline: func is called on each item passed to the
+    stage, by one of workers threads, and its return value is passed
+    on to the next stage (unless it's None).
+
+    queue_size is the number of items which can wait for the stage
+    before the previous stage blocks (0 for no limit).
+
+    """
+    def __init__(self, name, func, workers=1, queue_size=1):
+        self.name = name
+        self.func = func
+        self.workers = max(workers, 1)
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.items = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+        self._lock = threading.Lock()
+        self._running = 0
+
+    def record(self, busy, wait):
+        """record an item which took busy seconds to process, after the
+        worker waited wait seconds for it
+
+        """
+        with self._lock:
+            self.items += 1
+            self.busy_time += busy
+            self.wait_time += wait
+
+    def start(self):
+        """mark every worker of the stage as running
+        """
+        with self._lock:
+            self._running = self.workers
+
+    def finish_worker(self):
+        """mark one worker of the stage as finished, and return whether it
+        was the last one running
+
+        """
+        with self._lock:
+            self._running -= 1
+            return self._running == 0
+
+    def utilization(self, wall_time):
+        """get the fraction of the available worker time this stage spent
+        busy
+
+        """
+        if wall_time <= 0:
+            return 0.0
+        return self.busy_time / (wall_time * self.workers)
+
+class Pipeline:
+    """a sequence of Stages, each feeding the next.
+    """
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.results = []
+        self.errors = []
+        self.wall_time = 0.0
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """get the stage with the given name
+        """
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    def feed(self, name, item):
+        """pass an extra item to the named stage while the pipeline is
+        running
+
+        """
+        self.stage(name).queue.put(item)
+
+    def _output(self, index, item):
+        if index + 1 < len(self.stages):
+            self.stages[index + 1].queue.put(item)
+        else:
+            with self._lock:
+                self.results.append(item)
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        while True:
+            wait_start = time.time()
+            item = stage.queue.get()
+            if item is _DONE:
+                break
+
+            busy_start = time.time()
+            result = None
+            if not self.errors:
+                try:
+                    result = stage.func(item)
+                except Exception as error:
+                    with self._lock:
+                        self.errors.append((stage.name, item, error))
+            stage.record(time.time() - busy_start, busy_start - wait_start)
+
+            if result is not None:
+                self._output(index, result)
+
+        #once every worker in this stage has finished, the next stage
+        #won't get any more items
+        if stage.finish_worker() and index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1].workers):
+                self.stages[index + 1].queue.put(_DONE)
+
+    def run(self, items):
+        """pass each of items through every stage of the pipeline, and wait
+        for all of them to finish.
+
+        return the outputs of the last stage (in the order they
+        finished). If any stage raised an exception, no new items are
+        processed after it, and the first exception is re-raised once
+        the pipeline has stopped.
+
+        """
+        start_time = time.time()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            stage.start()
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=self._worker, args=(index,))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+        for item in items:
+            self.stages[0].queue.put(item)
+        for _ in range(self.stages[0].workers):
+            self.stages[0].queue.put(_DONE)
+
+        for thread in threads:
+            thread.join()
+        self.wall_time = time.time() - start_time
+
+        if self.errors:
+            raise self.errors[0][2]
+
+        return self.results
+
+    def summary(self):
+        """get a string describing the timing and utilization of each stage
+        """
+        lines = ["{:<12} {:>6} {:>10} {:>10} {:>6}".format(
+            "stage", "items", "busy", "waiting", "util")]
+        for stage in self.stages:
+            lines.append("{:<12} {:>6} {:>9.1f}s {:>9.1f}s {:>5.0f}%".format(
+                stage.name, stage.items, stage.busy_time, stage.wait_time,
+                100 * stage.utilization(self.wall_time)))
+        lines.append("total wall time: {:.1f}s".format(self.wall_time))
+        return "\n".join(lines)
@@ -0,0 +1,221 @@
+"""playlist_index.py: keep a local index of the videos in playlists, so
+that they can be synced incrementally instead of being listed from
+scratch on every run.
+
+The index is a JSON file in the cache directory. For each playlist it
+stores the known video ids (in playlist order), and the page token,
+ETag and size of each page of results they were fetched from. A sync
+then only fetches what changed:
+
+- the first page is requested conditionally; if the server says it's
+  unchanged (304), so is the playlist, and the cached ids are used.
+- if the first page still has the same items, videos were appended
+  to the end of the playlist: only the last known page and any pages
+  after it are fetched.
+- otherwise, videos were added to the start of the playlist: pages
+  are fetched from the start until a known video is reached, and the
+  rest of the list (and the tokens of the pages it's on) is taken
+  from the index.
+
+"""
+
+from collections import namedtuple
+import json
+import os
+import threading
+
+from . import appdata
+
+INDEX_FILE = "playlist_index.json"
+
+#a page of playlist results: etag identifies the version of the page,
+#and next_token is the token for the page after it (or None)
+Page = namedtuple("Page", ["etag", "ids", "next_token"])
+
+def _empty_entry():
+    return {"ids": [], "pages": [], "complete": False}
+
+def _page_meta(token, page):
+    return {"token": token, "etag": page.etag,
+            "next": page.next_token, "count": len(page.ids)}
+
+class PlaylistIndex:
+    """the locally stored index of known playlist items.
+
+    fetch_page(playlist_id, token, etag) is called to get a page of a
+    playlist: it should return a Page, or None if etag is given and the
+    page hasn't changed since.
+
+    """
+    def __init__(self, fetch_page, path=None):
+        self.fetch_page = fetch_page
+        self.path = path or appdata.cache_filename(INDEX_FILE)
+        self.playlists = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as index_file:
+                self.playlists = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            self.playlists = {}
+
+    def save(self):
+        """write the index to disk, replacing the previous version
+        atomically
+
+        """
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as index_file:
+                json.dump(self.playlists, index_file)
+            os.replace(tmp_path, self.path)
+
+    def invalidate(self, playlist_id=None):
+        """forget a playlist (or every playlist, if none is given)
+        """
+        if playlist_id is None:
+            self.playlists = {}
+        else:
+            self.playlists.pop(playlist_id, None)
+        self.save()
+
+    def _fetch(self, playlist_id, token, etag=None):
+        self.requests += 1
+        return self.fetch_page(playlist_id, token, etag)
+
+    def _pages_cover_ids(self, entry):
+        return sum(page["count"] for page in entry["pages"]) == len(entry["ids"])
+
+    def _fetch_from(self, playlist_id, entry, token, limit):
+        """fetch pages starting at token until the end of the playlist or
+        until more than limit ids are known (limit < 0 for no limit),
+        appending them to entry
+
+        """
+        while token is not None and (limit < 0 or len(entry["ids"]) < limit):
+            page = self._fetch(playlist_id, token)
+            entry["ids"] += page.ids
+            entry["pages"].append(_page_meta(token, page))
+            token = page.next_token
+
+        entry["complete"] = token is None
+
+    def _sync_appended(self, playlist_id, entry, first_page, limit):
+        """sync a playlist whose first page hasn't changed: refetch the
+        last known page, and fetch any pages after it
+
+        """
+        pages = entry["pages"]
+        if len(pages) == 1:
+            last, page = pages[0], first_page
+        else:
+            #keep the first page's new ETag, so the next sync can find
+            #out it's unchanged with a single request
+            pages[0] = _page_meta(None, first_page)
+            last = pages[-1]
+            page = self._fetch(playlist_id, last["token"], last["etag"])
+
+        if page is not None:
+            if last["count"]:
+                del entry["ids"][-last["count"]:]
+            entry["ids"] += page.ids
+            pages[-1] = _page_meta(last["token"], page)
+
+        self._fetch_from(playlist_id, entry, pages[-1]["next"], limit)
+
+    def _merge_pages(self, new_entry, old_pages):
+        """add the pages after the ones fetched for new_entry from the
+        index (old_pages), so later syncs don't have to walk the whole
+        playlist again
+
+        """
+        #page tokens stand for positions in the playlist, so the old
+        #tokens for the later pages still work, but their contents
+        #have moved along, so their ETags don't
+        for meta in old_pages[len(new_entry["pages"]):]:
+            new_entry["pages"].append(dict(meta, etag=None))
+
+        #the last page holds whatever is left over (more than a page, if
+        #the new items pushed some onto a page we don't know the token
+        #for; syncing it fetches the rest)
+        covered = sum(meta["count"] for meta in new_entry["pages"][:-1])
+        new_entry["pages"][-1]["count"] = len(new_entry["ids"]) - covered
+
+    def _sync_prepended(self, playlist_id, entry, first_page, limit):
+        """sync a playlist with new items at the start: fetch pages until a
+        known id is reached, then reuse the rest of the index
+
+        """
+        known = set(entry["ids"])
+        new_entry = _empty_entry()
+        page, token = first_page, None
+        while True:
+            for i, video_id in enumerate(page.ids):
+                if video_id in known:
+                    new_entry["ids"] += page.ids[:i]
+                    new_entry["ids"] += entry["ids"][
+                        entry["ids"].index(video_id):]
+                    new_entry["complete"] = entry["complete"]
+                    new_entry["pages"].append(_page_meta(token, page))
+                    self._merge_pages(new_entry, entry["pages"])
+                    return new_entry
+
+            new_entry["ids"] += page.ids
+            new_entry["pages"].append(_page_meta(token, page))
+            token = page.next_token
+            if token is None or (0 <= limit <= len(new_entry["ids"])):
+                new_entry["complete"] = token is None
+                return new_entry
+            page = self._fetch(playlist_id, token)
+
+    def video_ids(self, playlist_id, limit=-1):
+        """get the ids of the videos in a playlist, syncing the index with
+        the server first.
+
+        if limit is non-negative, only make sure the first limit ids
+        are up to date.
+
+        """
+        entry = self.playlists.get(playlist_id) or _empty_entry()
+        pages = entry["pages"]
+
+        first_page = self._fetch(playlist_id, None,
+                                 pages[0]["etag"] if pages else None)
+        if first_page is None and not (
+                entry["complete"] or 0 <= limit <= len(entry["ids"])):
+            #the first page (including the total number of results) is
+            #unchanged, so only fetch anything we haven't seen before
+            if self._pages_cover_ids(entry):
+                self._fetch_from(playlist_id, entry, pages[-1]["next"], limit)
+            else:
+                entry = _empty_entry()
+                first_page = self._fetch(playlist_id, None)
+
+        if first_page is not None:
+            pages = entry["pages"]
+            known_count = pages[0]["count"] if pages else 0
+            if (pages and self._pages_cover_ids(entry) and
+                    first_page.ids[:known_count] ==
+                    entry["ids"][:known_count]):
+                self._sync_appended(playlist_id, entry, first_page, limit)
+            elif entry["ids"]:
+                entry = self._sync_prepended(playlist_id, entry, first_page,
+                                             limit)
+            else:
+                entry["ids"] = list(first_page.ids)
+                entry["pages"] = [_page_meta(None, first_page)]
+                self._fetch_from(playlist_id, entry, first_page.next_token,
+                                 limit)
+
+        self.playlists[playlist_id] = entry
+        self.save()
+
+        if limit >= 0:
+            return entry["ids"][:limit]
+        return list(entry["ids"])
@@ -0,0 +1,129 @@
+"""response_cache.py: a small persistent cache of API responses.
+
+Responses are stored in a JSON file in the cache directory, along with
+the time they were fetched, the endpoint they came from and their
+ETag (if any). Each endpoint has its own time to live (in the
+api_cache_ttl config option). Once a response is older than that, it
+is revalidated with a conditional request rather than being thrown
+away, so an unchanged response costs a 304 instead of a full body.
+
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from cr_download.configuration import data as config
+from . import appdata
+
+CACHE_FILE = "api_responses.json"
+
+#fields every cached response has
+_ENTRY_FIELDS = ["endpoint", "time", "etag", "data"]
+
+def cache_key(url, params=None):
+    """get the key a response is stored under. It's a hash, so that
+    API keys in params aren't written to disk.
+
+    """
+    text = json.dumps([url, sorted((params or {}).items())])
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def endpoint_ttl(endpoint):
+    """get the time to live (in seconds) for responses from an endpoint,
+    or None if they shouldn't be cached
+
+    """
+    return (config.api_cache_ttl or {}).get(endpoint)
+
+class ResponseCache:
+    """persistent cache of decoded JSON responses, indexed by cache_key
+    """
+    def __init__(self, path=None):
+        self.path = path or appdata.cache_filename(CACHE_FILE)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as cache_file:
+                self.entries = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            self.entries = {}
+
+        #anything which isn't a complete entry (e.g. left by an older
+        #version) is treated as a miss
+        if not isinstance(self.entries, dict):
+            self.entries = {}
+        self.entries = {key: entry for key, entry in self.entries.items()
+                        if isinstance(entry, dict) and
+                        all(field in entry for field in _ENTRY_FIELDS)}
+
+    def save(self):
+        """write the cache to disk, replacing the previous version
+        atomically
+
+        """
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as cache_file:
+                json.dump(self.entries, cache_file)
+            os.replace(tmp_path, self.path)
+
+    def lookup(self, key, ttl):
+        """get a tuple (entry, fresh) for a cached response: entry is None
+        if nothing is cached, and fresh is whether it's younger than
+        ttl seconds
+
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, False
+            fresh = time.time() - entry["time"] < ttl
+            if fresh:
+                self.hits += 1
+            return entry, fresh
+
+    def store(self, key, endpoint, data, etag=None):
+        """cache a response fetched because it wasn't cached (or had
+        changed), and save the cache
+
+        """
+        with self._lock:
+            self.misses += 1
+            self.entries[key] = {"endpoint": endpoint, "time": time.time(),
+                                 "etag": etag, "data": data}
+        self.save()
+
+    def refresh(self, key):
+        """mark a cached response as revalidated (i.e. fresh again)
+        """
+        with self._lock:
+            self.revalidated += 1
+            self.entries[key]["time"] = time.time()
+        self.save()
+
+    def invalidate(self, endpoint=None):
+        """drop every cached response from an endpoint (or all of them,
+        if no endpoint is given)
+
+        """
+        with self._lock:
+            self.entries = {key: entry for key, entry in self.entries.items()
+                            if endpoint is not None
+                            and entry["endpoint"] != endpoint}
+        self.save()
+
+    def summary(self):
+        return "{} hit(s), {} revalidated, {} miss(es)".format(
+            self.hits, self.revalidated, self.misses)
@@ -0,0 +1,164 @@
+"""selective_download.py: download only the parts of a stream which
+are kept in the final episode.
+
+The autocutter only needs low quality audio to find the transitions
+in an episode, so the intervals to keep can be found from a cheap
+preview download. This module then fetches those intervals (and
+nothing else) from the full quality stream:
+
+- for HLS streams, only the media segments overlapping each interval
+  are downloaded, and trimmed to the exact interval by ffmpeg.
+- for plain HTTP(S) media, ffmpeg seeks straight to each interval in
+  the remote file, so only the byte ranges it needs are requested.
+
+"""
+
+from collections import namedtuple
+import os
+
+from cr_download import ffmpeg_jobs
+from cr_download import hls_download
+from cr_download.transfer import make_session
+
+#where to get the media for a stream: protocol is "hls" or "http",
+#headers is a dict of extra HTTP headers (or None), and variant is the
+#name of the variant to use if url is an HLS master playlist
+MediaSource = namedtuple("MediaSource", ["url", "protocol", "headers", "variant"])
+MediaSource.__new__.__defaults__ = (None, None)
+
+class SelectiveDownloadException(Exception):
+    """exception thrown when part of a stream can't be fetched
+    """
+
+def _is_init_segment(segment):
+    #parse_playlist gives the EXT-X-MAP initialization section (if
+    #there is one) as a segment with no duration
+    return segment.index == 0 and segment.duration == 0
+
+def overlapping_segments(segments, start, end):
+    """get the segments (plus any initialization segment) which contain
+    part of the interval [start, end) in seconds. end may be None for
+    the end of the stream.
+
+    """
+    init = [seg for seg in segments[:1] if _is_init_segment(seg)]
+    return init + [
+        seg for seg in segments
+        if not _is_init_segment(seg)
+        and seg.start + seg.duration > start
+        and (end is None or seg.start < end)
+    ]
+
+def _clip_input(input_name, start, end, headers=None):
+    """get the ffmpeg input arguments reading input_name from start to
+    end (in seconds, relative to the start of the input)
+
+    """
+    args = []
+    if headers:
+        args += ["-headers", "".join(
+            "{}: {}\r\n".format(key, value) for key, value in headers.items())]
+    if start > 0:
+        args += ["-ss", "{:.3f}".format(start)]
+    if end is not None:
+        args += ["-t", "{:.3f}".format(end - start)]
+    return args + ["-i", input_name]
+
+def _fetch_hls_clip(segments, start, end, clip_file, session, rate_limiter):
+    """download the segments covering [start, end) to clip_file
+
+    return the ffmpeg input arguments for the interval in the clip.
+
+    """
+    clip_segments = overlapping_segments(segments, start, end)
+    media_segments = [seg for seg in clip_segments
+                      if not _is_init_segment(seg)]
+    if not media_segments:
+        raise SelectiveDownloadException(
+            "No segments found for interval {}-{}".format(start, end))
+
+    with open(clip_file, "wb") as output_file:
+        hls_download.download_segments(clip_segments, output_file, session,
+                                       rate_limiter=rate_limiter)
+
+    offset = media_segments[0].start
+    return _clip_input(clip_file, start - offset,
+                       None if end is None else end - offset)
+
+def _concat_job(inputs, output_file):
+    """get an ffmpeg job joining the audio of each input (a list of
+    ffmpeg input arguments) into output_file
+
+    """
+    args = ["-y"]
+    for input_args in inputs:
+        args += input_args
+
+    if len(inputs) == 1:
+        args += ["-vn", "-map", "0:a:0"]
+    else:
+        streams = "".join("[{}:a:0]".format(i) for i in range(len(inputs)))
+        args += ["-filter_complex",
+                 "{}concat=n={}:v=0:a=1[out]".format(streams, len(inputs)),
+                 "-map", "[out]"]
+
+    return ffmpeg_jobs.FFmpegJob(
+        args + [output_file],
+        description="fetch {}".format(os.path.basename(output_file)))
+
+def fetch_episode_segments(media, episode_segments, tmpdir,
+                           rate_limiter=None, on_output=None):
+    """fetch the parts of an episode from a MediaSource.
+
+    episode_segments is a sequence of tuples (part_name, intervals), as
+    returned by autocutter.timed_episode_segments, with intervals in
+    seconds. Each part is saved as a single audio file. Downloaded HLS
+    segments are kept in tmpdir until the parts have been encoded.
+
+    if on_output is given, it's called with the name of each audio
+    file as soon as it has been encoded.
+
+    return the names of the audio files created.
+
+    """
+    session = make_session()
+    segments = None
+    if media.protocol == "hls":
+        segments = hls_download.get_segments(media.url, session,
+                                             media.variant)
+    elif media.protocol != "http":
+        raise SelectiveDownloadException(
+            "Can't fetch intervals over {}".format(media.protocol))
+
+    jobs = []
+    clip_files = []
+    for name, intervals in episode_segments:
+        inputs = []
+        for start, end in intervals:
+            if segments is None:
+                inputs.append(_clip_input(media.url, start, end,
+                                          media.headers))
+                continue
+
+            clip_file = os.path.join(tmpdir, "{}.clip{:02d}.ts".format(
+                os.path.basename(name), len(clip_files)))
+            clip_files.append(clip_file)
+            inputs.append(_fetch_hls_clip(segments, start, end, clip_file,
+                                          session, rate_limiter))
+        jobs.append(_concat_job(inputs, name))
+
+    on_done = None
+    if on_output is not None:
+        #the last argument of each job is its output file
+        on_done = lambda job: on_output(job.args[-1])
+
+    try:
+        ffmpeg_jobs.run_all(jobs, on_done=on_done)
+    finally:
+        for clip_file in clip_files:
+            try:
+                os.remove(clip_file)
+            except OSError:
+                pass
+
+    return [name for name, _ in episode_segments]
@@ -0,0 +1,118 @@
+"""sources.py: find recent streams from every enabled stream source at
+once.
+
+Each source registered in stream_data.SOURCES is queried in its own
+thread, so checking several sites takes about as long as the slowest
+one. A source which fails or takes longer than its timeout is
+reported and skipped. The streams found are merged into one list,
+with streams of the same episode on different sites only listed once.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import importlib
+import re
+import time
+
+from cr_download.configuration import data as config
+from cr_download import stream_data
+
+#modules which register the StreamData subclass for each source when
+#imported. They're only imported once a source is used, since their
+#download libraries are slow to load
+SOURCE_MODULES = {
+    "youtube": "cr_download.youtube",
+    "twitch": "cr_download.twitch_download"
+}
+
+class SourceException(Exception):
+    """exception thrown when streams can't be retrieved from any source
+    """
+
+def _source_timeout(source):
+    timeouts = config.source_timeout
+    if isinstance(timeouts, dict):
+        return timeouts.get(source)
+    return timeouts
+
+def load_source(source):
+    """get the StreamData subclass for a source, importing the module
+    which registers it if needed
+
+    """
+    if source not in stream_data.SOURCES and source in SOURCE_MODULES:
+        importlib.import_module(SOURCE_MODULES[source])
+    try:
+        return stream_data.SOURCES[source]
+    except KeyError:
+        raise SourceException(
+            "Invalid stream source specified: {}".format(source))
+
+def stream_key(stream):
+    """get a key identifying the episode a stream is of: its title
+    (ignoring case and punctuation) and the date it aired
+
+    """
+    title = re.sub(r"[\W_]+", " ", stream["title"].lower()).strip()
+    return title, stream["creation_date"][:10]
+
+def merge_streams(stream_lists):
+    """merge arrays of streams into a single array, leaving out streams
+    with the same stream_key as a stream from an earlier array (streams
+    from the same array are all kept, e.g. several parts of one VOD)
+
+    """
+    merged = []
+    seen = set()
+    for streams in stream_lists:
+        keys = set()
+        for stream in streams:
+            key = stream_key(stream)
+            if key not in seen:
+                keys.add(key)
+                merged.append(stream)
+        seen |= keys
+    return merged
+
+def find_streams(sources=None, limit=10):
+    """get recent streams from each of the given sources (by default, the
+    ones enabled by the source config option), queried concurrently.
+
+    each source is given the number of seconds in the source_timeout
+    config option (a number, or a dict indexed by source name) to
+    respond. Streams from sources earlier in the list are preferred
+    when removing duplicates.
+
+    """
+    sources = stream_data.enabled_sources(sources)
+    source_classes = [load_source(source) for source in sources]
+
+    start_time = time.time()
+    executor = ThreadPoolExecutor(max_workers=max(len(sources), 1))
+    futures = [executor.submit(source_class.recent_streams, limit)
+               for source_class in source_classes]
+
+    results = []
+    try:
+        for source, future in zip(sources, futures):
+            #every source's timeout runs from when they were all started
+            timeout = _source_timeout(source)
+            if timeout is not None:
+                timeout = max(start_time + timeout - time.time(), 0)
+            done, _ = wait([future], timeout=timeout)
+            if not done:
+                print("Timed out retrieving streams from {}".format(source))
+                continue
+            try:
+                results.append(future.result())
+            except Exception as error:
+                print("Could not retrieve streams from {}: {}".format(
+                    source, error))
+    finally:
+        #don't wait for sources which timed out
+        executor.shutdown(wait=False)
+
+    if sources and not results:
+        raise SourceException("Could not retrieve streams from any source")
+
+    return merge_streams(results)
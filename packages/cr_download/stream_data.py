@@ -15,13 +15,49 @@ It might also be necessary to override the download method to
 configure the appropriate streamlink plugin used to download the video
 (e.g. to set up Twitch authentication if downloading a Twitch stream)
 
+Derived classes are registered as stream sources (under their source
+name) with the register_source decorator, and should override the
+recent_streams class method to list the recent streams from that
+source.
+
 """
 
-import progressbar
+import abc
+
+from cr_download.configuration import data as config
 
 StreamException = Exception
 
-class StreamData:
+#StreamData subclasses for each source of streams, indexed by source name
+SOURCES = {}
+
+def register_source(cls):
+    """class decorator registering a StreamData subclass as the source of
+    streams named by its source attribute
+
+    """
+    SOURCES[cls.source] = cls
+    return cls
+
+def enabled_sources(source=None):
+    """get the list of source names given by source (by default, the
+    source config option), which can be a list or a comma-separated
+    string
+
+    """
+    if source is None:
+        source = config.source
+
+    if isinstance(source, str):
+        source = source.split(",")
+
+    return [name.strip() for name in source if name.strip()]
+
+class StreamData(abc.ABC):
+    #name of the site the stream comes from (used to look up per-source
+    #config options)
+    source = None
+
     def __init__(self, data):
         #these should all be in human-readable format
         self.title = ""
@@ -30,6 +66,9 @@ class StreamData:
         self.url = ""
         self.stream = ""
 
+        #the data the stream was loaded from, which is enough to
+        #recreate it later
+        self.json_data = data
         self.load_data(data)
 
     def load_data(self, data):
@@ -41,5 +80,39 @@ class StreamData:
     def __setitem__(self, key):
         setattr(self, key)
 
-    def download(self, output_filename):
-        pass
+    def download(self, output_filename, progress=None, rate_limiter=None,
+                 quality=None):
+        """download the stream to output_filename (plus an extension).
+
+        quality selects the rendition to download (by default,
+        self.stream).
+
+        progress is an object with update/finish methods (e.g. a
+        ProgressBar) used to report the number of bytes downloaded. If
+        a transfer.RateLimiter is given, the download shares its
+        bandwidth limit.
+
+        return the name of the file created.
+
+        """
+
+    @classmethod
+    @abc.abstractmethod
+    def recent_streams(cls, limit=10):
+        """get an array of (at most limit) recent streams from this source
+        which might be Critical Role episodes, most recent first.
+
+        every source has to implement this. It can raise an exception
+        if the source can't be reached, which sources.find_streams
+        reports before going on with the other sources.
+
+        """
+
+    def resolve_media(self, quality=None):
+        """get a selective_download.MediaSource for the given rendition of
+        the stream (by default, self.stream), so that parts of it can be
+        fetched without downloading the whole thing.
+
+        """
+        raise StreamException(
+            "Can't fetch part of a stream from {}".format(self.url))
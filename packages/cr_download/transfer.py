@@ -0,0 +1,139 @@
+"""transfer.py: helpers shared by the downloaders: connection pools,
+throughput measurement, bandwidth limiting and progress output.
+
+"""
+
+import threading
+import time
+
+from cr_download.configuration import data as config
+from cr_download import media_utils
+
+#seconds between progress lines printed by a LineProgress
+PROGRESS_INTERVAL = 10
+
+class TransferStats:
+    """keep track of the number of bytes transferred and the
+    throughput of a download
+
+    """
+    def __init__(self):
+        self.start_time = time.time()
+        self.end_time = None
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, num_bytes):
+        with self._lock:
+            self.bytes += num_bytes
+
+    def finish(self):
+        self.end_time = time.time()
+
+    @property
+    def elapsed(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def rate(self):
+        """average throughput in bytes per second
+        """
+        if self.elapsed <= 0:
+            return 0.0
+        return self.bytes / self.elapsed
+
+class RateLimiter:
+    """limit the combined throughput of any number of downloads (in any
+    number of threads) to rate bytes per second
+
+    """
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._next_free = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, num_bytes):
+        """account for num_bytes transferred, sleeping as long as needed
+        to keep under the rate limit
+
+        """
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_free)
+            self._next_free = start + num_bytes / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+_rate_limiters = {}
+
+def default_rate_limiter():
+    """get the RateLimiter shared by every download for the
+    bandwidth_limit config option (in MB/s), or None if there's no
+    limit
+
+    """
+    if not config.bandwidth_limit:
+        return None
+    if config.bandwidth_limit not in _rate_limiters:
+        _rate_limiters[config.bandwidth_limit] = RateLimiter(
+            config.bandwidth_limit * 1000000)
+    return _rate_limiters[config.bandwidth_limit]
+
+def make_session(workers=None):
+    """get a requests session whose connection pool can serve the given
+    number of workers
+
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    workers = workers or config.download_workers
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def download_progress_bar():
+    """get a progress bar showing the amount downloaded and the transfer
+    rate
+
+    """
+    import progressbar
+
+    widgets = [
+        'Downloaded: ',
+        progressbar.DataSize(),
+        '(',
+        progressbar.FileTransferSpeed(),
+        ')'
+    ]
+    return progressbar.ProgressBar(widgets=widgets)
+
+class LineProgress:
+    """progress callback for transfers running side by side: print a
+    line for the transfer every PROGRESS_INTERVAL seconds, instead of
+    drawing a progress bar
+
+    """
+    def __init__(self, label, action="downloaded"):
+        self.label = label
+        self.action = action
+        self.stats = TransferStats()
+        self._last_printed = self.stats.start_time
+
+    def update(self, total_bytes):
+        self.stats.bytes = total_bytes
+        now = time.time()
+        if now - self._last_printed >= PROGRESS_INTERVAL:
+            self._last_printed = now
+            print("{}: {} {} ({}/s)".format(
+                self.label, media_utils.display_bytes(total_bytes),
+                self.action,
+                media_utils.display_bytes(int(self.stats.rate))))
+
+    def finish(self):
+        self.stats.finish()
+        print("{}: finished, {} in {:.0f}s".format(
+            self.label, media_utils.display_bytes(self.stats.bytes),
+            self.stats.elapsed))
@@ -12,17 +12,18 @@ if Twitch ever chooses to fix it.
 
 """
 
-from __future__ import print_function
-
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
-import sys
-import re
-
-import requests
-import streamlink
+import json
 
 from cr_download.configuration import data as config
+from cr_download import appdata
 from cr_download import stream_data
+from cr_download import api_client
+from cr_download import hls_download
+from cr_download import media_utils
+from cr_download import transfer
+from cr_download.selective_download import MediaSource
 
 TWITCH_CLIENT_ID = "ignduriqallck9hugiw15zfaqdvgwc"
 CRITROLE_TWITCH_CHANNEL = "criticalrole"
@@ -32,9 +33,22 @@ HEADERS = {"Client-ID" : TWITCH_CLIENT_ID,
 
 DEFAULT_STREAM_QUALITY = "audio"
 
+#max number of VODs the API returns per request
+VOD_PAGE_SIZE = 100
+
 UNCONFIGURED_TOKEN = "YOUR_TOKEN_HERE"
 
+@stream_data.register_source
 class TwitchStreamData(stream_data.StreamData):
+    source = "twitch"
+
+    @classmethod
+    def recent_streams(cls, limit=10):
+        #check for a token before listing VODs, so the user knows to
+        #configure it before picking any to download
+        _get_oauth_token()
+        return get_vod_list(limit=limit)
+
     def load_data(self, data):
         #hold onto all of the data in the Twitch json object, just in
         #case we want to use it later
@@ -47,12 +61,21 @@ class TwitchStreamData(stream_data.StreamData):
         self.url = data["url"]
         self.stream = DEFAULT_STREAM_QUALITY
 
-    def download(self, filename, output_progress=True):
+    def download(self, filename, output_progress=True, progress=None,
+                 rate_limiter=None, quality=None):
         output_filename = filename + ".mp4"
-        download_twitch_vod(self.url, DEFAULT_STREAM_QUALITY,
-                            output_filename, output_progress=output_progress)
+        download_twitch_vod(self.url, quality or self.stream,
+                            output_filename, output_progress=output_progress,
+                            progress=progress, rate_limiter=rate_limiter)
         return output_filename
 
+    def resolve_media(self, quality=None):
+        stream = _find_stream(self.url, quality or self.stream)
+        if stream.shortname() != "hls":
+            raise stream_data.StreamException(
+                "Can't fetch part of a {} stream".format(stream.shortname()))
+        return MediaSource(stream.url, "hls")
+
 def _get_oauth_token():
     try:
         if config.twitch_token != UNCONFIGURED_TOKEN:
@@ -62,54 +85,155 @@ def _get_oauth_token():
 
     #if we're not using twitch as a video source, we can ignore an
     #unconfigured token
-    if config.source != "twitch":
+    if "twitch" not in stream_data.enabled_sources():
         return None
 
-    print("This application is not yet authorized to access "
-          "your Twitch account! Run "
-          "'streamlink --twitch-oauth-authenticate' "
-          "and set 'twitch_token' in your config file to the resulting "
-          "value.")
-    sys.exit()
+    raise stream_data.StreamException(
+        "This application is not yet authorized to access "
+        "your Twitch account! Run "
+        "'streamlink --twitch-oauth-authenticate' "
+        "and set 'twitch_token' in your config file to the resulting "
+        "value.")
+
+
+def _api_url(path):
+    return config.twitch_api_url.rstrip("/") + "/" + path
 
+_channel_ids = {}
 
 def get_channel_id(channel_name):
     """Retrieve the Twitch ID of the channel with the given name
 
     """
-    params = {"login":channel_name}
-    response = requests.get("https://api.twitch.tv/kraken/users",
-                            headers=HEADERS, params=params)
-    return response.json()["users"][0]["_id"]
+    if channel_name not in _channel_ids:
+        params = {"login":channel_name}
+        data = api_client.get_client().get(_api_url("users"),
+                                           params=params, headers=HEADERS,
+                                           endpoint="twitch_users")
+        _channel_ids[channel_name] = data["users"][0]["_id"]
+
+    return _channel_ids[channel_name]
+
+def _get_vod_page(channel_id, offset, limit=VOD_PAGE_SIZE):
+    params = {"broadcast_type":"archive", "limit":str(limit),
+              "offset":str(offset)}
+    url = _api_url("channels/{}/videos".format(channel_id))
+    return api_client.get_client().get(url, params=params, headers=HEADERS)
+
+def _vod_cache_file(channel_id):
+    return "twitch_vods_{}.json".format(channel_id)
+
+def _load_cached_vods(channel_id):
+    """get the cached list of VODs, and whether it goes all the way back
+    to the start of the channel's history
+
+    """
+    try:
+        with appdata.open_cache_file(_vod_cache_file(channel_id), "r") as vod_file:
+            cached = json.load(vod_file)
+    except (IOError, OSError, ValueError):
+        return [], False
+
+    #older caches were just the list, without recording how far back
+    #they went
+    if isinstance(cached, list):
+        return cached, False
+    return cached.get("vods", []), cached.get("complete", False)
+
+def _save_cached_vods(channel_id, vods, complete):
+    with appdata.open_cache_file(_vod_cache_file(channel_id), "w") as vod_file:
+        json.dump({"vods": vods, "complete": complete}, vod_file)
+
+def _merge_vods(fetched, cached):
+    """merge newly fetched VODs (most recent first) with the cached list,
+    once the fetched list reaches a VOD which is already cached
+
+    """
+    fetched_ids = set(vod["_id"] for vod in fetched)
+    cached_ids = [vod["_id"] for vod in cached]
+    for vod in fetched:
+        if vod["_id"] in cached_ids:
+            overlap = cached_ids.index(vod["_id"])
+            return fetched + [old for old in cached[overlap:]
+                              if old["_id"] not in fetched_ids]
+    return None
 
 def get_vod_list(limit=10):
     """get JSON array of past broadcast VODs on the G&S channel, most
     recent first
 
+    if limit is negative, get the entire history of the channel.
+
+    VODs are cached locally, along with whether the cache reaches the
+    start of the channel's history. Once pages of results reach VODs
+    which were seen before, those are taken from the cache, and only
+    VODs older than the cached ones are fetched (if more are needed).
+    The API only supports paging by offset, so pages are fetched a few
+    at a time, concurrently, over the API client's connection pool.
+
     """
-    limit = max(min(limit, 100), 1)
-    params = {"broadcast_type":"archive", "limit":str(limit)}
     channel_id = get_channel_id(CRITROLE_TWITCH_CHANNEL)
-    url = "https://api.twitch.tv/kraken/channels/{}/videos".format(channel_id)
-    response = requests.get(url, headers=HEADERS, params=params)
-    vods = response.json()["videos"]
-
+    cached, cached_complete = _load_cached_vods(channel_id)
+
+    first_page = _get_vod_page(channel_id, 0)
+    vods = first_page["videos"]
+    available = int(first_page.get("_total", len(vods)))
+    wanted = available if limit < 0 else min(limit, available)
+
+    merged = _merge_vods(vods, cached)
+    if merged is not None:
+        vods = merged
+    complete = ((merged is not None and cached_complete)
+                or len(vods) >= available
+                or len(first_page["videos"]) < VOD_PAGE_SIZE)
+
+    with ThreadPoolExecutor(max_workers=config.download_workers) as executor:
+        while not complete and len(vods) < wanted:
+            offsets = range(len(vods), wanted,
+                            VOD_PAGE_SIZE)[:config.download_workers]
+            pages = list(executor.map(
+                lambda page_offset: _get_vod_page(channel_id, page_offset),
+                offsets))
+
+            #VODs posted since the first page shift the later pages
+            #along, so some may have been seen already
+            seen = set(vod["_id"] for vod in vods)
+            new_vods = [vod for page in pages for vod in page["videos"]
+                        if vod["_id"] not in seen]
+            if not new_vods:
+                break
+            vods += new_vods
+
+            if merged is None:
+                merged = _merge_vods(vods, cached)
+                if merged is not None:
+                    vods = merged
+                    complete = cached_complete
+            complete = (complete or len(vods) >= available
+                        or any(len(page["videos"]) < VOD_PAGE_SIZE
+                               for page in pages))
+
+    _save_cached_vods(channel_id, vods, complete)
+
+    if limit >= 0:
+        vods = vods[:limit]
     return [TwitchStreamData(vod) for vod in vods]
 
-def _download_progress_bar():
-    widgets = [
-        'Downloaded: ',
-        progressbar.DataSize(),
-        '(',
-        progressbar.FileTransferSpeed(),
-        ')'
-    ]
-    return progressbar.ProgressBar(widgets=widgets)
-
-def download_twitch_vod(url, stream_name, output_filename,
-                        buffer_size=8192, output_progress=True):
-    """download a video object to the given output file.
+def _download_hls(stream, source, output_filename, progress, rate_limiter):
+    stats = hls_download.download(
+        stream.url, output_filename, source=source, rate_limiter=rate_limiter,
+        progress=(None if progress is None else progress.update))
+    if progress is not None:
+        progress.finish()
+        print("Downloaded {} in {:.0f}s ({}/s)".format(
+            media_utils.display_bytes(stats.bytes), stats.elapsed,
+            media_utils.display_bytes(int(stats.rate))))
+
+def _find_stream(url, stream_name):
+    """get the streamlink stream with the given name for a VOD url
     """
+    import streamlink
+
     oauth_token = _get_oauth_token()
     session = streamlink.Streamlink()
     session.set_plugin_option("twitch", "oauth-token", oauth_token)
@@ -117,28 +241,50 @@ def download_twitch_vod(url, stream_name, output_filename,
     streams = session.streams(url)
 
     if streams and stream_name in streams:
-        stream = streams[stream_name]
-    else:
-        raise StreamException("Could not find stream {1} at url {2}".format(
-            stream_name, url))
+        return streams[stream_name]
+
+    raise stream_data.StreamException(
+        "Could not find stream {} at url {}".format(stream_name, url))
+
+def download_twitch_vod(url, stream_name, output_filename,
+                        buffer_size=1024 * 1024, output_progress=True,
+                        progress=None, rate_limiter=None):
+    """download a video object to the given output file.
+
+    HLS streams are downloaded by fetching their segments
+    concurrently (resuming an earlier partial download of the same
+    VOD); anything else is read through streamlink.
+
+    progress is an object with update/finish methods used to report
+    progress (by default, a progress bar if output_progress is
+    specified). If a RateLimiter is given, the download shares its
+    bandwidth limit.
+
+    """
+    stream = _find_stream(url, stream_name)
+
+    if progress is None and output_progress:
+        progress = transfer.download_progress_bar()
+
+    if stream.shortname() == "hls":
+        _download_hls(stream, "{} {}".format(url, stream_name),
+                      output_filename, progress, rate_limiter)
+        return
 
     total_downloaded = 0
     with stream.open() as stream_file, open(output_filename, "wb") as output_file:
-        if output_progress:
-            progress_bar = _download_progress_bar()
-
         chunk = stream_file.read(buffer_size)
 
         while chunk:
             total_downloaded += len(chunk)
 
-            if output_progress:
-                progress_bar.update(total_downloaded)
+            if progress is not None:
+                progress.update(total_downloaded)
+            if rate_limiter is not None:
+                rate_limiter.consume(len(chunk))
 
             output_file.write(chunk)
             chunk = stream_file.read(buffer_size)
 
-# try and set token as soon as the module is loaded so that the user
-# knows to configure it if necessary. NOTE: this should be changed if
-# we want to let the user set the token on the command line.
-_TWITCH_TOKEN = _get_oauth_token()
+    if progress is not None:
+        progress.finish()
@@ -0,0 +1,147 @@
+"""upload_targets.py: places finished episode audio can be published
+to.
+
+Each UploadTarget subclass is registered in TARGETS under its name,
+and the upload_target config option picks which one is used: Google
+Drive, a local directory (e.g. one served by a web server or synced
+elsewhere), or an HTTP endpoint files are PUT to.
+
+"""
+
+import abc
+import os
+import shutil
+import threading
+from urllib.parse import quote
+
+from cr_download.configuration import data as config
+from cr_download import transfer
+
+#UploadTarget subclasses, indexed by target name
+TARGETS = {}
+
+class UploadException(Exception):
+    """exception thrown when a file can't be uploaded
+    """
+
+def register_target(cls):
+    """class decorator registering an UploadTarget subclass under its
+    name attribute
+
+    """
+    TARGETS[cls.name] = cls
+    return cls
+
+class UploadTarget(abc.ABC):
+    """somewhere to upload files to. Subclasses implement upload, which
+    must be safe to call from several threads at once.
+
+    """
+    name = None
+
+    @abc.abstractmethod
+    def upload(self, filename):
+        """upload filename, and return a description of where it went.
+        Raise an UploadException if it can't be uploaded.
+
+        """
+
+@register_target
+class DriveTarget(UploadTarget):
+    """upload to the xfer folder in the user's Google Drive, reusing one
+    DriveUploader (so the service and folder are only looked up once)
+
+    """
+    name = "drive"
+
+    def __init__(self):
+        self._uploader = None
+        self._lock = threading.Lock()
+
+    def _get_uploader(self):
+        from cr_download import drive_upload
+
+        with self._lock:
+            if self._uploader is None:
+                self._uploader = drive_upload.DriveUploader()
+            return self._uploader
+
+    def upload(self, filename):
+        from cr_download import drive_upload
+
+        progress = transfer.LineProgress(os.path.basename(filename),
+                                         action="uploaded")
+        try:
+            file_id = self._get_uploader().upload(filename, progress=progress)
+        except drive_upload.DriveUploadException as error:
+            raise UploadException("Could not upload {} to Google Drive: {}"
+                                  .format(filename, error))
+        return "Google Drive file {}".format(file_id)
+
+@register_target
+class DirectoryTarget(UploadTarget):
+    """copy files into a directory (by default, the upload_dir config
+    option)
+
+    """
+    name = "dir"
+
+    def __init__(self, directory=None):
+        self.directory = directory or config.upload_dir
+
+    def upload(self, filename):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+        #copy under a temporary name, so nothing watching the directory
+        #sees a partial file
+        destination = os.path.join(self.directory, os.path.basename(filename))
+        tmp_file = destination + ".part"
+        try:
+            shutil.copyfile(filename, tmp_file)
+            os.replace(tmp_file, destination)
+        except (IOError, OSError) as error:
+            raise UploadException("Could not copy {} to {}: {}".format(
+                filename, self.directory, error))
+        return destination
+
+@register_target
+class HTTPTarget(UploadTarget):
+    """PUT files to a url (by default, the upload_url config option)
+    followed by their filename
+
+    """
+    name = "http"
+
+    def __init__(self, url=None):
+        self.url = url or config.upload_url
+        if not self.url.endswith("/"):
+            self.url += "/"
+        self.session = transfer.make_session()
+
+    def upload(self, filename):
+        url = self.url + quote(os.path.basename(filename))
+        try:
+            with open(filename, "rb") as upload_file:
+                response = self.session.put(
+                    url, data=upload_file, timeout=config.api_timeout,
+                    headers={"Content-Length": str(os.path.getsize(filename))})
+        except (IOError, OSError) as error:
+            raise UploadException("Could not upload {} to {}: {}".format(
+                filename, url, error))
+        if response.status_code >= 400:
+            raise UploadException("Could not upload {} to {}: HTTP {}".format(
+                filename, url, response.status_code))
+        return url
+
+def get_target(name=None):
+    """get an UploadTarget of the type with the given name (by default,
+    the upload_target config option)
+
+    """
+    name = name or config.upload_target
+    try:
+        return TARGETS[name]()
+    except KeyError:
+        raise UploadException("Invalid upload target specified: {}".format(
+            name))
@@ -6,24 +6,22 @@ episodes.
 
 """
 
-from __future__ import print_function
-
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 import re
-import sys
-
-import requests
-import youtube_dl
 
 from cr_download.configuration import data as config
 from cr_download import stream_data
+from cr_download import api_client
+from cr_download import playlist_index
+from cr_download import http_download
+from cr_download import transfer
+from cr_download.selective_download import MediaSource
 
 
 
 ISO_REGEX = re.compile(r"PT((?P<h>\d*)H)?((?P<m>\d*)M)?((?P<s>\d*)S)?")
 
-YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3/"
-
 DEFAULT_API_KEY = "API_UNCONFIGURED"
 
 VIDEO_QUERY = "videos"
@@ -48,6 +46,9 @@ def youtube_api_key():
 
     return key
 
+def _api_url(query):
+    return config.youtube_api_url.rstrip("/") + "/" + query
+
 def _parse_iso_duration(duration):
     match = ISO_REGEX.match(duration)
     if match:
@@ -56,10 +57,19 @@ def _parse_iso_duration(duration):
         secs = match.group('s') or "0"
         return timedelta(hours=int(hrs), minutes=int(mins), seconds=int(secs))
 
+@stream_data.register_source
 class YoutubeStreamData(stream_data.StreamData):
+    source = "youtube"
+
     def __init__(self, *args, **kwargs):
         super(YoutubeStreamData, self).__init__(*args, **kwargs)
-        output_filename = ""
+        self.output_filename = ""
+
+    @classmethod
+    def recent_streams(cls, limit=10):
+        return get_recent_critrole_videos(
+            limit=limit,
+            all_videos=getattr(config, "youtube_all_uploads", False))
 
     #it's actually absurd that the youtube_dl API doesn't have an
     #obvious way to access the final filename except through a
@@ -83,75 +93,182 @@ class YoutubeStreamData(stream_data.StreamData):
         self.description = data["snippet"]["description"]
         self.stream = DEFAULT_STREAM_QUALITY
 
-    def download(self, output):
-        ydl_options = {"format":DEFAULT_STREAM_QUALITY,
+    def download(self, output, progress=None, rate_limiter=None,
+                 quality=None):
+        import youtube_dl
+
+        ydl_options = {"format":quality or self.stream,
                        "outtmpl":"{}.%(ext)s".format(output),
-                       "progress_hooks":[lambda d: self.download_hook(d)]
+                       "progress_hooks":[self._progress_hook(progress,
+                                                             rate_limiter)]
         }
+        if progress is not None:
+            #progress is reported through the hook instead
+            ydl_options["noprogress"] = True
 
         with youtube_dl.YoutubeDL(ydl_options) as ydl:
-            ydl.download([self.url])
+            info = ydl.extract_info(self.url, download=False)
+
+            #plain http(s) media can be fetched directly, which lets us
+            #resume interrupted downloads
+            if info.get("protocol") in ("http", "https") and "url" in info:
+                self.output_filename = "{}.{}".format(output, info["ext"])
+                if progress is None:
+                    progress = transfer.download_progress_bar()
+                http_download.download(
+                    info["url"], self.output_filename,
+                    source="{} {}".format(self.url, info.get("format_id")),
+                    headers=info.get("http_headers"),
+                    progress=progress.update, rate_limiter=rate_limiter)
+                progress.finish()
+            else:
+                ydl.process_ie_result(info, download=True)
+                if progress is not None:
+                    progress.finish()
 
         return self.output_filename
 
+    def _progress_hook(self, progress, rate_limiter):
+        """get a youtube_dl progress hook which keeps track of the output
+        filename, reports the bytes downloaded to progress, and passes
+        them through rate_limiter (so youtube_dl downloads share its
+        limit with every other download, however many run at once)
 
-def get_video_data(ids):
+        """
+        downloaded = 0
+
+        def _hook(status):
+            nonlocal downloaded
+            self.download_hook(status)
+
+            total = status.get("downloaded_bytes")
+            if total is None:
+                return
+            #each file (or fragment) youtube_dl downloads starts counting
+            #from zero again
+            new_bytes = total - downloaded if total >= downloaded else total
+            downloaded = total
+
+            if rate_limiter is not None and new_bytes > 0:
+                rate_limiter.consume(new_bytes)
+            if progress is not None:
+                progress.update(total)
+
+        return _hook
+
+    def resolve_media(self, quality=None):
+        import youtube_dl
+
+        with youtube_dl.YoutubeDL({"format":quality or self.stream}) as ydl:
+            info = ydl.extract_info(self.url, download=False)
+
+        protocol = info.get("protocol")
+        if protocol in ("http", "https"):
+            return MediaSource(info["url"], "http", info.get("http_headers"))
+        if protocol in ("m3u8", "m3u8_native"):
+            return MediaSource(info["url"], "hls")
+
+        raise stream_data.StreamException(
+            "Can't fetch part of {} over {}".format(self.url, protocol))
+
+
+def _get_video_batch(ids):
     params = {"part":"contentDetails,snippet",
               "id":",".join(ids),
               "key":youtube_api_key()
     }
 
-    response = requests.get(YOUTUBE_API_URL + VIDEO_QUERY,
-                            params=params)
-    response.raise_for_status()
+    return api_client.get_client().get(_api_url(VIDEO_QUERY),
+                                       params=params)["items"]
 
-    return [YoutubeStreamData(video)
-            for video in response.json()["items"]]
+def get_video_data(ids):
+    """get a YoutubeStreamData object for each of the given video ids,
+    in the same order.
 
-def get_playlist_video_ids(playlist_id, limit=10, reverse=False):
-    """get video ids for items in the given playlist.
+    the API only takes MAX_RESULTS_PER_PAGE ids per request, so ids are
+    split into batches which are fetched concurrently. If some batches
+    fail, the videos from the others are still returned (an
+    api_client.APIError is only raised if every batch fails). Videos
+    which no longer exist are left out.
 
-    if limit is negative, get everything in the list.
+    """
+    batches = [ids[i:i + MAX_RESULTS_PER_PAGE]
+               for i in range(0, len(ids), MAX_RESULTS_PER_PAGE)]
+    if not batches:
+        return []
+
+    videos = {}
+    errors = []
+    with ThreadPoolExecutor(
+            max_workers=min(len(batches), config.download_workers)) as executor:
+        futures = [executor.submit(_get_video_batch, batch)
+                   for batch in batches]
+        for batch, future in zip(batches, futures):
+            try:
+                for video in future.result():
+                    videos[video["id"]] = video
+            except api_client.APIError as error:
+                errors.append(error)
+                print("Could not get details for {} video(s): {}".format(
+                    len(batch), error))
+
+    if errors and len(errors) == len(batches):
+        raise errors[0]
+
+    return [YoutubeStreamData(videos[video_id])
+            for video_id in ids if video_id in videos]
+
+def _fetch_playlist_page(playlist_id, token=None, etag=None):
+    """get a playlist_index.Page of the items in a playlist (or None if
+    etag is given and the page is unchanged)
 
     """
     params = {"part":"contentDetails",
               "playlistId":playlist_id,
+              "maxResults":MAX_RESULTS_PER_PAGE,
               "key":youtube_api_key()
     }
+    if token:
+        params["pageToken"] = token
 
-    video_ids = []
+    headers = {"If-None-Match": etag} if etag else None
+    response = api_client.get_client().request(
+        _api_url(PLAYLIST_ITEM_QUERY), params=params, headers=headers)
+    if response.status_code == 304:
+        return None
 
-    initial_query = True
+    return playlist_index.Page(
+        response.headers.get("ETag", response.data.get("etag")),
+        [video["contentDetails"]["videoId"]
+         for video in response.data["items"]],
+        response.data.get("nextPageToken"))
 
-    if reverse:
-        return get_playlist_video_ids(
-            playlist_id, limit=-1, reverse=False
-        )[-1 * limit:]
-
-    while (initial_query or
-           ("nextPageToken" in response.json() and
-            (len(video_ids) < limit or limit < 0))):
+_playlist_index = None
 
-        if not initial_query:
-            params["pageToken"] = response.json()["nextPageToken"]
+def get_playlist_index():
+    """get the local index of playlist items (loaded from the cache
+    the first time it's needed)
 
-        initial_query = False
+    """
+    global _playlist_index
+    if _playlist_index is None:
+        _playlist_index = playlist_index.PlaylistIndex(_fetch_playlist_page)
+    return _playlist_index
 
-        if limit > 0:
-            max_results = min(limit - len(video_ids), MAX_RESULTS_PER_PAGE)
-        else:
-            max_results = MAX_RESULTS_PER_PAGE
+def get_playlist_video_ids(playlist_id, limit=10, reverse=False):
+    """get video ids for items in the given playlist.
 
-        params["maxResults"] = max_results
+    if limit is negative, get everything in the list. If reverse is
+    specified, get the last limit items instead of the first.
 
-        response = requests.get(YOUTUBE_API_URL + PLAYLIST_ITEM_QUERY,
-                                params=params)
-        response.raise_for_status()
+    ids are kept in a local index, so only the pages of the playlist
+    which changed since the last call are fetched.
 
-        video_ids += [video["contentDetails"]["videoId"]
-                      for video in response.json()["items"]]
+    """
+    if reverse:
+        return get_playlist_index().video_ids(playlist_id)[-1 * limit:]
 
-    return video_ids
+    return get_playlist_index().video_ids(playlist_id, limit)
 
 def get_critrole_main_playlist_id():
     """find the playlist id for the main Critical Role campaign playlist"""
@@ -159,18 +276,20 @@ def get_critrole_main_playlist_id():
               "channelId":CRITROLE_YOUTUBE_ID,
               "key":youtube_api_key()}
 
-    initial_query = True
-    while initial_query or "nextPageToken" in response.json():
-        initial_query = False
-        response = requests.get(YOUTUBE_API_URL + PLAYLIST_QUERY, params=params)
-        response.raise_for_status()
+    client = api_client.get_client()
+    data = {}
+    while not data or "nextPageToken" in data:
+        if data:
+            params["pageToken"] = data["nextPageToken"]
+        data = client.get(_api_url(PLAYLIST_QUERY), params=params,
+                          endpoint="playlists")
 
-        for playlist in response.json()["items"]:
+        for playlist in data["items"]:
             if re.match(CRITROLE_CAMPAIGN_PLAYLIST,
                         playlist["snippet"]["title"]):
                 return playlist["id"]
 
-        params["pageToken"] = response.json()["nextPageToken"]
+    return None
 
 def get_critrole_upload_playlist_id():
     """find the playlist id for the playlist of all uploads to the
@@ -183,10 +302,10 @@ def get_critrole_upload_playlist_id():
             "id":CRITROLE_YOUTUBE_ID,
             "key":youtube_api_key()}
 
-    response = requests.get(YOUTUBE_API_URL + CHANNEL_QUERY, params=params)
-    response.raise_for_status()
+    data = api_client.get_client().get(_api_url(CHANNEL_QUERY),
+                                       params=params, endpoint="channels")
 
-    for item in response.json()["items"]:
+    for item in data["items"]:
         return item["contentDetails"]["relatedPlaylists"]["uploads"]
 
 def get_recent_critrole_videos(limit=10, all_videos=False):
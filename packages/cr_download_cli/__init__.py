@@ -0,0 +1,4 @@
+import time
+
+#when the CLI tools started loading, used to report startup time
+START_TIME = time.time()
@@ -10,6 +10,7 @@ import tempfile
 import shutil
 
 from cr_download.configuration import data as config
+from cr_download import ffmpeg_jobs
 from . import cli
 
 def _autocut_argparser():
@@ -58,3 +59,5 @@ def main(args):
     finally:
         if not config.debug:
             shutil.rmtree(tmpdir)
+        else:
+            print("ffmpeg job timings:\n{}".format(ffmpeg_jobs.summary()))
@@ -5,15 +5,20 @@ utility CLI functions.
 
 import re
 import os
+import time
 from argparse import ArgumentParser
 
-from builtins import input
-
+from cr_download import checkpoint
 from cr_download import media_utils
 from cr_download import metadata
-from cr_download.autocut import autocutter
+from cr_download import transfer
 from cr_download.configuration import data as config
 
+import cr_download_cli
+
+#seconds the CLI tools should take to load their modules and parse their
+#arguments (not counting the interpreter's own startup)
+STARTUP_BUDGET = 0.1
 
 _CONFIRM_YN_OPTION = {"Y":True, "N":False}
 _CONFIRM_YN_ORDER = "YN"
@@ -113,7 +118,7 @@ def prompt_title(vod_title="", multiple_parts=False):
 
     return title
 
-def videos_to_episode_audio(video_files, title, tmpdir):
+def videos_to_episode_audio(video_files, title, tmpdir, on_output=None):
     """convert all of the files in VIDEO_FILES to one or more audio files.
 
     if autocut is set to run, run the autocutting algorithm on each
@@ -121,35 +126,141 @@ def videos_to_episode_audio(video_files, title, tmpdir):
     specified, the different parts of the (autocut) episode are merged
     into a single audio file.
 
+    if ON_OUTPUT is given, it's called with the name of each audio
+    file as soon as it has been created.
+
     return the name(s) of the audio file(s) created.
 
     """
 
-    #TODO: don't bother to split into .wav files if we're not
-    #autocutting
+    if not config.autocut:
+        return extract_episode_audio(video_files, title, on_output)
+
+    return cut_episode_audio(split_episode_audio(video_files, tmpdir), title,
+                             on_output=on_output)
 
-    episodes = []
-    for filename in video_files:
-        episodes.append(
-            media_utils.mp4_to_audio_segments(
-                filename, tmpdir,
-                segment_fmt=".wav"))
+def extract_episode_audio(video_files, title, on_output=None):
+    """convert VIDEO_FILES to a single uncut audio file named TITLE.
+
+    there's no need to split into .wav files here, the audio is just
+    pulled out of the video (and copied as-is if the container allows
+    it).
+
+    return an array containing the name of the audio file created.
+
+    """
+    audio_file = media_utils.extract_audio(
+        video_files, title, allow_rename=config.copy_audio_container)
+    if on_output is not None:
+        on_output(audio_file)
+    return [audio_file]
+
+def split_episode_audio(video_files, tmpdir, episode_checkpoint=None):
+    """split each of VIDEO_FILES into .wav segments in TMPDIR, for the
+    autocutter.
+
+    if EPISODE_CHECKPOINT is given, the segments are saved in its work
+    directory instead, and not split again if the videos haven't
+    changed.
+
+    return an array containing the array of segments for each video.
+
+    """
+    if episode_checkpoint is None:
+        return [media_utils.mp4_to_audio_segments(filename, tmpdir,
+                                                  segment_fmt=".wav")
+                for filename in video_files]
+
+    return episode_checkpoint.run(
+        "split", [checkpoint.file_signature(name) for name in video_files],
+        lambda: split_episode_audio(video_files,
+                                    episode_checkpoint.directory),
+        files=lambda segments: [name for video_segments in segments
+                                for name in video_segments])
+
+def cut_episode_audio(episodes, title, source=None, on_output=None,
+                      episode_checkpoint=None):
+    """run the autocutter on each array of .wav segments in EPISODES
+    (as returned by split_episode_audio), saving the output under
+    TITLE. SOURCE is the site the episode came from. ON_OUTPUT is
+    called with the name of each audio file as soon as it's created.
+    If EPISODE_CHECKPOINT is given, autocutting stages which were
+    already done are skipped.
+
+    return the name(s) of the audio file(s) created.
+
+    """
+    from cr_download.autocut import autocutter
 
     output_files = []
-    for episode_segments in episodes:
-        if config.autocut:
-            try:
-                output_files += autocutter.autocut(episode_segments, title)
-            except autocutter.AutocutterException:
-                if config.ignore_errors:
-                    print("Autocutter failed, exporting episode audio uncut as {}"
-                          .format(title))
-                    output_files.append(
-                        media_utils.merge_audio_files(episode_segments, title))
-                else:
-                    raise
-        else:
-            output_files.append(media_utils.merge_audio_files(episode_segments, title))
+    for i, episode_segments in enumerate(episodes):
+        video_checkpoint = None
+        if episode_checkpoint is not None:
+            video_checkpoint = episode_checkpoint.scoped("{:02d}.".format(i))
+        try:
+            output_files += autocutter.autocut(episode_segments, title,
+                                               source, on_output,
+                                               video_checkpoint)
+        except autocutter.AutocutterException:
+            if config.ignore_errors:
+                print("Autocutter failed, exporting episode audio uncut as {}"
+                      .format(title))
+                output_files.append(
+                    media_utils.merge_audio_files(episode_segments, title))
+                if on_output is not None:
+                    on_output(output_files[-1])
+            else:
+                raise
+
+    return output_files
+
+def fetch_cut_episode_audio(streams, episodes, title, tmpdir,
+                            on_output=None, episode_checkpoint=None):
+    """run the autocutter on each array of .wav segments in EPISODES,
+    split from low quality previews of STREAMS, then fetch just the
+    parts of each stream that are kept (at full quality), saving them
+    under TITLE. ON_OUTPUT is called with the name of each audio file
+    as soon as it's created. If EPISODE_CHECKPOINT is given, stages
+    which were already done are skipped.
+
+    return the name(s) of the audio file(s) created.
+
+    """
+    from cr_download import selective_download
+    from cr_download.autocut import autocutter
+
+    rate_limiter = transfer.default_rate_limiter()
+    output_files = []
+    for i, (stream, episode_segments) in enumerate(zip(streams, episodes)):
+        video_checkpoint = None
+        if episode_checkpoint is not None:
+            video_checkpoint = episode_checkpoint.scoped("{:02d}.".format(i))
+        try:
+            parts = autocutter.timed_episode_segments(
+                episode_segments, title, stream.source, video_checkpoint)
+        except autocutter.AutocutterException:
+            if config.ignore_errors:
+                print("Autocutter failed, downloading episode audio uncut as {}"
+                      .format(title))
+                parts = [(title, [(0, None)])]
+            else:
+                raise
+
+        fetch = lambda: selective_download.fetch_episode_segments(
+            stream.resolve_media(), parts, tmpdir, rate_limiter=rate_limiter,
+            on_output=on_output)
+        if video_checkpoint is None:
+            output_files += fetch()
+            continue
+
+        def _reused(part_files):
+            if on_output is not None:
+                for name in part_files:
+                    on_output(name)
+
+        output_files += video_checkpoint.run(
+            "fetch", [stream.url, parts], fetch,
+            files=lambda part_files: part_files, on_reuse=_reused)
 
     return output_files
 
@@ -193,6 +304,12 @@ def base_argparser():
     parser.add_argument("--ffmpeg-path", default="ffmpeg",
                         help="""Path to ffmpeg""")
 
+    parser.add_argument("--copy-audio", action="store_true",
+                        dest="copy_audio_container", help="""When not
+                        autocutting, change the output file extension if
+                        needed so the audio can be copied without
+                        re-encoding""")
+
     parser.add_argument("-d", "--debug", dest="debug",
                         action="store_true", help="debug mode")
     return parser
@@ -201,3 +318,10 @@ def parse_args(parser, args):
     """parse args using parser and update configuration with the result"""
     args = parser.parse_args(args)
     config.update(vars(args))
+
+    if config.debug:
+        startup_time = time.time() - cr_download_cli.START_TIME
+        print("Startup took {:.0f}ms{}".format(
+            startup_time * 1000,
+            " (over budget of {:.0f}ms)".format(STARTUP_BUDGET * 1000)
+            if startup_time > STARTUP_BUDGET else ""))
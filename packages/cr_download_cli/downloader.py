@@ -1,19 +1,24 @@
-from __future__ import print_function
-from __future__ import unicode_literals
-from builtins import input
-
-from datetime import timedelta
 from argparse import ArgumentParser
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import tempfile
 import os
 import re
 import shutil
 
 from cr_download.configuration import data as config
-from cr_download import twitch_download
-from cr_download import youtube
+from cr_download import sources
 from cr_download import media_utils
 from cr_download import metadata
+from cr_download import catalog
+from cr_download import checkpoint
+from cr_download import feed
+from cr_download import api_client
+from cr_download import download_registry
+from cr_download import ffmpeg_jobs
+from cr_download import transfer
+from cr_download import pipeline
+from cr_download import upload_targets
 
 from . import cli
 
@@ -22,22 +27,25 @@ STRICT_CR_REGEX = ".*Critical Role Ep(isode)? ?.*"
 DEFAULT_CR_REGEX = ".*Critical Role.*"
 
 
-def _downloader_argparser():
-    base_parser = cli.base_argparser()
-    autocut_parser = cli.autocutter_argparser()
-    parser = ArgumentParser(parents=[base_parser, autocut_parser],
-                            description="Download .mp3 files for Critical "
-                            "Role episodes from Twitch")
+def download_argparser():
+    """get an argument parser containing the options for downloading,
+    converting and publishing episodes (shared with the watch daemon)
+
+    """
+    parser = ArgumentParser(add_help=False)
 
     parser.add_argument("-a", dest="autocut", action="store_true",
                         help="""automatically cut transitions/
                         breaks from episode""")
 
-    parser.add_argument("-m", "--merge", action="store_true",
-                        help="merge all downloaded VODs into a single episode")
-
     parser.add_argument("-u", "--upload", action="store_true",
-                        help="Also upload .mp3s to Google Drive")
+                        help="""Also upload each .mp3 as soon as it's
+                        created""")
+
+    parser.add_argument("--upload-target", default=config.upload_target,
+                        choices=sorted(upload_targets.TARGETS),
+                        help="""where to upload .mp3s to (default:
+                        {})""".format(config.upload_target))
 
 
     download_args = parser.add_argument_group("downloader")
@@ -46,68 +54,371 @@ def _downloader_argparser():
                                help="""keep downloaded video files in a temporary
                                directory to be deleted after running""")
 
-    download_args.add_argument("-i", "--index-select", action="store_true",
-                               help="""list all most recent VODs and select
-                               which one to download""")
+    download_args.add_argument("-p", "--parallel-downloads", type=int,
+                               dest="max_parallel_downloads",
+                               default=config.max_parallel_downloads,
+                               help="""max number of streams to download
+                               at once (default: {})""".format(
+                                   config.max_parallel_downloads))
+
+    download_args.add_argument("--bandwidth-limit", type=float,
+                               default=config.bandwidth_limit,
+                               help="""limit the combined download rate
+                               to this many MB/s (0 for no limit)""")
+
+    download_args.add_argument("--two-pass", action="store_true",
+                               default=config.two_pass,
+                               help="""when autocutting, find transitions in a
+                               low quality preview, then only download the
+                               parts of each stream which are kept""")
 
     download_args.add_argument("-l", dest="limit", type=int, default=10,
                                help="""Set max number of VODs to retrieve
                                when searching for CR episodes (default: 10)""")
 
-    download_args.add_argument("-s", "--source", default="youtube",
+    download_args.add_argument("-s", "--source", default=config.source,
                                help="""where to look for recent
-                               Critical Role streams (twitch or
-                               youtube). Default: youtube""")
+                               Critical Role streams (twitch, youtube,
+                               or a comma-separated list of both to
+                               check them at the same time).
+                               Default: {}""".format(config.source))
+
+    download_args.add_argument("--refresh-cache", action="store_true",
+                               help="""ignore cached API responses and
+                               playlist contents, and fetch them again""")
 
     download_args.add_argument("--youtube-all-uploads", action="store_true",
                                help="""Look for videos among all uploads to the
                                Critical Role channel, not just to a campaign playlist""")
 
-    # regex arguments
-    download_args.add_argument("-r", "--regex", default=DEFAULT_CR_REGEX,
-                               help="""what regex to use when filtering for
-                               CR vods""")
+    download_args.add_argument("--metadata-file", help="""name of a YAML file that
+                               will be output with a description of each episode
+                               downloaded""")
 
-    download_args.add_argument("--strict", action="store_const",
-                               dest="regex", const=STRICT_CR_REGEX,
-                               help="""use a stricter regex to match
-                               possible CR vods""")
+    download_args.add_argument("--feed-file", help="""name of an RSS feed file
+                               to write with an item for every episode in
+                               the episode catalog""")
 
-    download_args.add_argument("-n", action="store_const", dest="regex",
-                               const=None, help="""don't filter vods at all
-                               when searching for CR videos""")
+    return parser
 
+def _downloader_argparser():
+    base_parser = cli.base_argparser()
+    autocut_parser = cli.autocutter_argparser()
+    parser = ArgumentParser(parents=[base_parser, autocut_parser,
+                                     download_argparser()],
+                            description="Download .mp3 files for Critical "
+                            "Role episodes from Twitch")
 
-    download_args.add_argument("-v", dest="verbose", action="store_true",
-                               default=False, help="Show more details about vods")
+    parser.add_argument("-m", "--merge", action="store_true",
+                        help="merge all downloaded VODs into a single episode")
 
-    download_args.add_argument("--metadata-file", help="""name of a YAML file that
-                               will be output with a description of each episode
-                               downloaded""")
+
+    select_args = parser.add_argument_group("stream selection")
+
+    select_args.add_argument("-i", "--index-select", action="store_true",
+                             help="""list all most recent VODs and select
+                             which one to download""")
+
+    # regex arguments
+    select_args.add_argument("-r", "--regex", default=DEFAULT_CR_REGEX,
+                             help="""what regex to use when filtering for
+                             CR vods""")
+
+    select_args.add_argument("--strict", action="store_const",
+                             dest="regex", const=STRICT_CR_REGEX,
+                             help="""use a stricter regex to match
+                             possible CR vods""")
+
+    select_args.add_argument("-n", action="store_const", dest="regex",
+                             const=None, help="""don't filter vods at all
+                             when searching for CR videos""")
+
+
+    select_args.add_argument("-v", dest="verbose", action="store_true",
+                             default=False, help="Show more details about vods")
 
 
     return parser
 
-def _upload_file(title):
-    from cr_download import drive_upload
+def refresh_caches():
+    """forget cached API responses and playlist contents
+    """
+    from cr_download import youtube
+
+    api_client.get_client().cache.invalidate()
+    youtube.get_playlist_index().invalidate()
+
+def publish_episodes(audio_files, streams, episode_catalog):
+    """add episodes (given by dicts of their audio files and streams,
+    indexed by title) to episode_catalog, and write the metadata file
+    and RSS feed, if they're configured
+
+    """
+    if config.metadata_file:
+        metadata.write_metadata_file(config.metadata_file, audio_files,
+                                     streams, episode_catalog)
+    else:
+        metadata.catalog_episodes(audio_files, streams, episode_catalog)
+
+    if config.feed_file:
+        feed.write_feed(config.feed_file, episode_catalog.query())
 
-    ostr = "Uploading {} to 'xfer' folder in Google Drive..."
-    print((ostr.format(title)))
-    drive_upload.single_xfer_upload(title)
+def _stream_filename(base_name, dst_dir, index):
+    video_base = media_utils.change_ext(base_name, "")
+    return os.path.join(dst_dir, "{}{:02}".format(video_base, index))
 
-def download_streams(base_name, to_download, dst_dir):
+def download_streams(base_name, to_download, dst_dir, preview=False,
+                     executor=None, parallel=None):
     """Download video files for the streams specified in to_download.
 
     """
-    video_files = []
-    video_base = media_utils.change_ext(base_name, "")
-    for i, stream in enumerate(to_download):
-        filename = os.path.join(dst_dir, "{}{:02}".format(video_base, i))
-        output_filename = stream.download(filename)
-        video_files.append(output_filename)
+    return download_episodes({base_name: to_download}, dst_dir,
+                             preview, executor, parallel)[base_name]
+
+def download_executor(streams):
+    """get an executor to download the given number of streams with,
+    running up to config.max_parallel_downloads of them at once
+
+    """
+    return ThreadPoolExecutor(
+        max_workers=max(min(config.max_parallel_downloads, streams), 1))
+
+def download_episodes(episodes, dst_dir, preview=False, executor=None,
+                      parallel=None):
+    """Download video files for every stream of every episode in
+    EPISODES (a dict of arrays of streams, indexed by title).
+
+    if preview is specified, download the low quality rendition of
+    each stream given by config.preview_quality instead.
+
+    Up to config.max_parallel_downloads streams are downloaded at
+    once, sharing the bandwidth limit in config.bandwidth_limit. The
+    filenames used are the same no matter how many run in parallel.
+
+    if an executor is given (e.g. one shared by every episode being
+    downloaded), streams are downloaded with it instead of a new one.
+    parallel says whether other downloads may be running at the same
+    time, so each should report its progress on a line of its own
+    instead of with a progress bar (by default, whether there's more
+    than one stream to download).
+
+    streams which were downloaded before (and whose files are still
+    there, unchanged) aren't downloaded again.
+
+    return a dict of arrays of the video files downloaded, in the
+    same order as the streams, indexed by title.
+
+    """
+    jobs = [(title, i, stream)
+            for title, streams in episodes.items()
+            for i, stream in enumerate(streams)]
+    if parallel is None:
+        parallel = min(config.max_parallel_downloads, len(jobs)) > 1
+    rate_limiter = transfer.default_rate_limiter()
+    registry = download_registry.get_registry()
+
+    def _download(job):
+        title, i, stream = job
+        progress = None
+        if parallel:
+            progress = transfer.LineProgress(
+                "{} part {}".format(title, i + 1))
+        quality = None
+        if preview:
+            quality = config.preview_quality.get(stream.source)
+
+        filename_base = _stream_filename(title, dst_dir, i)
+        key = download_registry.stream_key(stream, quality)
+        existing = registry.reuse(key, filename_base)
+        if existing is not None:
+            print("Reusing earlier download of {} part {}: {}".format(
+                title, i + 1, existing))
+            return existing
+
+        video_file = stream.download(filename_base, progress=progress,
+                                     rate_limiter=rate_limiter,
+                                     quality=quality)
+        registry.record(key, video_file)
+        return video_file
+
+    if executor is not None:
+        video_files = list(executor.map(_download, jobs))
+    else:
+        with download_executor(len(jobs)) as own_executor:
+            video_files = list(own_executor.map(_download, jobs))
 
-    return video_files
+    episode_files = {title: [] for title in episodes}
+    for (title, _, _), video_file in zip(jobs, video_files):
+        episode_files[title].append(video_file)
 
+    return episode_files
+
+
+#an audio file queued for upload by the stage which created it
+_UploadJob = namedtuple("_UploadJob", ["title", "filename"])
+
+def _episode_pipeline(stream_dir, tmpdir, executor, workers, parallel):
+    """get a pipeline taking (title, streams) pairs through download,
+    audio extraction and autocutting, to (title, audio files) pairs
+
+    streams are downloaded with executor, which is shared by every
+    episode, so only as many run at once as it has workers, however
+    many episodes are downloading. workers is the number of episodes
+    to download at once, and parallel says whether more than one
+    stream may be downloading at a time.
+
+    in two-pass mode, only low quality previews are downloaded (to
+    tmpdir) and autocut, and the autocut stage then fetches the parts
+    of each stream to keep.
+
+    if config.upload is set, each audio file is passed to the upload
+    stage as soon as it has been encoded, so it can be uploaded while
+    the rest of the episode is still being cut.
+
+    when autocutting with config.checkpoint set, each episode's
+    intermediate files are kept in its work directory until the
+    episode has been cut, so if processing it fails, the stages which
+    were already done are skipped when it's run again. The work
+    directory is deleted once the episode is finished.
+
+    """
+    two_pass = config.autocut and config.two_pass
+    upload_target = None
+    if config.upload:
+        upload_target = upload_targets.get_target(config.upload_target)
+
+    #checkpoints for each episode, indexed by title
+    checkpoints = {}
+
+    def _on_output(title):
+        if upload_target is None:
+            return None
+        return lambda filename: episode_pipeline.feed(
+            "upload", _UploadJob(title, filename))
+
+    def _download(item):
+        title, streams = item
+        episode_checkpoint = None
+        if config.autocut:
+            episode_checkpoint = checkpoint.for_episode(title)
+        checkpoints[title] = episode_checkpoint
+
+        download_dir = stream_dir
+        if episode_checkpoint is not None and (two_pass or config.cleanup):
+            #downloads which won't be kept (previews, or any download
+            #with -c) are kept with the rest of the episode's
+            #intermediate files, so they're still there if it fails
+            download_dir = episode_checkpoint.directory
+        elif two_pass:
+            download_dir = tmpdir
+
+        download = lambda: download_streams(title, streams, download_dir,
+                                            preview=two_pass,
+                                            executor=executor,
+                                            parallel=parallel)
+        if episode_checkpoint is None:
+            return title, streams, download()
+
+        return title, streams, episode_checkpoint.run(
+            "download",
+            [[stream.url for stream in streams], two_pass, download_dir],
+            download, files=lambda video_files: video_files)
+
+    def _extract(item):
+        title, streams, video_files = item
+        print("Converting {} to audio...".format(title))
+        if config.autocut:
+            return (title, streams,
+                    cli.split_episode_audio(video_files, tmpdir,
+                                            checkpoints[title]), None)
+        return (title, streams, None,
+                cli.extract_episode_audio(video_files, title,
+                                          _on_output(title)))
+
+    def _autocut(item):
+        title, streams, segments, audio_files = item
+        episode_checkpoint = checkpoints[title]
+        if two_pass:
+            audio_files = cli.fetch_cut_episode_audio(streams, segments,
+                                                      title, tmpdir,
+                                                      _on_output(title),
+                                                      episode_checkpoint)
+        elif segments is not None:
+            audio_files = cli.cut_episode_audio(segments, title,
+                                                streams[0].source,
+                                                _on_output(title),
+                                                episode_checkpoint)
+
+        if episode_checkpoint is not None:
+            episode_checkpoint.clear()
+        return title, audio_files
+
+    def _upload(item):
+        if not isinstance(item, _UploadJob):
+            #an episode finished by the autocut stage, whose files have
+            #already been queued
+            return item
+        print("Uploading {}...".format(item.filename))
+        try:
+            location = upload_target.upload(item.filename)
+        except upload_targets.UploadException as error:
+            #the file is still saved locally, so a failed upload
+            #shouldn't stop the other episodes being processed
+            print("Failed to upload {}: {}".format(item.filename, error))
+            return None
+        print("Uploaded {} to {}".format(item.filename, location))
+        return None
+
+    stages = [
+        pipeline.Stage("download", _download,
+                       workers=workers),
+        pipeline.Stage("extract", _extract),
+        pipeline.Stage("autocut", _autocut)
+    ]
+    if upload_target is not None:
+        #files are queued for upload without limit, so encoding is
+        #never held up by uploads
+        stages.append(pipeline.Stage("upload", _upload,
+                                     workers=config.upload_workers,
+                                     queue_size=0))
+
+    episode_pipeline = pipeline.Pipeline(stages)
+    return episode_pipeline
+
+def process_episodes(to_download, stream_dir, tmpdir, executor=None,
+                     parallel=None):
+    """download and convert the streams for every episode in
+    TO_DOWNLOAD (a dict of arrays of streams indexed by title).
+
+    episodes go through a pipeline, so one episode can be converted or
+    cut while the next is still downloading. Streams are downloaded
+    with executor (by default, a new one running up to
+    config.max_parallel_downloads at once). parallel says whether
+    other downloads may be running at the same time (by default,
+    whether there's more than one stream to download).
+
+    return a dict of arrays of the audio files created, indexed by
+    title (in the same order as to_download).
+
+    """
+    streams = sum(len(episode_streams)
+                  for episode_streams in to_download.values())
+    workers = max(min(config.max_parallel_downloads, streams), 1)
+    if parallel is None:
+        parallel = workers > 1
+    if executor is None:
+        with download_executor(streams) as own_executor:
+            return process_episodes(to_download, stream_dir, tmpdir,
+                                    own_executor, parallel)
+
+    episode_pipeline = _episode_pipeline(stream_dir, tmpdir, executor,
+                                         workers, parallel)
+    try:
+        results = dict(episode_pipeline.run(to_download.items()))
+    finally:
+        print("Pipeline stages:\n{}".format(episode_pipeline.summary()))
+
+    return {title: results[title] for title in to_download}
 
 def stream_index_select(streams, split_episodes):
     to_download = {}
@@ -162,17 +473,12 @@ def main(args):
     if config.index_select:
         cr_filter = None
 
+    if config.refresh_cache:
+        refresh_caches()
+
     print("Retrieving recent streams...")
 
-    if config.source == "youtube":
-        streams = youtube.get_recent_critrole_videos(
-            limit=config.limit,
-            all_videos=config.youtube_all_uploads)
-    elif config.source == "twitch":
-        streams = twitch_download.get_vod_list(limit=config.limit)
-    else:
-        raise Exception(
-            "Invalid stream source specified: {}".format(config.source))
+    streams = sources.find_streams(limit=config.limit)
 
     if cr_filter:
         streams = filter_stream_list(streams, cr_filter)
@@ -202,26 +508,18 @@ def main(args):
         stream_dir = "."
 
     try:
-        print(("Downloading {} stream(s)...".format(num_streams)))
-        episode_files = {title: download_streams(title, streams, stream_dir)
-                         for title, streams in to_download.items()}
+        print(("Downloading and converting {} stream(s)...".format(
+            num_streams)))
+        audio_files = process_episodes(to_download, stream_dir, tmpdir)
 
-        print("Converting stream(s) to audio...")
-
-        audio_files = {
-            title: cli.videos_to_episode_audio(
-                video_files, title, tmpdir)
-            for title, video_files in episode_files.items()
-        }
         for title, files in audio_files.items():
             print("Output audio files for {}:\n{}".format(
                 title, "\n".join(files))
             )
 
-        if config.metadata_file:
-            metadata.write_metadata_file(config.metadata_file,
-                                         audio_files,
-                                         to_download)
+        if config.metadata_file or config.feed_file:
+            with catalog.EpisodeCatalog() as episode_catalog:
+                publish_episodes(audio_files, to_download, episode_catalog)
 
     finally:
         if not config.debug:
@@ -230,10 +528,8 @@ def main(args):
             print(("Debug mode: downloader script preserving temporary "
                    "directory {}".format(tmpdir)))
 
-    if config.upload:
-        print("Auto-uploader currently disabled.")
-        #print(("Uploading {} audio file(s)...".format(len(audio_files))))
-        #for audio_file in audio_files:
-        #    _upload_file(audio_file)
+    if config.debug:
+        print("API requests:\n{}".format(api_client.get_client().summary()))
+        print("ffmpeg job timings:\n{}".format(ffmpeg_jobs.summary()))
 
     print("Done.")
@@ -0,0 +1,271 @@
+"""watch.py
+
+This file provides a daemon which watches for new Critical Role
+episodes, and downloads, converts, uploads and publishes them without
+asking anything.
+
+Every few minutes, the configured sources are checked for streams
+whose titles match a regex and name an episode (so they can be saved
+under the filename suggested for them). New ones are added to a
+persistent job queue, which is worked through by threads that stay
+running between episodes, along with the sample fingerprints and API
+sessions they use.
+
+"""
+
+from argparse import ArgumentParser
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from cr_download.configuration import data as config
+from cr_download import catalog
+from cr_download import job_queue
+from cr_download import metadata
+from cr_download import sources
+
+from . import cli
+from . import downloader
+
+#longest an idle worker waits before checking the queue again
+IDLE_WAIT = 5.0
+
+def _watch_argparser():
+    parser = ArgumentParser(parents=[cli.base_argparser(),
+                                     cli.autocutter_argparser(),
+                                     downloader.download_argparser()],
+                            description="""Watch for new Critical Role
+                            episodes, and download them as soon as they
+                            appear""")
+
+    watch_args = parser.add_argument_group("watch")
+
+    watch_args.add_argument("--interval", type=float,
+                            default=config.watch_interval,
+                            help="""how often (in seconds) to check for new
+                            streams (default: {})""".format(
+                                config.watch_interval))
+
+    watch_args.add_argument("-r", "--regex", default=downloader.STRICT_CR_REGEX,
+                            help="""regex stream titles have to match to be
+                            downloaded""")
+
+    watch_args.add_argument("-o", "--output-dir", default=config.watch_output_dir,
+                            help="""directory to save episodes in (default:
+                            {})""".format(config.watch_output_dir))
+
+    watch_args.add_argument("-w", "--workers", type=int,
+                            dest="watch_workers", default=config.watch_workers,
+                            help="""number of episodes to process at once
+                            (default: {})""".format(config.watch_workers))
+
+    watch_args.add_argument("--retries", type=int, dest="watch_retries",
+                            default=config.watch_retries,
+                            help="""how many times to retry an episode
+                            which fails (default: {})""".format(
+                                config.watch_retries))
+
+    watch_args.add_argument("--backlog", action="store_true",
+                            help="""when first started, also download the
+                            episodes which are already available (by
+                            default, they're skipped)""")
+
+    watch_args.add_argument("--once", action="store_true",
+                            help="""check for streams once, process the
+                            queue and exit""")
+
+    return parser
+
+def select_streams(streams, title_regex, split_episodes):
+    """pick which streams to download, without prompting: the ones whose
+    titles match title_regex and name an episode.
+
+    return a list of (title, stream) pairs, with each title the
+    filename suggested for the episode.
+
+    """
+    selected = []
+    for stream in streams:
+        if title_regex and not re.match(title_regex, stream["title"],
+                                        flags=re.I):
+            continue
+        if not metadata.parse_critrole_title(stream["title"]):
+            continue
+        selected.append((cli.suggest_filename(stream["title"],
+                                              multiple_parts=split_episodes),
+                         stream))
+    return selected
+
+def _job_payload(stream):
+    return {"source": stream.source, "data": stream.json_data}
+
+def _job_stream(job):
+    source_class = sources.load_source(job.payload["source"])
+    return source_class(job.payload["data"])
+
+class WatchDaemon:
+    """poll for new episodes and process them with worker threads, until
+    stopped. Every worker downloads streams with executor, so no more
+    downloads run at once than it has workers.
+
+    """
+    def __init__(self, queue, episode_catalog, executor):
+        self.queue = queue
+        self.catalog = episode_catalog
+        self.executor = executor
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._publish_lock = threading.Lock()
+
+    def poll(self, skip=False):
+        """check the sources for new streams and queue them (or record
+        them as skipped, if skip is specified). Return the number of
+        jobs queued, or None if the sources couldn't be checked.
+
+        """
+        try:
+            streams = sources.find_streams(limit=config.limit)
+        except sources.SourceException as error:
+            print("Could not check for new streams: {}".format(error))
+            return None
+
+        split_episodes = config.autocut and not config.autocut_merge
+        queued = 0
+        for title, stream in select_streams(streams, config.regex,
+                                            split_episodes):
+            status = job_queue.SKIPPED if skip else job_queue.QUEUED
+            if self.queue.enqueue(stream.url, title, _job_payload(stream),
+                                  status=status) and not skip:
+                print("Queued {} ({})".format(stream["title"], title))
+                queued += 1
+
+        if queued:
+            self._wake.set()
+        return queued
+
+    def process(self, job):
+        """download, convert, upload and publish the episode for a job
+        """
+        stream = _job_stream(job)
+        title = os.path.join(config.output_dir, job.title)
+        to_download = {title: [stream]}
+
+        tmpdir = tempfile.mkdtemp()
+        stream_dir = tmpdir if config.cleanup else config.output_dir
+        try:
+            #the daemon's output is a log, so downloads always report
+            #their progress a line at a time
+            audio_files = downloader.process_episodes(
+                to_download, stream_dir, tmpdir, self.executor, parallel=True)
+        finally:
+            if not config.debug:
+                shutil.rmtree(tmpdir)
+
+        with self._publish_lock:
+            downloader.publish_episodes(audio_files, to_download, self.catalog)
+
+        print("Finished {}:\n{}".format(job.title,
+                                         "\n".join(audio_files[title])))
+
+    def _run_job(self, job):
+        try:
+            self.process(job)
+            self.queue.complete(job.id)
+        except Exception as error:
+            retry = job.attempts <= config.watch_retries
+            print("Failed to process {}{}: {}".format(
+                job.title, ", will retry" if retry else "", error))
+            self.queue.fail(job.id, error, retry=retry)
+
+    def _worker(self, until_empty):
+        while not self._stop.is_set():
+            job = self.queue.claim()
+            if job is not None:
+                self._run_job(job)
+            elif until_empty:
+                return
+            else:
+                self._wake.wait(timeout=IDLE_WAIT)
+                self._wake.clear()
+
+    def _start_workers(self, until_empty=False):
+        workers = [threading.Thread(target=self._worker, args=(until_empty,))
+                   for _ in range(max(config.watch_workers, 1))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        return workers
+
+    def run_queue(self):
+        """process queued jobs until the queue is empty
+        """
+        for worker in self._start_workers(until_empty=True):
+            worker.join()
+
+    def run(self, interval, skip_first=False):
+        """poll every interval seconds, processing queued jobs in
+        config.watch_workers threads, until interrupted
+
+        """
+        self._start_workers()
+
+        skip = skip_first
+        try:
+            while True:
+                #keep skipping the episodes already available until
+                #they've actually been seen
+                if self.poll(skip=skip) is not None:
+                    skip = False
+                self._stop.wait(timeout=interval)
+        finally:
+            self._stop.set()
+            self._wake.set()
+
+def _warm_up():
+    #load everything the workers need up front, so the first episode
+    #isn't slowed down
+    if config.autocut:
+        from cr_download.autocut import sample_fingerprint
+
+        sample_fingerprint.load_prints(sample_file=config.sample_data_file)
+
+def main(args):
+    parser = _watch_argparser()
+    cli.parse_args(parser, args)
+
+    if config.refresh_cache:
+        downloader.refresh_caches()
+
+    if not os.path.isdir(config.output_dir):
+        os.makedirs(config.output_dir)
+
+    with job_queue.JobQueue() as queue, \
+         catalog.EpisodeCatalog() as episode_catalog, \
+         downloader.download_executor(config.max_parallel_downloads) \
+         as executor:
+        requeued = queue.requeue_running()
+        if requeued:
+            print("Requeued {} interrupted job(s)".format(requeued))
+
+        #unless asked for the backlog, only episodes which appear after
+        #the daemon is first started are downloaded
+        skip_first = queue.is_empty() and not config.backlog
+
+        _warm_up()
+        daemon = WatchDaemon(queue, episode_catalog, executor)
+        if config.once:
+            daemon.poll(skip=skip_first)
+            daemon.run_queue()
+        else:
+            print("Checking for new streams every {:g}s...".format(
+                config.interval))
+            try:
+                daemon.run(config.interval, skip_first)
+            except KeyboardInterrupt:
+                print("Stopping.")
+
+        print("Jobs: {}".format(", ".join(
+            "{} {}".format(count, status)
+            for status, count in sorted(queue.counts().items()))))
@@ -1,6 +1,5 @@
 from setuptools import setup, find_packages
 from os import path
-from io import open
 
 setup_dir = path.abspath(path.dirname(__file__))
 with open(path.join(setup_dir, 'README.md'),
@@ -14,7 +13,8 @@ setup(
     packages=find_packages(),
 
     scripts=["bin/critrole_download",
-             "bin/autocut_vod"],
+             "bin/autocut_vod",
+             "bin/critrole_watch"],
 
     include_package_data=True,
 
@@ -25,10 +25,9 @@ setup(
         'ruamel.yaml>=0.15.0, <=0.15.87',
         'requests',
         'google-api-python-client',
-        'progressbar2',
-        'future',
-        'pathlib'
+        'progressbar2'
     ],
+    python_requires='>=3.7',
 
     author="Teddy Weisman",
     author_email="tjweisman@gmail.com",
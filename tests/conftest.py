@@ -0,0 +1,135 @@
+"""shared fixtures for the tests.
+
+Tests run against the packages in the source tree, with the config
+and application data directories pointed at a temporary directory (so
+the user's own config and cache are never touched), and talk to fake
+servers running in a thread instead of the real APIs.
+
+"""
+
+from http.server import ThreadingHTTPServer
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+_TEST_HOME = tempfile.mkdtemp(prefix="cr_download_tests_")
+os.environ["XDG_CONFIG_HOME"] = os.path.join(_TEST_HOME, "config")
+os.environ["XDG_DATA_HOME"] = os.path.join(_TEST_HOME, "data")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "packages"))
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """give each test its own (empty) application data directory
+    """
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "data"))
+    return tmp_path / "data"
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """retry failed requests straight away
+    """
+    from cr_download import api_client
+
+    monkeypatch.setattr(api_client, "BACKOFF_BASE", 0.0)
+
+@pytest.fixture
+def serve():
+    """start a local HTTP server with the given handler class in a
+    thread, and return its base url
+
+    """
+    servers = []
+
+    def _serve(handler_class):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever,
+                                  kwargs={"poll_interval": 0.05})
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+        return "http://127.0.0.1:{}".format(server.server_port)
+
+    yield _serve
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def hls_server(serve):
+    """a fake HLS server with a master playlist of two renditions,
+    "chunked" and "audio_only", each with 20 ten second segments.
+
+    segments later in the playlist are served faster, so they arrive
+    out of order. Requests are logged in the handler's requests list,
+    and segments in its failing set get a 500 error.
+
+    """
+    from fake_servers import HLSHandler
+
+    class Handler(HLSHandler):
+        requests = []
+        failing = set()
+        playlist_requests = 0
+
+    Handler.url = serve(Handler)
+    return Handler
+
+@pytest.fixture
+def range_server(serve):
+    """a fake file server supporting Range requests, serving 3MB of
+    random data (see fake_servers.RangeHandler)
+
+    """
+    from fake_servers import RangeHandler
+
+    class Handler(RangeHandler):
+        data = os.urandom(3 * 1024 * 1024)
+        requests = []
+
+    Handler.url = serve(Handler) + "/file.mp4"
+    return Handler
+
+@pytest.fixture
+def drive_server(serve):
+    """a fake Drive resumable upload endpoint (see
+    fake_servers.DriveHandler)
+
+    """
+    from fake_servers import DriveHandler
+
+    class Handler(DriveHandler):
+        sessions = {}
+        puts = []
+        start_errors = []
+        put_errors = []
+
+    Handler.url = serve(Handler) + "/upload"
+    return Handler
+
+@pytest.fixture
+def api_server(serve):
+    """a fake JSON API, answering every request with its data.
+
+    while its statuses list is non-empty, each request gets the next
+    status in it instead (with a Retry-After header, if retry_after is
+    set). If etag is set, it's sent with the data, and a request with
+    a matching If-None-Match header gets a 304. Requests are logged in
+    requests as (path, If-None-Match header) pairs.
+
+    """
+    from fake_servers import APIHandler
+
+    class Handler(APIHandler):
+        data = {"items": [1, 2, 3]}
+        requests = []
+        statuses = []
+
+    Handler.url = serve(Handler) + "/api"
+    return Handler
@@ -0,0 +1,256 @@
+"""request handlers for the fake servers the tests run
+"""
+
+from http.server import BaseHTTPRequestHandler
+import json
+import time
+from urllib.parse import parse_qs, urlparse
+
+class QuietHandler(BaseHTTPRequestHandler):
+    """request handler which doesn't log every request to stderr, with
+    helpers for parsing requests and sending responses
+
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def query(self):
+        return {key: values[0] for key, values
+                in parse_qs(urlparse(self.path).query).items()}
+
+    @property
+    def route(self):
+        return urlparse(self.path).path
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def send_body(self, status, body=b"", headers=None,
+                  content_type="application/octet-stream"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_json(self, data, status=200, headers=None):
+        self.send_body(status, json.dumps(data).encode("utf-8"), headers,
+                       content_type="application/json")
+
+class HLSHandler(QuietHandler):
+    """fake HLS server (see the hls_server fixture)
+    """
+    renditions = {"chunked": 2000000, "audio_only": 100000}
+    segment_count = 20
+    segment_duration = 10.0
+
+    requests = []
+    failing = set()
+    playlist_requests = 0
+
+    @classmethod
+    def segment_data(cls, rendition, index):
+        return "{} segment {}\n".format(rendition, index).encode("utf-8") * 100
+
+    @classmethod
+    def expected(cls, rendition, indices=None):
+        if indices is None:
+            indices = range(cls.segment_count)
+        return b"".join(cls.segment_data(rendition, index)
+                        for index in indices)
+
+    def _master(self):
+        lines = ["#EXTM3U"]
+        for name, bandwidth in self.renditions.items():
+            lines += ["#EXT-X-STREAM-INF:BANDWIDTH={},VIDEO=\"{}\"".format(
+                bandwidth, name), "{}/index.m3u8".format(name)]
+        return "\n".join(lines) + "\n"
+
+    def _media(self):
+        #every playlist request gets a new access token, like Twitch
+        type(self).playlist_requests += 1
+        lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:10"]
+        for index in range(self.segment_count):
+            lines += ["#EXTINF:{:.1f},".format(self.segment_duration),
+                      "{}.ts?token={}".format(index, self.playlist_requests)]
+        return "\n".join(lines) + "\n#EXT-X-ENDLIST\n"
+
+    def do_GET(self):
+        parts = self.route.strip("/").split("/")
+        if parts == ["master.m3u8"]:
+            self.send_body(200, self._master().encode("utf-8"))
+            return
+        if parts[-1] == "index.m3u8":
+            self.send_body(200, self._media().encode("utf-8"))
+            return
+
+        rendition, index = parts[0], int(parts[1].split(".")[0])
+        self.requests.append((rendition, index))
+        if (rendition, index) in self.failing:
+            self.send_body(500)
+            return
+        time.sleep(0.002 * (self.segment_count - index))
+        self.send_body(200, self.segment_data(rendition, index))
+
+class RangeHandler(QuietHandler):
+    """fake file server supporting Range requests.
+
+    subclasses set data (the file's contents). Each request's Range
+    header is logged in requests; while drops is non-zero, a response
+    is cut off after drop_after bytes (and drops is decremented), and
+    while errors is non-zero a 500 error is sent instead (errors is
+    set to errors_after_drop when a response is cut off). If ranges is
+    False, Range headers are ignored.
+
+    """
+    data = b""
+    requests = []
+    drops = 0
+    drop_after = 0
+    errors = 0
+    errors_after_drop = 0
+    ranges = True
+    delay = 0.0
+
+    def _range(self):
+        header = self.headers.get("Range")
+        if not self.ranges or not header:
+            return None
+        start, end = header.split("=", 1)[1].split("-")
+        end = int(end) + 1 if end else len(self.data)
+        return int(start), min(end, len(self.data))
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests.append(self.headers.get("Range"))
+        if cls.errors:
+            cls.errors -= 1
+            self.send_body(500)
+            return
+
+        byte_range = self._range()
+        if byte_range is None:
+            status, body, headers = 200, self.data, {}
+        else:
+            start, end = byte_range
+            status, body = 206, self.data[start:end]
+            headers = {"Content-Range": "bytes {}-{}/{}".format(
+                start, end - 1, len(self.data))}
+
+        if self.delay:
+            time.sleep(self.delay)
+
+        if cls.drops and len(body) > cls.drop_after:
+            cls.drops -= 1
+            cls.errors = cls.errors_after_drop
+            #promise the whole body, then hang up partway through it
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body[:cls.drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+        self.send_body(status, body, headers)
+
+class DriveHandler(QuietHandler):
+    """fake Drive resumable upload endpoint.
+
+    POSTs start a session, and PUTs send chunks to it, following the
+    resumable upload protocol. Subclasses can set put_errors (statuses
+    to answer the next PUTs with), start_errors (the same for POSTs),
+    expire (the number of sessions which are gone when first used) and
+    hold_last (answer the last chunk with a 308 instead of finishing).
+
+    """
+    sessions = {}
+    puts = []
+    start_errors = []
+    put_errors = []
+    expire = 0
+    hold_last = False
+
+    def do_POST(self):
+        cls = type(self)
+        self.read_body()
+        if cls.start_errors:
+            self.send_body(cls.start_errors.pop(0))
+            return
+        session_id = str(len(cls.sessions))
+        size = int(self.headers["X-Upload-Content-Length"])
+        cls.sessions[session_id] = {"data": bytearray(), "size": size,
+                                    "expired": cls.expire > 0}
+        cls.expire = max(cls.expire - 1, 0)
+        self.send_body(200, headers={
+            "Location": "http://{}:{}/upload/{}".format(
+                *self.server.server_address, session_id)})
+
+    def _status(self, session):
+        if len(session["data"]) == session["size"]:
+            self.send_json({"id": "file{}".format(len(self.sessions))})
+        elif session["data"]:
+            self.send_body(308, headers={"Range": "bytes=0-{}".format(
+                len(session["data"]) - 1)})
+        else:
+            self.send_body(308)
+
+    def do_PUT(self):
+        cls = type(self)
+        body = self.read_body()
+        content_range = self.headers["Content-Range"]
+        cls.puts.append(content_range)
+        session = cls.sessions[self.route.rsplit("/", 1)[1]]
+
+        if session["expired"]:
+            self.send_body(404)
+            return
+        if cls.put_errors:
+            self.send_body(cls.put_errors.pop(0))
+            return
+
+        byte_range, size = content_range.split(" ")[1].split("/")
+        if byte_range != "*":
+            start, end = [int(pos) for pos in byte_range.split("-")]
+            assert start == len(session["data"]) and end >= start
+            assert end - start + 1 == len(body)
+            session["data"] += body
+            if cls.hold_last and len(session["data"]) == session["size"]:
+                cls.hold_last = False
+                self.send_body(308, headers={"Range": "bytes=0-{}".format(
+                    session["size"] - 1)})
+                return
+        self._status(session)
+
+class APIHandler(QuietHandler):
+    """fake JSON API (see the api_server fixture)
+    """
+    data = {}
+    requests = []
+    statuses = []
+    retry_after = None
+    etag = None
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests.append((self.path, self.headers.get("If-None-Match")))
+        if cls.statuses:
+            headers = {}
+            if cls.retry_after is not None:
+                headers["Retry-After"] = str(cls.retry_after)
+            self.send_json({"error": "try again"}, cls.statuses.pop(0),
+                           headers)
+        elif cls.etag is not None and (
+                self.headers.get("If-None-Match") == cls.etag):
+            self.send_body(304, headers={"ETag": cls.etag})
+        else:
+            self.send_json(cls.data, headers=(
+                {"ETag": cls.etag} if cls.etag is not None else {}))
@@ -0,0 +1,86 @@
+from urllib.parse import urlparse
+
+import pytest
+
+from cr_download import api_client
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """record the waits between retries instead of sleeping
+    """
+    waits = []
+    monkeypatch.setattr(api_client.time, "sleep", waits.append)
+    return waits
+
+def _client():
+    return api_client.APIClient(timeout=5, max_retries=3)
+
+@pytest.mark.usefixtures("no_backoff")
+def test_retries_until_success(api_server):
+    api_server.statuses = [503, 429, 500]
+    client = _client()
+
+    assert client.get(api_server.url) == {"items": [1, 2, 3]}
+
+    assert len(api_server.requests) == 4
+    stats = client.stats[urlparse(api_server.url).netloc]
+    assert (stats.requests, stats.retries, stats.errors) == (4, 3, 0)
+
+@pytest.mark.usefixtures("no_backoff")
+def test_gives_up_after_max_retries(api_server):
+    api_server.statuses = [502] * 10
+    client = _client()
+
+    with pytest.raises(api_client.APIError, match="status 502"):
+        client.get(api_server.url)
+
+    assert len(api_server.requests) == 4
+    stats = client.stats[urlparse(api_server.url).netloc]
+    assert (stats.requests, stats.retries, stats.errors) == (4, 3, 1)
+
+def test_other_errors_not_retried(api_server, sleeps):
+    api_server.statuses = [404]
+
+    with pytest.raises(api_client.APIError, match="status 404"):
+        _client().get(api_server.url)
+
+    assert len(api_server.requests) == 1
+    assert sleeps == []
+
+def test_backoff_between_retries(api_server, sleeps):
+    api_server.statuses = [503, 503, 429]
+    api_server.retry_after = None
+
+    _client().get(api_server.url)
+
+    assert sleeps == [1.0, 2.0, 4.0]
+
+def test_retry_after_honored(api_server, sleeps):
+    api_server.statuses = [429]
+    api_server.retry_after = 7
+
+    _client().get(api_server.url)
+
+    assert sleeps == [7.0]
+
+def test_connection_errors_retried(sleeps):
+    #nothing listens on port 9 (discard) on the loopback interface
+    with pytest.raises(api_client.APIError, match="failed"):
+        _client().get("http://127.0.0.1:9/api")
+
+    assert len(sleeps) == 3
+
+def test_retry_delay():
+    assert [api_client.retry_delay(None, attempt)
+            for attempt in range(3)] == [1.0, 2.0, 4.0]
+    assert api_client.retry_delay(None, 20) == api_client.MAX_BACKOFF
+    assert api_client.retry_delay(FakeResponse({"Retry-After": "3"}), 5) == 3
+    assert api_client.retry_delay(
+        FakeResponse({"Retry-After": "100000"}), 0) == api_client.MAX_BACKOFF
+    #dates aren't supported, so fall back to backoff
+    assert api_client.retry_delay(FakeResponse(
+        {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}), 1) == 2.0
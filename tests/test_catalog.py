@@ -0,0 +1,91 @@
+import pytest
+
+from cr_download import catalog
+from cr_download import metadata
+
+class FakeStream(dict):
+    def __init__(self, title, url, date="2018-01-01"):
+        super().__init__(title=title, creation_date=date)
+        self.url = url
+
+def _entry(ep_id, title="Title", airdate="2018-01-01"):
+    return {"id": ep_id, "title": title, "airdate": airdate,
+            "file": "/audio/{}.m4a".format(ep_id)}
+
+@pytest.fixture
+def episode_catalog(tmp_path):
+    with catalog.EpisodeCatalog(str(tmp_path / "episodes.db")) as opened:
+        yield opened
+
+def test_upsert_reports_changes(episode_catalog):
+    assert episode_catalog.upsert(_entry("c2ep001"), 2, 1)
+    assert not episode_catalog.upsert(_entry("c2ep001"), 2, 1)
+    assert episode_catalog.upsert(_entry("c2ep001", title="New"), 2, 1)
+
+    assert episode_catalog.get("c2ep001") == _entry("c2ep001", title="New")
+    assert episode_catalog.get("c2ep002") is None
+
+def test_catalog_persists(tmp_path):
+    path = str(tmp_path / "episodes.db")
+    with catalog.EpisodeCatalog(path) as episode_catalog:
+        episode_catalog.upsert(_entry("c2ep001"), 2, 1)
+
+    with catalog.EpisodeCatalog(path) as episode_catalog:
+        assert episode_catalog.get("c2ep001") == _entry("c2ep001")
+
+def test_query_orders_and_filters(episode_catalog):
+    for ep_id, numbers in [("c2ep010", (2, 10, None)),
+                           ("c1ep003p02", (1, 3, 2)),
+                           ("c2ep002", (2, 2, None)),
+                           ("c1ep003p01", (1, 3, 1))]:
+        episode_catalog.upsert(_entry(ep_id), *numbers)
+
+    def ids(**kwargs):
+        return [entry["id"] for entry in episode_catalog.query(**kwargs)]
+
+    assert ids() == ["c1ep003p01", "c1ep003p02", "c2ep002", "c2ep010"]
+    assert ids(campaign=2) == ["c2ep002", "c2ep010"]
+    assert ids(first=3, last=9) == ["c1ep003p01", "c1ep003p02"]
+    assert ids(campaign="2", first=5) == ["c2ep010"]
+
+def test_remove(episode_catalog):
+    episode_catalog.upsert(_entry("c2ep001"), 2, 1)
+    episode_catalog.upsert(_entry("c2ep002"), 2, 2)
+
+    episode_catalog.remove("c2ep001")
+
+    assert [entry["id"] for entry in episode_catalog.query()] == ["c2ep002"]
+
+def test_export_yaml(episode_catalog, tmp_path):
+    from ruamel.yaml import YAML
+
+    entry = _entry("c2ep001")
+    entry["description"] = "a: description"
+    episode_catalog.upsert(entry, 2, 1)
+    episode_catalog.upsert(_entry("c2ep002"), 2, 2)
+    output_file = tmp_path / "episodes.yaml"
+
+    episode_catalog.export_yaml(str(output_file))
+
+    assert YAML(typ="safe").load(output_file) == {
+        "c2ep001": entry, "c2ep002": _entry("c2ep002")}
+
+def test_empty_id_rejected(episode_catalog):
+    with pytest.raises(catalog.CatalogException):
+        episode_catalog.upsert(_entry(""))
+
+    assert episode_catalog.query() == []
+
+def test_unnamed_episodes_kept_apart(episode_catalog):
+    streams = {"one": [FakeStream("Talks Machina", "https://example.com/1")],
+               "two": [FakeStream("Q&A stream", "https://example.com/2")]}
+    audio_files = {"one": ["one.m4a"], "two": ["two.m4a"]}
+
+    entries, changed = metadata.catalog_episodes(audio_files, streams,
+                                                 episode_catalog)
+
+    assert changed
+    assert [entry["id"] for entry in entries] == [
+        "https://example.com/1", "https://example.com/2"]
+    assert sorted(entry["title"] for entry in episode_catalog.query()) == [
+        "Q&A stream", "Talks Machina"]
@@ -0,0 +1,47 @@
+import os
+
+from cr_download import checkpoint
+
+def test_finished_stage_is_reused(tmp_path):
+    calls = []
+
+    def _stage():
+        calls.append(1)
+        with open(str(tmp_path / "work" / "out"), "w") as out_file:
+            out_file.write("data")
+        return str(tmp_path / "work" / "out")
+
+    episode_checkpoint = checkpoint.EpisodeCheckpoint(str(tmp_path / "work"))
+    episode_checkpoint.run("stage", ["input"], _stage, files=lambda f: [f])
+
+    rerun = checkpoint.EpisodeCheckpoint(str(tmp_path / "work"))
+    result = rerun.run("stage", ["input"], _stage, files=lambda f: [f])
+
+    assert result == str(tmp_path / "work" / "out")
+    assert len(calls) == 1
+    assert rerun.skipped == ["stage"]
+
+def test_stage_reruns_when_inputs_or_files_change(tmp_path):
+    calls = []
+
+    def _stage():
+        calls.append(1)
+        with open(str(tmp_path / "work" / "out"), "w") as out_file:
+            out_file.write("data")
+        return str(tmp_path / "work" / "out")
+
+    episode_checkpoint = checkpoint.EpisodeCheckpoint(str(tmp_path / "work"))
+    episode_checkpoint.run("stage", ["input"], _stage, files=lambda f: [f])
+    episode_checkpoint.run("stage", ["changed"], _stage, files=lambda f: [f])
+    os.remove(str(tmp_path / "work" / "out"))
+    episode_checkpoint.run("stage", ["changed"], _stage, files=lambda f: [f])
+
+    assert len(calls) == 3
+
+def test_clear_removes_work_dir(tmp_path):
+    episode_checkpoint = checkpoint.EpisodeCheckpoint(str(tmp_path / "work"))
+    episode_checkpoint.run("stage", [], lambda: 1)
+
+    episode_checkpoint.clear()
+
+    assert not os.path.exists(str(tmp_path / "work"))
@@ -0,0 +1,56 @@
+import os
+
+from cr_download import download_registry
+
+def _registry(tmp_path):
+    return download_registry.DownloadRegistry(str(tmp_path / "downloads.json"))
+
+def _write(path, data):
+    with open(str(path), "wb") as output_file:
+        output_file.write(data)
+    return str(path)
+
+def test_record_leaves_hashing_to_first_lookup(tmp_path, monkeypatch):
+    hashed = []
+    file_hash = download_registry.file_hash
+    monkeypatch.setattr(download_registry, "file_hash",
+                        lambda filename: hashed.append(filename)
+                        or file_hash(filename))
+    video_file = _write(tmp_path / "video.mp4", b"video")
+
+    registry = _registry(tmp_path)
+    registry.record("url audio", video_file)
+    assert hashed == []
+
+    assert registry.find("url audio") == video_file
+    assert hashed == [video_file]
+    assert _registry(tmp_path).entries["url audio"]["sha256"] == file_hash(
+        video_file)
+
+def test_touched_file_reused_once_hashed(tmp_path):
+    video_file = _write(tmp_path / "video.mp4", b"video")
+    registry = _registry(tmp_path)
+    registry.record("url audio", video_file)
+    registry.find("url audio")
+
+    os.utime(video_file, (0, 0))
+    assert registry.find("url audio") == video_file
+
+    _write(video_file, b"VIDEO")
+    os.utime(video_file, (1, 1))
+    assert registry.find("url audio") is None
+
+def test_touched_file_not_reused_before_hashing(tmp_path):
+    video_file = _write(tmp_path / "video.mp4", b"video")
+    registry = _registry(tmp_path)
+    registry.record("url audio", video_file)
+
+    os.utime(video_file, (0, 0))
+    assert registry.find("url audio") is None
+
+def test_missing_filenames_not_recorded(tmp_path):
+    registry = _registry(tmp_path)
+    registry.record("url audio", "")
+    registry.record("url video", str(tmp_path / "missing.mp4"))
+
+    assert registry.entries == {}
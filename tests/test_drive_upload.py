@@ -0,0 +1,126 @@
+from collections import namedtuple
+import os
+
+import pytest
+
+from cr_download.configuration import data as config
+from cr_download import drive_upload
+
+Token = namedtuple("Token", ["access_token"])
+
+class FakeCredentials:
+    def get_access_token(self):
+        return Token("token")
+
+CHUNK = drive_upload.CHUNK_ALIGNMENT
+
+@pytest.fixture
+def upload_file(tmp_path):
+    filename = str(tmp_path / "episode.mp3")
+    with open(filename, "wb") as output_file:
+        output_file.write(os.urandom(4 * CHUNK + 100))
+    return filename
+
+@pytest.fixture
+def make_uploader(drive_server, tmp_path, no_backoff, monkeypatch):
+    monkeypatch.setattr(config, "api_retries", 1)
+
+    def _make_uploader():
+        return drive_upload.DriveUploader(
+            folder_id="folder", credentials=FakeCredentials(),
+            upload_url=drive_server.url, chunk_size=CHUNK, workers=2,
+            sessions=drive_upload.UploadSessions(
+                str(tmp_path / "sessions.json")))
+    return _make_uploader
+
+def _uploaded(drive_server, session_id):
+    return bytes(drive_server.sessions[session_id]["data"])
+
+def _read(filename):
+    with open(filename, "rb") as input_file:
+        return input_file.read()
+
+def test_upload_in_chunks(drive_server, make_uploader, upload_file):
+    file_id = make_uploader().upload(upload_file)
+
+    assert file_id == "file1"
+    assert _uploaded(drive_server, "0") == _read(upload_file)
+    assert len(drive_server.puts) == 5
+
+def test_interrupted_upload_resumes(drive_server, make_uploader,
+                                    upload_file):
+    #the first two chunks get through, then the server keeps failing
+    uploader = make_uploader()
+    original_put = uploader._put
+    sent = []
+
+    def _put(session_uri, content_range, data=b""):
+        sent.append(content_range)
+        if len(sent) == 3:
+            drive_server.put_errors += [503, 503]
+        return original_put(session_uri, content_range, data)
+
+    uploader._put = _put
+    with pytest.raises(drive_upload.DriveUploadException):
+        uploader.upload(upload_file)
+
+    del drive_server.puts[:]
+    make_uploader().upload(upload_file)
+
+    #the same session is asked what it has, and only the rest is sent
+    assert len(drive_server.sessions) == 1
+    assert drive_server.puts[0] == "bytes */{}".format(4 * CHUNK + 100)
+    assert drive_server.puts[1].startswith("bytes {}-".format(2 * CHUNK))
+    assert _uploaded(drive_server, "0") == _read(upload_file)
+
+def test_every_byte_received_without_finishing(drive_server, make_uploader,
+                                               upload_file):
+    drive_server.hold_last = True
+    size = 4 * CHUNK + 100
+
+    make_uploader().upload(upload_file)
+
+    assert drive_server.puts[-1] == "bytes */{}".format(size)
+    assert "bytes {}-{}/{}".format(size, size - 1, size) not in \
+        drive_server.puts
+
+def test_expired_session_starts_over(drive_server, make_uploader,
+                                     upload_file):
+    drive_server.expire = 1
+
+    make_uploader().upload(upload_file)
+
+    assert len(drive_server.sessions) == 2
+    assert _uploaded(drive_server, "1") == _read(upload_file)
+
+def test_session_restarts_are_capped(drive_server, make_uploader,
+                                     upload_file):
+    drive_server.expire = 100
+
+    with pytest.raises(drive_upload.DriveUploadException):
+        make_uploader().upload(upload_file)
+
+    assert len(drive_server.sessions) == drive_upload.MAX_SESSION_RESTARTS + 1
+
+def test_start_retries_server_errors(drive_server, make_uploader,
+                                     upload_file):
+    drive_server.start_errors += [503]
+
+    make_uploader().upload(upload_file)
+
+    assert _uploaded(drive_server, "0") == _read(upload_file)
+
+def test_upload_files_concurrently(drive_server, make_uploader, tmp_path):
+    filenames = []
+    for number in range(3):
+        filename = str(tmp_path / "part{}.mp3".format(number))
+        with open(filename, "wb") as output_file:
+            output_file.write(os.urandom(CHUNK + number))
+        filenames.append(filename)
+
+    file_ids = make_uploader().upload_files(filenames)
+
+    assert sorted(file_ids) == sorted(filenames)
+    uploads = sorted(bytes(session["data"])
+                     for session in drive_server.sessions.values())
+    assert uploads == sorted(_read(filename) for filename in filenames)
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from cr_download import feed
+from cr_download import media_utils
+
+@pytest.fixture
+def probes(monkeypatch):
+    probed = []
+
+    def _probe(filename):
+        probed.append(filename)
+        return {"format": {"duration": "3600.0"}}
+
+    monkeypatch.setattr(media_utils, "probe", _probe)
+    return probed
+
+def _entry(tmp_path, number, create=True):
+    filename = str(tmp_path / "C2E{:03d}.mp3".format(number))
+    if create:
+        with open(filename, "wb") as audio_file:
+            audio_file.write(b"x" * number)
+    return {"id": "C2E{:03d}".format(number),
+            "title": "Episode {}".format(number),
+            "airdate": "2018-01-{:02d}".format(number), "file": filename}
+
+def _write(tmp_path, entries):
+    builder = feed.FeedBuilder(str(tmp_path / "feed_cache.json"))
+    output = str(tmp_path / "feed.xml")
+    builder.write(output, entries, title="Feed", link="http://example.com",
+                  description="", base_url="http://example.com/audio")
+    with open(output, encoding="utf-8") as feed_file:
+        return feed_file.read()
+
+def test_unchanged_files_probed_once(tmp_path, probes):
+    entries = [_entry(tmp_path, 1), _entry(tmp_path, 2)]
+
+    _write(tmp_path, entries)
+    _write(tmp_path, entries)
+
+    assert len(probes) == 2
+
+def test_moved_file_keeps_last_probe(tmp_path, probes):
+    entries = [_entry(tmp_path, 1), _entry(tmp_path, 2)]
+    _write(tmp_path, entries)
+    os.remove(entries[0]["file"])
+
+    xml = _write(tmp_path, entries)
+
+    assert "<title>Episode 1</title>" in xml
+    assert "length=\"1\"" in xml
+    assert not os.path.exists(str(tmp_path / "feed.xml.tmp"))
+
+def test_missing_unprobed_file_left_out(tmp_path, probes):
+    entries = [_entry(tmp_path, 1), _entry(tmp_path, 2, create=False)]
+
+    xml = _write(tmp_path, entries)
+
+    assert "<title>Episode 1</title>" in xml
+    assert "Episode 2" not in xml
+
+def test_failed_feed_leaves_no_temporary_file(tmp_path, monkeypatch):
+    def _probe(filename):
+        raise media_utils.MediaException("can't read")
+
+    monkeypatch.setattr(media_utils, "probe", _probe)
+
+    with pytest.raises(media_utils.MediaException):
+        _write(tmp_path, [_entry(tmp_path, 1)])
+    assert not os.path.exists(str(tmp_path / "feed.xml.tmp"))
@@ -0,0 +1,96 @@
+import os
+import shutil
+import sys
+import time
+
+import pytest
+
+from cr_download.configuration import data as config
+from cr_download import ffmpeg_jobs
+
+#stands in for ffmpeg: the last argument picks what it does
+FAKE_FFMPEG = """#!{python}
+import sys
+import time
+
+mode = sys.argv[-1]
+if mode == "progress":
+    print("out_time_us=1500000\\ntotal_size=1024\\nspeed=2.5x\\n"
+          "progress=continue")
+    print("out_time_us=N/A\\nout_time_ms=3000000\\ntotal_size=N/A\\n"
+          "speed=N/A\\nprogress=end")
+elif mode == "fail":
+    time.sleep(0.2)
+    sys.stderr.write("input.mp4: Invalid data found\\n")
+    sys.exit(3)
+elif mode == "sleep":
+    time.sleep(30)
+elif mode == "burn":
+    end = time.process_time() + 0.3
+    while time.process_time() < end:
+        pass
+"""
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "ffmpeg"
+    script.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}{}{}".format(bin_dir, os.pathsep,
+                                               os.environ["PATH"]))
+    monkeypatch.setattr(config, "ffmpeg_path", "ffmpeg", raising=False)
+    monkeypatch.setattr(config, "ffmpeg_progress_interval", 0, raising=False)
+
+def test_progress_parsed(fake_ffmpeg):
+    events = []
+
+    job = ffmpeg_jobs.run(["progress"], on_progress=events.append)
+
+    assert [event[1:] for event in events] == [
+        (1.5, 1024, 2.5, False), (3.0, None, None, True)]
+    assert all(event.job is job for event in events)
+    assert job.last_progress == events[-1]
+    assert job.returncode == 0
+
+def test_failure_raises_with_log(fake_ffmpeg):
+    with pytest.raises(ffmpeg_jobs.FFmpegError,
+                       match=r"status 3 \(probe\):\ninput.mp4: Invalid data"):
+        ffmpeg_jobs.run(["fail"], description="probe")
+
+def test_failure_cancels_other_jobs(fake_ffmpeg):
+    jobs = [ffmpeg_jobs.FFmpegJob([mode], description=mode)
+            for mode in ["fail", "sleep", "sleep"]]
+
+    start = time.time()
+    with pytest.raises(ffmpeg_jobs.FFmpegError, match="status 3"):
+        ffmpeg_jobs.run_all(jobs, max_jobs=2)
+
+    assert time.time() - start < 10
+    #the running job is stopped, and the queued one is either stopped
+    #too or never started
+    assert jobs[1].returncode == -15
+    assert jobs[2].returncode in (-15, None)
+
+@pytest.mark.skipif(not hasattr(os, "wait4"),
+                    reason="CPU time isn't available on this platform")
+def test_cpu_time_recorded(fake_ffmpeg):
+    job = ffmpeg_jobs.run(["burn"])
+
+    assert job.cpu_time >= 0.25
+    assert job.wall_time >= job.cpu_time * 0.9
+    assert "burn" in ffmpeg_jobs.summary([job])
+
+def test_history_keeps_newest_jobs(monkeypatch):
+    #true exits straight away, which is all these jobs need to do
+    monkeypatch.setattr(config, "ffmpeg_path", shutil.which("true"),
+                        raising=False)
+    jobs = [ffmpeg_jobs.FFmpegJob([], description=str(i))
+            for i in range(ffmpeg_jobs.HISTORY_SIZE + 10)]
+
+    for job in jobs:
+        job.run()
+
+    assert len(ffmpeg_jobs.history) == ffmpeg_jobs.HISTORY_SIZE
+    assert list(ffmpeg_jobs.history) == jobs[10:]
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+import requests
+
+from cr_download import hls_download
+
+def test_segments_written_in_playlist_order(hls_server, tmp_path):
+    output = str(tmp_path / "vod.ts")
+
+    stats = hls_download.download(hls_server.url + "/master.m3u8", output,
+                                  workers=4)
+
+    with open(output, "rb") as output_file:
+        assert output_file.read() == hls_server.expected("chunked")
+    assert stats.bytes == len(hls_server.expected("chunked"))
+
+def test_named_variant_is_used(hls_server, tmp_path):
+    output = str(tmp_path / "vod.ts")
+
+    hls_download.download(hls_server.url + "/master.m3u8", output,
+                          workers=4, variant="audio_only")
+
+    with open(output, "rb") as output_file:
+        assert output_file.read() == hls_server.expected("audio_only")
+    assert set(rendition for rendition, _ in hls_server.requests) == {
+        "audio_only"}
+
+def test_interrupted_download_resumes(hls_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(hls_download, "SEGMENT_RETRIES", 1)
+    output = str(tmp_path / "vod.ts")
+    hls_server.failing.add(("chunked", 12))
+
+    with pytest.raises(requests.HTTPError):
+        hls_download.download(hls_server.url + "/master.m3u8", output,
+                              workers=4, source="vod chunked")
+    assert os.path.exists(output + ".journal")
+
+    hls_server.failing.clear()
+    del hls_server.requests[:]
+    hls_download.download(hls_server.url + "/master.m3u8", output,
+                          workers=4, source="vod chunked")
+
+    #the segments written before the failure aren't fetched again,
+    #even though their urls have a new token
+    assert sorted(index for _, index in hls_server.requests) == list(
+        range(12, 20))
+    with open(output, "rb") as output_file:
+        assert output_file.read() == hls_server.expected("chunked")
+    assert not os.path.exists(output + ".journal")
+
+def test_parse_playlist_segment_times():
+    text = "#EXTM3U\n#EXTINF:4.0,\na.ts\n#EXTINF:6.0,\nb.ts\n#EXT-X-ENDLIST\n"
+
+    variants, segments = hls_download.parse_playlist(
+        text, "http://example.com/vod/index.m3u8")
+
+    assert variants == []
+    assert [(seg.url, seg.start) for seg in segments] == [
+        ("http://example.com/vod/a.ts", 0.0),
+        ("http://example.com/vod/b.ts", 4.0)]
@@ -0,0 +1,115 @@
+import os
+
+import pytest
+import requests
+
+from cr_download import http_download
+
+def _read(filename):
+    with open(filename, "rb") as input_file:
+        return input_file.read()
+
+def test_dropped_connection_resumes_with_range(range_server, tmp_path):
+    output = str(tmp_path / "file.mp4")
+    range_server.drops = 1
+    range_server.drop_after = 1024 * 1024
+
+    http_download.download(range_server.url, output, connections=1)
+
+    assert _read(output) == range_server.data
+    assert range_server.requests[0] is None
+    resumed_from = int(range_server.requests[1].split("=")[1].split("-")[0])
+    assert 0 < resumed_from <= 1024 * 1024
+    assert not os.path.exists(output + ".journal")
+
+def test_failed_download_resumes_in_later_run(range_server, tmp_path):
+    output = str(tmp_path / "file.mp4")
+    range_server.drops = 1
+    range_server.drop_after = 1024 * 1024
+    range_server.errors_after_drop = 1
+
+    with pytest.raises(requests.HTTPError):
+        http_download.download(range_server.url, output, connections=1)
+    assert os.path.exists(output + ".journal")
+
+    del range_server.requests[:]
+    http_download.download(range_server.url, output, connections=1)
+
+    assert _read(output) == range_server.data
+    resumed_from = int(range_server.requests[0].split("=")[1].split("-")[0])
+    assert 0 < resumed_from <= 1024 * 1024
+
+def test_server_ignoring_ranges_restarts(range_server, tmp_path):
+    output = str(tmp_path / "file.mp4")
+    range_server.ranges = False
+    range_server.drops = 1
+    range_server.drop_after = 1024 * 1024
+
+    http_download.download(range_server.url, output, connections=1)
+
+    assert _read(output) == range_server.data
+
+def test_parallel_parts_assembled_in_place(range_server, tmp_path,
+                                           monkeypatch):
+    monkeypatch.setattr(http_download, "PART_SIZE", 256 * 1024)
+    output = str(tmp_path / "file.mp4")
+    range_server.delay = 0.01
+
+    stats = http_download.download(range_server.url, output, connections=4)
+
+    assert _read(output) == range_server.data
+    assert stats.bytes == len(range_server.data)
+    #a probe, then one request per part
+    assert range_server.requests[0] == "bytes=0-0"
+    assert sorted(range_server.requests[1:]) == sorted(
+        "bytes={}-{}".format(start, start + 256 * 1024 - 1)
+        for start in range(0, len(range_server.data), 256 * 1024))
+
+def test_parallel_part_resumes_after_drop(range_server, tmp_path,
+                                          monkeypatch):
+    monkeypatch.setattr(http_download, "PART_SIZE", 1024 * 1024)
+    monkeypatch.setattr(http_download, "CHUNK_SIZE", 16 * 1024)
+    output = str(tmp_path / "file.mp4")
+    range_server.drops = 2
+    range_server.drop_after = 100 * 1024
+
+    http_download.download(range_server.url, output, connections=3)
+
+    assert _read(output) == range_server.data
+    #each dropped part is requested again from where it stopped
+    assert len(range_server.requests) == 1 + 3 + 2
+    starts = [int(request.split("=")[1].split("-")[0])
+              for request in range_server.requests[1:]]
+    assert len([start for start in starts if start % (1024 * 1024)]) == 2
+
+@pytest.mark.usefixtures("no_backoff")
+def test_parallel_part_retries_server_errors(range_server, tmp_path,
+                                             monkeypatch):
+    monkeypatch.setattr(http_download, "PART_SIZE", 1024 * 1024)
+    monkeypatch.setattr(http_download, "CHUNK_SIZE", 16 * 1024)
+    output = str(tmp_path / "file.mp4")
+    range_server.drops = 1
+    range_server.drop_after = 100 * 1024
+    range_server.errors_after_drop = 2
+
+    http_download.download(range_server.url, output, connections=3)
+
+    assert _read(output) == range_server.data
+    #the dropped part is retried through the errors, from where it stopped
+    starts = [int(request.split("=")[1].split("-")[0])
+              for request in range_server.requests[1:]]
+    assert len([start for start in starts if start % (1024 * 1024)]) >= 1
+
+@pytest.mark.usefixtures("no_backoff")
+def test_parallel_part_gives_up_after_retries(range_server, tmp_path,
+                                              monkeypatch):
+    monkeypatch.setattr(http_download, "PART_SIZE", 1024 * 1024)
+    output = str(tmp_path / "file.mp4")
+    range_server.drops = 1
+    range_server.drop_after = 100 * 1024
+    range_server.errors_after_drop = 100
+
+    with pytest.raises(http_download.DownloadException):
+        http_download.download(range_server.url, output, connections=3)
+
+    assert os.path.exists(output + ".journal")
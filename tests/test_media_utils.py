@@ -0,0 +1,170 @@
+import shutil
+import subprocess
+import sys
+import wave
+
+import pytest
+
+from cr_download.configuration import data as config
+from cr_download import media_utils
+
+needs_ffmpeg = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None,
+    reason="ffmpeg is not installed")
+
+def _make_media(filename, seconds, codec_args):
+    subprocess.check_call(
+        ["ffmpeg", "-v", "error", "-y", "-f", "lavfi",
+         "-i", "sine=frequency=440:sample_rate=44100:duration={}".format(
+             seconds)] + codec_args + [filename])
+
+def _pcm(filenames):
+    data = b""
+    for filename in filenames:
+        with wave.open(filename, "rb") as wav_file:
+            data += wav_file.readframes(wav_file.getnframes())
+    return data
+
+#AAC's noise substitution decodes differently depending on where
+#decoding started, so it's turned off for the comparison
+@needs_ffmpeg
+@pytest.mark.parametrize("input_name,codec_args", [
+    ("input.wav", ["-c:a", "pcm_s16le"]),
+    ("input.mp4", ["-c:a", "aac", "-aac_pns", "0"])
+])
+def test_parallel_segments_match_serial(tmp_path, monkeypatch, input_name,
+                                        codec_args):
+    monkeypatch.setattr(media_utils, "AUDIO_SEGMENT_LENGTH", 2)
+    monkeypatch.setattr(media_utils, "SEEK_PREROLL", 1)
+    monkeypatch.setattr(config, "ffmpeg_path", "ffmpeg", raising=False)
+    monkeypatch.setattr(config, "ffprobe_path", "ffprobe", raising=False)
+    video_file = str(tmp_path / input_name)
+    _make_media(video_file, 7, codec_args)
+    (tmp_path / "serial").mkdir()
+    (tmp_path / "parallel").mkdir()
+
+    serial = media_utils.mp4_to_audio_segments(
+        video_file, str(tmp_path / "serial"), ".wav", parallel=False)
+    parallel = media_utils.mp4_to_audio_segments(
+        video_file, str(tmp_path / "parallel"), ".wav", parallel=True)
+
+    assert len(parallel) == len(serial) == 4
+    assert _pcm(parallel) == _pcm(serial)
+
+#stands in for ffmpeg when encoding: copies stdin to the output file,
+#or fails straight away if the output file is named fail.*
+FAKE_ENCODER = """#!{python}
+import os
+import sys
+
+output = sys.argv[-1]
+if os.path.basename(output).startswith("fail."):
+    sys.stderr.write("Unknown encoder for {{}}\\n".format(output))
+    sys.exit(1)
+with open(output, "wb") as output_file:
+    output_file.write(sys.stdin.buffer.read())
+with open(output + ".args", "w") as args_file:
+    args_file.write(" ".join(sys.argv[1:]))
+"""
+
+@pytest.fixture
+def fake_encoder(tmp_path, monkeypatch):
+    script = tmp_path / "ffmpeg"
+    script.write_text(FAKE_ENCODER.format(python=sys.executable))
+    script.chmod(0o755)
+    monkeypatch.setattr(config, "ffmpeg_path", str(script), raising=False)
+    monkeypatch.setattr(config, "ffmpeg_progress_interval", 0, raising=False)
+
+WAV_PARAMS = (2, 2, 44100, 0, "NONE", "not compressed")
+
+def test_encoder_gets_frames(fake_encoder, tmp_path):
+    output = str(tmp_path / "episode.m4a")
+
+    with media_utils.open_encoder(output) as encoder:
+        encoder.setparams(WAV_PARAMS)
+        encoder.writeframes(b"abcd" * 100)
+        encoder.writeframes(b"efgh")
+
+    with open(output, "rb") as output_file:
+        assert output_file.read() == b"abcd" * 100 + b"efgh"
+    with open(output + ".args") as args_file:
+        assert "-f s16le -ar 44100 -ac 2 -i pipe:0" in args_file.read()
+
+def test_encoder_failure_raises(fake_encoder, tmp_path):
+    output = str(tmp_path / "fail.m4a")
+
+    with pytest.raises(media_utils.MediaException,
+                       match="Unknown encoder for"):
+        with media_utils.open_encoder(output) as encoder:
+            encoder.setparams(WAV_PARAMS)
+            for _ in range(100):
+                encoder.writeframes(b"\0" * 65536)
+
+def test_encoder_failure_doesnt_hide_error(fake_encoder, tmp_path):
+    output = str(tmp_path / "fail.m4a")
+
+    with pytest.raises(KeyError):
+        with media_utils.open_encoder(output) as encoder:
+            encoder.setparams(WAV_PARAMS)
+            raise KeyError("cut failed")
+
+def test_unsupported_sample_width(tmp_path):
+    encoder = media_utils.open_encoder(str(tmp_path / "episode.m4a"))
+
+    with pytest.raises(media_utils.MediaException):
+        encoder.setparams((2, 5, 44100, 0, "NONE", "not compressed"))
+
+@pytest.fixture
+def ffmpeg_runs(monkeypatch):
+    """record the arguments of every ffmpeg job run, instead of running
+    them
+
+    """
+    runs = []
+    monkeypatch.setattr(media_utils.ffmpeg_jobs, "run",
+                        lambda args, description=None, on_progress=None:
+                        runs.append(args))
+    return runs
+
+def _probe_codec(monkeypatch, codec_name):
+    streams = [{"codec_type": "video", "codec_name": "h264"}]
+    if codec_name is not None:
+        streams.append({"codec_type": "audio", "codec_name": codec_name})
+    monkeypatch.setattr(media_utils, "probe",
+                        lambda filename: {"format": {}, "streams": streams})
+
+@pytest.mark.parametrize("codec,output,allow_rename,expected,copy", [
+    ("aac", "episode.m4a", False, "episode.m4a", True),
+    ("aac", "episode.mp3", False, "episode.mp3", False),
+    ("aac", "episode.mp3", True, "episode.m4a", True),
+    ("opus", "episode.m4a", True, "episode.opus", True),
+    ("opus", "episode.webm", True, "episode.webm", True),
+    ("pcm_s16le", "episode.m4a", True, "episode.m4a", False)
+])
+def test_extract_audio_copies_when_possible(monkeypatch, ffmpeg_runs, codec,
+                                            output, allow_rename, expected,
+                                            copy):
+    _probe_codec(monkeypatch, codec)
+
+    result = media_utils.extract_audio(["video.mp4"], output,
+                                       allow_rename=allow_rename)
+
+    assert result == expected
+    args = ffmpeg_runs[0]
+    assert args[-1] == expected
+    assert (args[-3:-1] == ["-c:a", "copy"]) == copy
+    assert args[1:3] == ["-i", "video.mp4"]
+
+def test_extract_audio_concatenates_parts(monkeypatch, ffmpeg_runs):
+    _probe_codec(monkeypatch, "aac")
+
+    media_utils.extract_audio(["part1.mp4", "part2.mp4"], "episode.m4a")
+
+    assert ffmpeg_runs[0][1:5] == ["-f", "concat", "-safe", "0"]
+
+def test_extract_audio_needs_audio(monkeypatch, ffmpeg_runs):
+    _probe_codec(monkeypatch, None)
+
+    with pytest.raises(media_utils.MediaException, match="no audio stream"):
+        media_utils.extract_audio(["video.mp4"], "episode.m4a")
+    assert ffmpeg_runs == []
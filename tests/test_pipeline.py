@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+
+import pytest
+
+from cr_download.configuration import data as config
+from cr_download import download_registry
+from cr_download import pipeline
+from cr_download import upload_targets
+from cr_download_cli import cli
+from cr_download_cli import downloader
+
+class FakeStream:
+    source = "youtube"
+    stream = "audio"
+
+    running = 0
+    most_running = 0
+    lock = threading.Lock()
+
+    def __init__(self, url):
+        self.url = url
+
+    def download(self, filename, progress=None, rate_limiter=None,
+                 quality=None):
+        with FakeStream.lock:
+            FakeStream.running += 1
+            FakeStream.most_running = max(FakeStream.most_running,
+                                          FakeStream.running)
+        time.sleep(0.05)
+        with FakeStream.lock:
+            FakeStream.running -= 1
+        with open(filename + ".mp4", "wb") as video_file:
+            video_file.write(self.url.encode("utf-8"))
+        return filename + ".mp4"
+
+@pytest.fixture
+def no_audio(monkeypatch, tmp_path):
+    for option, value in [("autocut", False), ("upload", False),
+                          ("two_pass", False), ("max_parallel_downloads", 2)]:
+        monkeypatch.setattr(config, option, value, raising=False)
+    monkeypatch.setattr(download_registry, "_registry",
+                        download_registry.DownloadRegistry(
+                            str(tmp_path / "downloads.json")))
+    monkeypatch.setattr(cli, "extract_episode_audio",
+                        lambda video_files, title, on_output=None: video_files)
+
+def test_pipeline_downloads_share_parallel_limit(no_audio, tmp_path):
+    to_download = {
+        str(tmp_path / "episode{}".format(episode)):
+        [FakeStream("https://example.com/{}/{}".format(episode, part))
+         for part in range(2)]
+        for episode in range(3)}
+
+    results = downloader.process_episodes(to_download, str(tmp_path),
+                                          str(tmp_path))
+
+    assert FakeStream.most_running == 2
+    assert [len(files) for files in results.values()] == [2, 2, 2]
+
+def test_pipeline_stops_after_error():
+    processed = []
+
+    def _fail(item):
+        if item == 1:
+            raise ValueError("bad item")
+        return item
+
+    stages = [pipeline.Stage("first", _fail),
+              pipeline.Stage("second", processed.append)]
+    with pytest.raises(ValueError):
+        pipeline.Pipeline(stages).run(range(5))
+
+    assert 1 not in processed
+    assert stages[0].items == 5
+
+def test_failed_upload_doesnt_stop_episodes(no_audio, monkeypatch, tmp_path):
+    uploaded = []
+
+    class FlakyTarget(upload_targets.UploadTarget):
+        name = "flaky"
+
+        def upload(self, filename):
+            if "episode0" in filename:
+                raise upload_targets.UploadException("no space left")
+            uploaded.append(filename)
+            return filename
+
+    def _extract(video_files, title, on_output=None):
+        for video_file in video_files:
+            on_output(video_file)
+        return video_files
+
+    monkeypatch.setitem(upload_targets.TARGETS, "flaky", FlakyTarget)
+    monkeypatch.setattr(config, "upload", True, raising=False)
+    monkeypatch.setattr(config, "upload_target", "flaky", raising=False)
+    monkeypatch.setattr(config, "upload_workers", 1, raising=False)
+    monkeypatch.setattr(cli, "extract_episode_audio", _extract)
+    to_download = {str(tmp_path / "episode{}".format(episode)):
+                   [FakeStream("https://example.com/{}".format(episode))]
+                   for episode in range(3)}
+
+    results = downloader.process_episodes(to_download, str(tmp_path),
+                                          str(tmp_path))
+
+    assert [len(files) for files in results.values()] == [1, 1, 1]
+    assert sorted(os.path.basename(name)[:len("episode0")]
+                  for name in uploaded) == ["episode1", "episode2"]
+
+def test_upload_target_must_upload():
+    class Incomplete(upload_targets.UploadTarget):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
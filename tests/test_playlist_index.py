@@ -0,0 +1,138 @@
+import hashlib
+
+import pytest
+
+from cr_download.configuration import data as config
+from cr_download import playlist_index
+from cr_download import youtube
+
+from fake_servers import QuietHandler
+
+PAGE_SIZE = youtube.MAX_RESULTS_PER_PAGE
+
+@pytest.fixture
+def fake_youtube(serve, monkeypatch):
+    """a fake YouTube API serving one playlist, whose ETags change with
+    a page's items or the playlist's total size
+
+    """
+    class YoutubeHandler(QuietHandler):
+        ids = ["id{}".format(number) for number in range(120)]
+        requests = []
+
+        def do_GET(self):
+            start = int(self.query.get("pageToken", 0))
+            page_ids = self.ids[start:start + PAGE_SIZE]
+            etag = hashlib.sha1("{} {}".format(
+                page_ids, len(self.ids)).encode("utf-8")).hexdigest()
+
+            if self.headers.get("If-None-Match") == etag:
+                self.requests.append((start, 304))
+                self.send_body(304)
+                return
+
+            self.requests.append((start, 200))
+            data = {"items": [{"contentDetails": {"videoId": video_id}}
+                              for video_id in page_ids],
+                    "pageInfo": {"totalResults": len(self.ids)}}
+            if start + PAGE_SIZE < len(self.ids):
+                data["nextPageToken"] = str(start + PAGE_SIZE)
+            self.send_json(data, headers={"ETag": etag})
+
+    monkeypatch.setattr(config, "youtube_api_url", serve(YoutubeHandler))
+    monkeypatch.setattr(config, "youtube_api_key", "key")
+    return YoutubeHandler
+
+@pytest.fixture
+def index(tmp_path):
+    return playlist_index.PlaylistIndex(youtube._fetch_playlist_page,
+                                        str(tmp_path / "index.json"))
+
+def test_first_sync_fetches_every_page(fake_youtube, index):
+    assert index.video_ids("playlist") == fake_youtube.ids
+    assert fake_youtube.requests == [(0, 200), (50, 200), (100, 200)]
+
+def test_unchanged_playlist_takes_one_request(fake_youtube, index):
+    index.video_ids("playlist")
+    fake_youtube.requests.clear()
+
+    assert index.video_ids("playlist") == fake_youtube.ids
+    assert fake_youtube.requests == [(0, 304)]
+
+def test_appended_items_only_fetch_last_page(fake_youtube, index):
+    index.video_ids("playlist")
+    fake_youtube.ids += ["new{}".format(number) for number in range(10)]
+    fake_youtube.requests.clear()
+
+    assert index.video_ids("playlist") == fake_youtube.ids
+    assert fake_youtube.requests == [(0, 200), (100, 200)]
+
+    #the first page's new ETag was kept
+    fake_youtube.requests.clear()
+    assert index.video_ids("playlist") == fake_youtube.ids
+    assert fake_youtube.requests == [(0, 304)]
+
+def test_prepended_items_reuse_index(fake_youtube, index):
+    index.video_ids("playlist")
+    fake_youtube.ids[:0] = ["new0", "new1", "new2"]
+    fake_youtube.requests.clear()
+
+    assert index.video_ids("playlist") == fake_youtube.ids
+    assert fake_youtube.requests == [(0, 200)]
+
+def test_sync_persists_between_runs(fake_youtube, tmp_path):
+    path = str(tmp_path / "index.json")
+    playlist_index.PlaylistIndex(youtube._fetch_playlist_page,
+                                 path).video_ids("playlist")
+    fake_youtube.requests.clear()
+
+    ids = playlist_index.PlaylistIndex(youtube._fetch_playlist_page,
+                                       path).video_ids("playlist")
+
+    assert ids == fake_youtube.ids
+    assert fake_youtube.requests == [(0, 304)]
+
+def test_empty_last_page(tmp_path):
+    pages = {None: playlist_index.Page("etag1", ["a", "b"], "t2"),
+             "t2": playlist_index.Page("etag2", [], None)}
+
+    def _fetch_page(playlist_id, token, etag):
+        page = pages[token]
+        return None if etag == page.etag else page
+
+    index = playlist_index.PlaylistIndex(_fetch_page,
+                                         str(tmp_path / "index.json"))
+    assert index.video_ids("playlist") == ["a", "b"]
+
+    pages[None] = playlist_index.Page("etag3", ["a", "b"], "t2")
+    pages["t2"] = playlist_index.Page("etag4", ["c"], None)
+
+    assert index.video_ids("playlist") == ["a", "b", "c"]
+
+#with 100 items, the prepended ones push some onto a page which wasn't
+#indexed, so the last indexed page is fetched again along with it
+@pytest.mark.parametrize("total,refetched", [(120, [100]), (100, [50, 100])])
+def test_syncs_after_prepend_stay_incremental(fake_youtube, index, total,
+                                              refetched):
+    del fake_youtube.ids[total:]
+    index.video_ids("playlist")
+    fake_youtube.ids[:0] = ["new0", "new1", "new2"]
+    index.video_ids("playlist")
+
+    #unchanged since the prepend
+    fake_youtube.requests.clear()
+    assert index.video_ids("playlist") == fake_youtube.ids
+    assert fake_youtube.requests == [(0, 304)]
+
+    #appended since the prepend: only the end is fetched again
+    fake_youtube.ids += ["more0", "more1"]
+    fake_youtube.requests.clear()
+    assert index.video_ids("playlist") == fake_youtube.ids
+    assert fake_youtube.requests == [(0, 200)] + [
+        (start, 200) for start in refetched]
+
+    #prepended again
+    fake_youtube.ids[:0] = ["newer"]
+    fake_youtube.requests.clear()
+    assert index.video_ids("playlist") == fake_youtube.ids
+    assert fake_youtube.requests == [(0, 200)]
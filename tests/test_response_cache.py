@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from cr_download.configuration import data as config
+from cr_download import api_client
+from cr_download import response_cache
+
+@pytest.fixture
+def cache(tmp_path):
+    return response_cache.ResponseCache(str(tmp_path / "responses.json"))
+
+@pytest.fixture
+def client(cache, monkeypatch):
+    monkeypatch.setattr(config, "api_cache_ttl", {"things": 60},
+                        raising=False)
+    return api_client.APIClient(timeout=5, max_retries=0, cache=cache)
+
+def _age(cache, seconds):
+    for entry in cache.entries.values():
+        entry["time"] -= seconds
+
+def test_lookup_expires_after_ttl(cache):
+    key = response_cache.cache_key("https://example.com", {"id": 1})
+    assert cache.lookup(key, 60) == (None, False)
+
+    cache.store(key, "things", {"a": 1}, etag="v1")
+    entry, fresh = cache.lookup(key, 60)
+    assert fresh and entry["data"] == {"a": 1}
+
+    _age(cache, 61)
+    entry, fresh = cache.lookup(key, 60)
+    assert not fresh and entry["etag"] == "v1"
+
+def test_cache_persists(cache, tmp_path):
+    key = response_cache.cache_key("https://example.com")
+    cache.store(key, "things", [1, 2])
+
+    reloaded = response_cache.ResponseCache(str(tmp_path / "responses.json"))
+
+    assert reloaded.lookup(key, 60)[0]["data"] == [1, 2]
+
+def test_fresh_response_not_requested(api_server, client):
+    assert client.get(api_server.url, endpoint="things") == {"items": [1, 2, 3]}
+    assert client.get(api_server.url, endpoint="things") == {"items": [1, 2, 3]}
+
+    assert len(api_server.requests) == 1
+    assert client.cache.hits == 1
+
+def test_uncached_endpoint_always_requested(api_server, client):
+    client.get(api_server.url, endpoint="others")
+    client.get(api_server.url)
+
+    assert len(api_server.requests) == 2
+    assert client.cache.entries == {}
+
+def test_stale_response_revalidated(api_server, client):
+    api_server.etag = "\"v1\""
+    client.get(api_server.url, endpoint="things")
+    _age(client.cache, 61)
+    api_server.data = {"items": "changed but not seen"}
+
+    assert client.get(api_server.url, endpoint="things") == {"items": [1, 2, 3]}
+
+    assert api_server.requests[1] == ("/api", "\"v1\"")
+    assert client.cache.revalidated == 1
+    #the revalidated response is fresh again
+    assert client.get(api_server.url, endpoint="things") == {"items": [1, 2, 3]}
+    assert len(api_server.requests) == 2
+
+def test_changed_response_replaces_cache(api_server, client):
+    api_server.etag = "\"v1\""
+    client.get(api_server.url, endpoint="things")
+    _age(client.cache, 61)
+    api_server.etag = "\"v2\""
+    api_server.data = {"items": [4]}
+
+    assert client.get(api_server.url, endpoint="things") == {"items": [4]}
+
+    entry, fresh = client.cache.lookup(
+        response_cache.cache_key(api_server.url), 60)
+    assert fresh and entry["etag"] == "\"v2\""
+
+@pytest.mark.parametrize("contents", [
+    "{not json",
+    "[1, 2, 3]",
+    json.dumps({"key": "not an entry", "other": {"time": 0}})
+])
+def test_corrupt_cache_ignored(tmp_path, contents):
+    path = tmp_path / "responses.json"
+    path.write_text(contents)
+
+    cache = response_cache.ResponseCache(str(path))
+
+    assert cache.entries == {}
+    assert cache.lookup("key", 60) == (None, False)
+    cache.store("key", "things", {})
+    assert json.loads(path.read_text())["key"]["data"] == {}
@@ -0,0 +1,30 @@
+from cr_download import hls_download
+from cr_download import selective_download
+from cr_download.transfer import make_session
+
+def test_clip_only_fetches_overlapping_segments(hls_server, tmp_path):
+    session = make_session()
+    segments = hls_download.get_segments(hls_server.url + "/master.m3u8",
+                                         session, variant="audio_only")
+    clip_file = str(tmp_path / "clip.ts")
+
+    args = selective_download._fetch_hls_clip(segments, 35.0, 62.0,
+                                              clip_file, session, None)
+
+    assert sorted(hls_server.requests) == [("audio_only", index)
+                                           for index in range(3, 7)]
+    with open(clip_file, "rb") as clip:
+        assert clip.read() == hls_server.expected("audio_only", range(3, 7))
+    #the interval is trimmed relative to the start of the first segment
+    assert args == ["-ss", "5.000", "-t", "27.000", "-i", clip_file]
+
+def test_overlapping_segments_to_end_of_stream():
+    segments = [hls_download.Segment(0, "init.mp4", 0.0, 0.0)] + [
+        hls_download.Segment(index, "{}.ts".format(index), 10.0,
+                             10.0 * (index - 1))
+        for index in range(1, 6)]
+
+    overlapping = selective_download.overlapping_segments(segments, 25.0, None)
+
+    assert [seg.url for seg in overlapping] == ["init.mp4", "3.ts", "4.ts",
+                                                "5.ts"]
@@ -0,0 +1,70 @@
+import pytest
+
+from cr_download.configuration import data as config
+from cr_download import sources
+from cr_download import stream_data
+
+class FakeStream(stream_data.StreamData):
+    source = "fake"
+
+    def load_data(self, data):
+        self.json_data = data
+        self.title = data["title"]
+        self.creation_date = data["date"]
+
+    @classmethod
+    def recent_streams(cls, limit=10):
+        return [cls({"title": "Episode 2", "date": "2018-01-08"}),
+                cls({"title": "Episode 1", "date": "2018-01-01"})][:limit]
+
+class MirrorStream(FakeStream):
+    source = "mirror"
+
+    @classmethod
+    def recent_streams(cls, limit=10):
+        return [cls({"title": "episode 2!", "date": "2018-01-08T10:00"}),
+                cls({"title": "Episode 3", "date": "2018-01-15"})]
+
+class BrokenStream(FakeStream):
+    source = "broken"
+
+    @classmethod
+    def recent_streams(cls, limit=10):
+        raise IOError("no network")
+
+@pytest.fixture(autouse=True)
+def fake_sources(monkeypatch):
+    for cls in [FakeStream, MirrorStream, BrokenStream]:
+        monkeypatch.setitem(stream_data.SOURCES, cls.source, cls)
+    monkeypatch.setattr(config, "source_timeout", 5, raising=False)
+
+def test_streams_merged_without_duplicates():
+    streams = sources.find_streams(["fake", "mirror"])
+
+    assert [(stream.source, stream["title"]) for stream in streams] == [
+        ("fake", "Episode 2"), ("fake", "Episode 1"), ("mirror", "Episode 3")]
+
+def test_failing_source_skipped():
+    streams = sources.find_streams(["broken", "fake"], limit=1)
+
+    assert [stream["title"] for stream in streams] == ["Episode 2"]
+
+def test_every_source_failing_raises():
+    with pytest.raises(sources.SourceException):
+        sources.find_streams(["broken"])
+
+def test_source_must_list_streams():
+    class Incomplete(stream_data.StreamData):
+        source = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete({})
+
+def test_parts_from_one_source_kept():
+    parts = [FakeStream({"title": "Episode 4", "date": "2018-01-22"})
+             for _ in range(2)]
+    mirrored = MirrorStream({"title": "Episode 4", "date": "2018-01-22"})
+
+    merged = sources.merge_streams([parts, [mirrored]])
+
+    assert merged == parts
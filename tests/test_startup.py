@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+PACKAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "packages")
+
+#modules which are slow to load, and only needed once work has started
+SLOW_MODULES = ["requests", "youtube_dl", "streamlink", "ruamel.yaml"]
+
+_IMPORT_SCRIPT = """
+import sys
+import cr_download_cli.cli
+print(",".join(name for name in {!r} if name in sys.modules))
+""".format(SLOW_MODULES)
+
+def _modules_loaded(data_dir):
+    env = dict(os.environ, PYTHONPATH=PACKAGES_DIR,
+               XDG_DATA_HOME=str(data_dir))
+    output = subprocess.run([sys.executable, "-c", _IMPORT_SCRIPT], env=env,
+                            check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout.strip()
+    return [name for name in output.split(",") if name]
+
+def test_cli_doesnt_load_slow_modules(data_dir):
+    #the first run parses the config files, and caches them for the rest
+    _modules_loaded(data_dir)
+
+    assert _modules_loaded(data_dir) == []
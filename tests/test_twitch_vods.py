@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from cr_download.configuration import data as config
+from cr_download import appdata
+from cr_download import twitch_download
+
+from fake_servers import QuietHandler
+
+CHANNEL_ID = "1234"
+
+def _vod(number):
+    return {"_id": "v{}".format(number), "title": "VOD {}".format(number),
+            "recorded_at": "2018-01-01T00:00:00Z", "length": 3600,
+            "url": "https://www.twitch.tv/videos/{}".format(number)}
+
+@pytest.fixture
+def fake_twitch(serve, monkeypatch):
+    """a fake Twitch API for a channel with 250 VODs (most recent first)
+    """
+    class TwitchHandler(QuietHandler):
+        vods = [_vod(number) for number in range(250, 0, -1)]
+        offsets = []
+
+        def do_GET(self):
+            if self.route.endswith("/users"):
+                self.send_json({"users": [{"_id": CHANNEL_ID}]})
+                return
+            offset = int(self.query["offset"])
+            limit = int(self.query["limit"])
+            self.offsets.append(offset)
+            self.send_json({"_total": len(self.vods),
+                            "videos": self.vods[offset:offset + limit]})
+
+    monkeypatch.setattr(config, "twitch_api_url", serve(TwitchHandler) + "/")
+    monkeypatch.setattr(twitch_download, "_channel_ids", {})
+    return TwitchHandler
+
+def _ids(streams):
+    return [stream.json_data["_id"] for stream in streams]
+
+def _cache():
+    with appdata.open_cache_file(
+            twitch_download._vod_cache_file(CHANNEL_ID), "r") as cache_file:
+        return json.load(cache_file)
+
+def test_limited_listing_only_fetches_first_page(fake_twitch):
+    streams = twitch_download.get_vod_list(limit=10)
+
+    assert _ids(streams) == ["v{}".format(n) for n in range(250, 240, -1)]
+    assert fake_twitch.offsets == [0]
+    assert not _cache()["complete"]
+
+def test_later_full_listing_pages_past_cached_depth(fake_twitch):
+    twitch_download.get_vod_list(limit=10)
+    fake_twitch.offsets.clear()
+
+    streams = twitch_download.get_vod_list(limit=-1)
+
+    assert _ids(streams) == [vod["_id"] for vod in fake_twitch.vods]
+    assert sorted(fake_twitch.offsets) == [0, 100, 200]
+    assert _cache()["complete"]
+
+def test_complete_cache_only_fetches_new_vods(fake_twitch):
+    twitch_download.get_vod_list(limit=-1)
+    fake_twitch.vods[:0] = [_vod(252), _vod(251)]
+    fake_twitch.offsets.clear()
+
+    streams = twitch_download.get_vod_list(limit=-1)
+
+    assert _ids(streams) == [vod["_id"] for vod in fake_twitch.vods]
+    assert fake_twitch.offsets == [0]
+
+def test_larger_limit_extends_cache(fake_twitch):
+    twitch_download.get_vod_list(limit=10)
+    fake_twitch.vods[:0] = [_vod(251)]
+    fake_twitch.offsets.clear()
+
+    streams = twitch_download.get_vod_list(limit=150)
+
+    assert _ids(streams) == [vod["_id"] for vod in fake_twitch.vods[:150]]
+    assert fake_twitch.offsets == [0, 101]
+    assert len(_cache()["vods"]) == 201
+    assert not _cache()["complete"]
+
+def test_old_cache_format_is_refetched(fake_twitch):
+    with appdata.open_cache_file(twitch_download._vod_cache_file(CHANNEL_ID),
+                                 "w") as cache_file:
+        json.dump(fake_twitch.vods[:100], cache_file)
+
+    streams = twitch_download.get_vod_list(limit=-1)
+
+    assert len(streams) == 250
+    assert _cache()["complete"]
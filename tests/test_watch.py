@@ -0,0 +1,68 @@
+import pytest
+
+from cr_download.configuration import data as config
+from cr_download import job_queue
+from cr_download import sources
+from cr_download import twitch_download
+from cr_download import stream_data
+from cr_download import youtube
+from cr_download_cli import downloader
+from cr_download_cli import watch
+
+def _stream(number):
+    return youtube.YoutubeStreamData({
+        "id": "video{}".format(number),
+        "snippet": {
+            "title": "The Episode | Critical Role Episode {}".format(number),
+            "publishedAt": "2018-01-01T00:00:00Z",
+            "description": ""},
+        "contentDetails": {"duration": "PT4H"}})
+
+@pytest.fixture
+def daemon(monkeypatch, tmp_path):
+    for option, value in [("limit", 10), ("autocut", False),
+                          ("autocut_merge", False),
+                          ("regex", downloader.STRICT_CR_REGEX),
+                          ("watch_workers", 1)]:
+        monkeypatch.setattr(config, option, value, raising=False)
+    queue = job_queue.JobQueue(str(tmp_path / "jobs.db"))
+    yield watch.WatchDaemon(queue, None, None)
+    queue.close()
+
+def test_backlog_skipped_after_failed_first_poll(daemon, monkeypatch):
+    polls = []
+
+    def _find_streams(limit):
+        polls.append(limit)
+        if len(polls) == 1:
+            raise sources.SourceException("network down")
+        if len(polls) == 2:
+            return [_stream(1), _stream(2)]
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(sources, "find_streams", _find_streams)
+
+    with pytest.raises(KeyboardInterrupt):
+        daemon.run(0, skip_first=True)
+
+    assert len(polls) == 3
+    assert daemon.queue.counts() == {job_queue.SKIPPED: 2}
+
+def test_new_streams_queued_after_first_poll(daemon, monkeypatch):
+    found = [[_stream(1)], [_stream(1), _stream(2)]]
+    monkeypatch.setattr(sources, "find_streams",
+                        lambda limit: found.pop(0))
+
+    assert daemon.poll(skip=True) == 0
+    assert daemon.poll() == 1
+    assert [job.key for job in daemon.queue.jobs(job_queue.QUEUED)] == [
+        youtube.YOUTUBE_VIDEO_URL + "video2"]
+
+def test_missing_twitch_token_raises(monkeypatch):
+    monkeypatch.setattr(config, "twitch_token",
+                        twitch_download.UNCONFIGURED_TOKEN)
+    monkeypatch.setattr(config, "source", "twitch")
+
+    #StreamException is just Exception, so check it's the token error
+    with pytest.raises(stream_data.StreamException, match="not yet authorized"):
+        twitch_download.TwitchStreamData.recent_streams()
@@ -0,0 +1,158 @@
+import struct
+import wave
+
+import pytest
+
+from cr_download.autocut import wav_sequence
+
+def _pcm(nframes, offset=0, nchannels=2, sampwidth=2):
+    framesize = nchannels * sampwidth
+    return bytes((offset + i) % 251 for i in range(nframes * framesize))
+
+def _write_wave(filename, data, nchannels=2, sampwidth=2, framerate=8000):
+    with wave.open(filename, "wb") as wav_file:
+        wav_file.setnchannels(nchannels)
+        wav_file.setsampwidth(sampwidth)
+        wav_file.setframerate(framerate)
+        wav_file.writeframes(data)
+    return filename
+
+def _fmt(format_tag=1, nchannels=2, sampwidth=2, framerate=8000):
+    framesize = nchannels * sampwidth
+    return struct.pack("<HHIIHH", format_tag, nchannels, framerate,
+                       framerate * framesize, framesize, sampwidth * 8)
+
+def _write_riff(filename, chunks):
+    """write a RIFF file from a list of (chunk id, data, declared size)
+    """
+    body = b"WAVE"
+    for chunk_id, data, size in chunks:
+        body += struct.pack("<4sI", chunk_id,
+                            len(data) if size is None else size) + data
+        if len(data) & 1:
+            body += b"\0"
+    with open(filename, "wb") as riff_file:
+        riff_file.write(struct.pack("<4sI", b"RIFF", len(body)) + body)
+    return filename
+
+@pytest.fixture
+def sequence_files(tmp_path):
+    sizes = [1000, 1, 2500]
+    data = [_pcm(size, offset) for size, offset in zip(sizes, [0, 7, 13])]
+    filenames = [_write_wave(str(tmp_path / "part{}.wav".format(i)), part)
+                 for i, part in enumerate(data)]
+    return filenames, b"".join(data)
+
+def test_frames_match_wave_module(sequence_files):
+    filenames, data = sequence_files
+    with wav_sequence.open(filenames) as seq:
+        assert len(seq) == len(data) // 4
+        assert seq.getparams()[:4] == (2, 2, 8000, len(data) // 4)
+        assert seq.file_frame_counts() == [1000, 1, 2500]
+        assert seq.frames(0, len(seq)) == data
+
+def test_slices_cross_files(sequence_files):
+    filenames, data = sequence_files
+    with wav_sequence.open(filenames) as seq:
+        for start, end in [(0, 1000), (999, 1002), (1000, 1001),
+                           (500, 3000), (3400, 3600), (-10, None)]:
+            expected_start, expected_end, _ = slice(start, end).indices(
+                len(seq))
+            assert seq[start:end] == data[expected_start * 4:
+                                          expected_end * 4]
+        assert seq[1000] == data[4000:4004]
+        assert seq[-1] == data[-4:]
+        with pytest.raises(IndexError):
+            seq[len(seq)]
+
+def test_blocks_cover_sequence(sequence_files):
+    filenames, data = sequence_files
+    with wav_sequence.open(filenames) as seq:
+        assert b"".join(seq.blocks(block_size=333)) == data
+        assert b"".join(seq.blocks(998, 1003, block_size=2)) == \
+            data[998 * 4:1003 * 4]
+        assert b"".join(seq.file_blocks(2, block_size=999)) == data[1001 * 4:]
+
+def test_sequential_reads_cross_files(sequence_files):
+    filenames, data = sequence_files
+    with wav_sequence.open(filenames) as seq:
+        seq.seek(998)
+        assert seq.readframes(4) == data[998 * 4:1002 * 4]
+        seq.skip_frames(10)
+        assert seq.frame_index == 1012
+        seq.seek(len(seq) + 10)
+        assert seq.readframes(4) == b""
+        seq.seek(-5)
+        assert seq.readframes(2) == data[:8]
+
+def test_chunks_before_data_skipped(tmp_path):
+    data = _pcm(100)
+    filename = _write_riff(str(tmp_path / "list.wav"), [
+        (b"LIST", b"INFOISFT\x03\0\0\0ab\0", None),
+        (b"fmt ", _fmt(), None),
+        (b"junk", b"odd", None),
+        (b"data", data, None)])
+
+    with wav_sequence.open([filename]) as seq:
+        assert seq.frames(0, len(seq)) == data
+
+def test_odd_sized_data_padded(tmp_path):
+    data = _pcm(101, nchannels=1, sampwidth=1)
+    filename = _write_riff(str(tmp_path / "odd.wav"), [
+        (b"fmt ", _fmt(nchannels=1, sampwidth=1), None),
+        (b"data", data, None),
+        (b"LIST", b"trailer", None)])
+
+    with wav_sequence.open([filename]) as seq:
+        assert len(seq) == 101
+        assert seq.frames(0, len(seq)) == data
+
+@pytest.mark.parametrize("declared_size", [0, 0xFFFFFFFF])
+def test_unset_data_size_uses_file_size(tmp_path, declared_size):
+    data = _pcm(100)
+    filename = _write_riff(str(tmp_path / "stream.wav"), [
+        (b"fmt ", _fmt(), None),
+        (b"data", data, declared_size)])
+
+    with wav_sequence.open([filename]) as seq:
+        assert seq.frames(0, len(seq)) == data
+
+def test_extensible_pcm(tmp_path):
+    data = _pcm(50)
+    #cbSize, valid bits, channel mask, then the KSDATAFORMAT_SUBTYPE_PCM GUID
+    extension = struct.pack("<HHI", 22, 16, 3) + \
+        b"\x01\x00\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71"
+    filename = _write_riff(str(tmp_path / "ext.wav"), [
+        (b"fmt ", _fmt(format_tag=0xFFFE) + extension, None),
+        (b"data", data, None)])
+
+    with wav_sequence.open([filename]) as seq:
+        assert seq.getparams()[:3] == (2, 2, 8000)
+        assert seq.frames(0, len(seq)) == data
+
+def test_extensible_float_rejected(tmp_path):
+    extension = struct.pack("<HHI", 22, 32, 3) + \
+        b"\x03\x00\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71"
+    filename = _write_riff(str(tmp_path / "float.wav"), [
+        (b"fmt ", _fmt(format_tag=0xFFFE, sampwidth=4) + extension, None),
+        (b"data", _pcm(10, sampwidth=4), None)])
+
+    with pytest.raises(wav_sequence.WavException):
+        wav_sequence.open([filename])
+
+@pytest.mark.parametrize("contents", [b"", b"RIFF", b"RIFF\0\0\0\0WAVE",
+                                      b"RIFX\0\0\0\0WAVEdata\0\0\0\0"])
+def test_invalid_files_rejected(tmp_path, contents):
+    filename = tmp_path / "bad.wav"
+    filename.write_bytes(contents)
+
+    with pytest.raises(wav_sequence.WavException):
+        wav_sequence.open([str(filename)])
+
+def test_mismatched_files_rejected(tmp_path):
+    filenames = [_write_wave(str(tmp_path / "a.wav"), _pcm(10)),
+                 _write_wave(str(tmp_path / "b.wav"), _pcm(10),
+                             framerate=44100)]
+
+    with pytest.raises(wav_sequence.WavException):
+        wav_sequence.open(filenames)
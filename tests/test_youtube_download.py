@@ -0,0 +1,47 @@
+from cr_download import youtube
+
+class FakeRateLimiter:
+    def __init__(self):
+        self.consumed = []
+
+    def consume(self, num_bytes):
+        self.consumed.append(num_bytes)
+
+class FakeProgress:
+    def __init__(self):
+        self.updates = []
+
+    def update(self, total_bytes):
+        self.updates.append(total_bytes)
+
+def _stream():
+    return youtube.YoutubeStreamData({
+        "id": "abc",
+        "snippet": {"title": "Episode", "publishedAt": "2018-01-01",
+                    "description": ""},
+        "contentDetails": {"duration": "PT1H"}})
+
+def test_progress_hook_shares_rate_limiter():
+    rate_limiter = FakeRateLimiter()
+    progress = FakeProgress()
+    hook = _stream()._progress_hook(progress, rate_limiter)
+
+    for downloaded in [100, 250, 400]:
+        hook({"status": "downloading", "filename": "out.m4a",
+              "downloaded_bytes": downloaded})
+    #a second file starts counting again
+    hook({"status": "downloading", "filename": "out.f2.m4a",
+          "downloaded_bytes": 50})
+    hook({"status": "finished", "filename": "out.f2.m4a",
+          "downloaded_bytes": 80})
+
+    assert rate_limiter.consumed == [100, 150, 150, 50, 30]
+    assert progress.updates == [100, 250, 400, 50, 80]
+
+def test_progress_hook_records_filename():
+    stream = _stream()
+    hook = stream._progress_hook(None, None)
+
+    hook({"status": "finished", "filename": "out.m4a"})
+
+    assert stream.output_filename == "out.m4a"
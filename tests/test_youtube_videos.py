@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from cr_download.configuration import data as config
+from cr_download import youtube
+
+from fake_servers import QuietHandler
+
+@pytest.fixture
+def fake_videos(serve, monkeypatch):
+    """a fake YouTube videos endpoint, which returns each batch's videos
+    in reverse order (leaving out ids in gone), and answers the first
+    batch last
+
+    """
+    class VideosHandler(QuietHandler):
+        batches = []
+        gone = set()
+        lock = threading.Lock()
+
+        def do_GET(self):
+            ids = self.query["id"].split(",")
+            with self.lock:
+                self.batches.append(ids)
+            time.sleep(0.1 if ids[0] == "id0" else 0.01)
+            self.send_json({"items": [
+                {"id": video_id,
+                 "snippet": {"title": "Video {}".format(video_id),
+                             "publishedAt": "2018-01-01T00:00:00Z",
+                             "description": ""},
+                 "contentDetails": {"duration": "PT1H2M3S"}}
+                for video_id in reversed(ids) if video_id not in self.gone]})
+
+    monkeypatch.setattr(config, "youtube_api_url", serve(VideosHandler))
+    monkeypatch.setattr(config, "youtube_api_key", "key")
+    monkeypatch.setattr(config, "download_workers", 4, raising=False)
+    return VideosHandler
+
+@pytest.mark.parametrize("count", [0, 1, 50, 51, 101])
+def test_batches_keep_order(fake_videos, count):
+    ids = ["id{}".format(number) for number in range(count)]
+
+    videos = youtube.get_video_data(ids)
+
+    assert [video.url for video in videos] == [
+        youtube.YOUTUBE_VIDEO_URL + video_id for video_id in ids]
+    assert all(len(batch) <= youtube.MAX_RESULTS_PER_PAGE
+               for batch in fake_videos.batches)
+    assert sorted(video_id for batch in fake_videos.batches
+                  for video_id in batch) == sorted(ids)
+
+def test_missing_videos_left_out(fake_videos):
+    ids = ["id{}".format(number) for number in range(60)]
+    fake_videos.gone = {"id3", "id55"}
+
+    videos = youtube.get_video_data(ids)
+
+    assert [video.json_data["id"] for video in videos] == [
+        video_id for video_id in ids if video_id not in fake_videos.gone]